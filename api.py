@@ -0,0 +1,374 @@
+"""HTTP API for sellers' warehouse systems: the WB and Ozon pipelines without Telegram.
+
+Uploads are streamed into the job workspace and become ordinary jobs of the
+shared queue, processed by the same workers as the bot's (``worker.py`` or a
+bot with ``WORKER_INLINE``). Requests are authorized with a key from the
+``access_keys`` table (the admin panel's access keys), and the fair queue
+treats every key as a separate tenant.
+
+    Authorization: Bearer <key>
+
+    POST   /v1/wb                multipart: excel, pdf (repeat pdf for stickers split over several files)
+    POST   /v1/ozon              multipart: assembly, ticket
+    GET    /v1/jobs/{id}         job status
+    GET    /v1/jobs/{id}/output  the resulting PDF (or labels)
+    DELETE /v1/jobs/{id}         cancel the job
+    GET    /healthz
+
+A POST answers 202 with the job to poll. With ``?wait=<seconds>`` (at most
+``API_MAX_WAIT``) it waits for the job and answers with the PDF itself, or
+with 422 and the job if it failed; if time runs out, it answers 202 as usual.
+Results stay available for ``WORKSPACE_ORPHAN_TTL`` (see ``utils.janitor``).
+``?format=zpl|png|pbm&dpi=203|300`` asks for labels rasterised for a thermal
+printer instead of the PDF (see ``utils.thermal``).
+
+    python api.py
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from functools import partial
+
+from aiohttp import web
+from sqlalchemy import select
+
+from config import (
+    API_HOST,
+    API_KEY_CACHE_TTL,
+    API_MAX_UPLOAD_MB,
+    API_MAX_WAIT,
+    API_METRICS_PORT,
+    API_PORT,
+    API_WORKER_INLINE,
+    JOB_POLL_INTERVAL,
+    METRICS_HOST,
+)
+from database.setup import AccessKey, get_read_session, init_db
+from utils.job_queue import check_admission, enqueue_job, get_job, request_cancel
+from utils.logs import setup_logging, start_rate_refresh
+from utils.metrics import API_REQUESTS, BYTES, STAGE_SECONDS, STARTUP_SECONDS
+from utils.scheduler import QueueFull, estimate_ozon_cost, estimate_wb_cost
+from utils.thermal import DEFAULT_DPI, DPIS, EXTENSIONS, FORMATS, MEDIA_TYPES
+from utils.warmup import process_uptime
+from utils.workspace import new_user_file, remove_job_files, safe_remove
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ('done', 'failed', 'cancelled')
+# Поля multipart каждого пайплайна: имя -> (расширение по умолчанию, допустимые сигнатуры, можно ли несколько)
+_FIELDS = {
+    'wb': {
+        'excel': ('.xlsx', (b'PK', b'\xd0\xcf\x11\xe0'), False),
+        'pdf': ('.pdf', (b'%PDF',), True),
+    },
+    'ozon': {
+        'assembly': ('.pdf', (b'%PDF',), False),
+        'ticket': ('.pdf', (b'%PDF',), False),
+    },
+}
+_dumps = partial(json.dumps, ensure_ascii=False)
+_keys: dict[str, tuple[int, float]] = {}  # Ключ -> (id ключа, до какого времени проверка действительна)
+
+
+def _error(status: int, message: str, **extra) -> web.Response:
+    return web.json_response({'error': message, **extra}, status=status, dumps=_dumps)
+
+
+async def _key_id(request: web.Request) -> int | None:
+    scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not key:
+        return None
+    cached = _keys.get(key)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    async with get_read_session() as session:
+        key_id = await session.scalar(select(AccessKey.id).where(AccessKey.key == key))
+    if key_id is not None:
+        _keys[key] = (key_id, time.monotonic() + API_KEY_CACHE_TTL)
+    else:
+        _keys.pop(key, None)
+    return key_id
+
+
+def _tenant(key_id: int) -> str:
+    return f"api:{key_id}"
+
+
+def _queue_full(exc: QueueFull) -> web.Response:
+    return web.json_response(
+        {'error': "очередь заполнена, повторите позже", 'queued': exc.queued},
+        status=429,
+        headers={'Retry-After': '30'},
+        dumps=_dumps,
+    )
+
+
+@web.middleware
+async def _middleware(request: web.Request, handler):
+    resource = request.match_info.route.resource
+    status = 500
+    try:
+        if request.path.startswith('/v1/'):
+            key_id = await _key_id(request)
+            if key_id is None:
+                status = 401
+                return _error(401, "нужен заголовок Authorization: Bearer <ключ доступа>")
+            request['key_id'] = key_id
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    finally:
+        API_REQUESTS.inc(route=resource.canonical if resource is not None else 'unknown', status=str(status))
+
+
+async def _receive_files(request: web.Request, pipeline: str) -> dict[str, list[str]]:
+    """Stream the multipart files of ``pipeline`` into the workspace; return field -> paths."""
+    fields = _FIELDS[pipeline]
+    owner = f"api-{request['key_id']}"
+    limit, received = API_MAX_UPLOAD_MB * 2**20, 0
+    files: dict[str, list[str]] = {}
+    path = None
+    try:
+        reader = await request.multipart()
+        with STAGE_SECONDS.time(pipeline=pipeline, stage="download"):
+            while (part := await reader.next()) is not None:
+                if part.name not in fields:
+                    await part.release()
+                    continue
+                default_ext, signatures, repeated = fields[part.name]
+                if part.name in files and not repeated:
+                    raise web.HTTPBadRequest(reason=f"поле {part.name} должно быть одно")
+                ext = os.path.splitext(part.filename or '')[1].lower() or default_ext
+                path = new_user_file(owner, f"{part.name}{ext if ext in ('.xlsx', '.xls', '.pdf') else default_ext}")
+                with open(path, 'wb') as fh:
+                    first = True
+                    while chunk := await part.read_chunk(2**20):
+                        if first and not chunk.startswith(signatures):
+                            raise web.HTTPBadRequest(reason=f"поле {part.name}: неверный формат файла")
+                        first = False
+                        received += len(chunk)
+                        if received > limit:
+                            raise web.HTTPRequestEntityTooLarge(max_size=limit, actual_size=received)
+                        fh.write(chunk)
+                if first:
+                    raise web.HTTPBadRequest(reason=f"поле {part.name}: пустой файл")
+                files.setdefault(part.name, []).append(path)
+                path = None
+    except BaseException:
+        safe_remove(path)
+        for paths in files.values():
+            for uploaded in paths:
+                safe_remove(uploaded)
+        raise
+    BYTES.inc(received, pipeline=pipeline, direction="in")
+    return files
+
+
+def _job_json(job) -> dict:
+    data = {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+    }
+    result = job.result or {}
+    if job.status == 'done':
+        data.update(pages=result.get('pages'), articles=result.get('articles'), output=f"/v1/jobs/{job.id}/output")
+    elif job.status == 'failed':
+        data.update(error=result.get('error'), reason=result.get('reason'))
+    return data
+
+
+async def _wait_finished(job_id: int, timeout: float):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        job = await get_job(job_id)
+        remaining = deadline - loop.time()
+        if job is None or job.status in FINISHED or remaining <= 0:
+            return job
+        await asyncio.sleep(min(JOB_POLL_INTERVAL, remaining))
+
+
+def _output_response(job) -> web.StreamResponse:
+    output = (job.result or {}).get('output')
+    if not output or not os.path.exists(output):
+        return _error(410, "результат уже удалён", job=_job_json(job))
+    BYTES.inc(os.path.getsize(output), pipeline=job.kind, direction="out")
+    output_format = job.payload.get('format', 'pdf')
+    return web.FileResponse(
+        output,
+        headers={
+            'Content-Type': MEDIA_TYPES[output_format],
+            'Content-Disposition': f'attachment; filename="{job.kind}_{job.id}{EXTENSIONS[output_format]}"',
+            'X-Job-Id': str(job.id),
+        },
+    )
+
+
+async def _submit(request: web.Request, pipeline: str) -> web.StreamResponse:
+    try:
+        wait = min(float(request.query.get('wait', 0)), API_MAX_WAIT)
+    except ValueError:
+        return _error(400, "wait — число секунд")
+    output_format = request.query.get('format', 'pdf')
+    if output_format not in FORMATS:
+        return _error(400, f"format — одно из: {', '.join(FORMATS)}")
+    try:
+        dpi = int(request.query.get('dpi', DEFAULT_DPI))
+    except ValueError:
+        dpi = None
+    if dpi not in DPIS:
+        return _error(400, f"dpi — одно из: {', '.join(map(str, DPIS))}")
+    if not request.content_type.startswith('multipart/'):
+        return _error(400, "файлы передаются как multipart/form-data")
+    tenant = _tenant(request['key_id'])
+    try:
+        # Отказ до приёма файлов: клиент не тратит время на загрузку
+        await check_admission(tenant)
+    except QueueFull as exc:
+        return _queue_full(exc)
+
+    try:
+        files = await _receive_files(request, pipeline)
+    except web.HTTPRequestEntityTooLarge:
+        return _error(413, f"файлы больше {API_MAX_UPLOAD_MB} МБ")
+    except web.HTTPBadRequest as exc:
+        return _error(400, exc.reason)
+
+    missing = [name for name in _FIELDS[pipeline] if name not in files]
+    if missing:
+        for paths in files.values():
+            for path in paths:
+                safe_remove(path)
+        return _error(400, f"не хватает полей: {', '.join(missing)}")
+
+    if pipeline == 'wb':
+        pdfs = files['pdf']
+        inputs = {'excel': files['excel'][0], 'pdf': pdfs[0]}
+        inputs.update({f'pdf_{n}': path for n, path in enumerate(pdfs[1:], start=2)})
+        cost = await asyncio.to_thread(estimate_wb_cost, inputs['excel'], pdfs)
+    else:
+        inputs = {'assembly': files['assembly'][0], 'ticket': files['ticket'][0]}
+        cost = await asyncio.to_thread(estimate_ozon_cost, inputs['ticket'])
+    payload = {'inputs': inputs, 'output_name': f"{pipeline}_result{EXTENSIONS[output_format]}"}
+    if output_format != 'pdf':
+        payload.update(format=output_format, dpi=dpi)
+    try:
+        enqueued = await enqueue_job(
+            pipeline,
+            payload,
+            tenant=tenant,
+            cost=cost,
+        )
+    except QueueFull as exc:
+        remove_job_files(None, {'inputs': inputs})
+        return _queue_full(exc)
+
+    job = await _wait_finished(enqueued.job_id, wait) if wait > 0 else None
+    if job is not None and job.status == 'done':
+        return _output_response(job)
+    if job is not None and job.status in FINISHED:
+        return web.json_response(_job_json(job), status=422, dumps=_dumps)
+    body = _job_json(job) if job is not None else {'id': enqueued.job_id, 'kind': pipeline, 'status': 'queued'}
+    body['position'] = enqueued.position
+    return web.json_response(body, status=202, headers={'Location': f"/v1/jobs/{enqueued.job_id}"}, dumps=_dumps)
+
+
+async def submit_wb(request: web.Request) -> web.StreamResponse:
+    return await _submit(request, 'wb')
+
+
+async def submit_ozon(request: web.Request) -> web.StreamResponse:
+    return await _submit(request, 'ozon')
+
+
+async def _own_job(request: web.Request):
+    try:
+        job = await get_job(int(request.match_info['job_id']))
+    except ValueError:
+        return None
+    # Чужая задача выглядит так же, как несуществующая
+    return job if job is not None and job.tenant == _tenant(request['key_id']) else None
+
+
+async def job_status(request: web.Request) -> web.Response:
+    job = await _own_job(request)
+    if job is None:
+        return _error(404, "задача не найдена")
+    return web.json_response(_job_json(job), dumps=_dumps)
+
+
+async def job_output(request: web.Request) -> web.StreamResponse:
+    job = await _own_job(request)
+    if job is None:
+        return _error(404, "задача не найдена")
+    if job.status != 'done':
+        return _error(409, "результата нет", job=_job_json(job))
+    return _output_response(job)
+
+
+async def cancel_job(request: web.Request) -> web.Response:
+    job = await _own_job(request)
+    if job is None:
+        return _error(404, "задача не найдена")
+    status, payload = await request_cancel(job.id, job.user_id)
+    if status == 'cancelled':
+        # Задача ещё не начиналась — файлы удаляем сами, воркер её уже не увидит
+        remove_job_files(job.id, payload)
+    return web.json_response({'id': job.id, 'status': status}, dumps=_dumps)
+
+
+async def health(_request: web.Request) -> web.Response:
+    return web.json_response({'status': 'ok'}, dumps=_dumps)
+
+
+def create_app() -> web.Application:
+    app = web.Application(middlewares=[_middleware])
+    app.router.add_post('/v1/wb', submit_wb)
+    app.router.add_post('/v1/ozon', submit_ozon)
+    app.router.add_get('/v1/jobs/{job_id}', job_status)
+    app.router.add_get('/v1/jobs/{job_id}/output', job_output)
+    app.router.add_delete('/v1/jobs/{job_id}', cancel_job)
+    app.router.add_get('/healthz', health)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+async def _on_startup(app: web.Application) -> None:
+    await init_db()
+    start_rate_refresh()
+    if API_METRICS_PORT:
+        from utils.metrics import start_metrics_server
+
+        app['metrics_runner'] = await start_metrics_server(API_METRICS_PORT, METRICS_HOST)
+    if API_WORKER_INLINE:
+        from utils.job_worker import JobWorker
+
+        app['worker'] = JobWorker()
+        app['worker_task'] = await app['worker'].start()
+    STARTUP_SECONDS.set(process_uptime(), process="api")
+    logger.info("HTTP API слушает %s:%s", API_HOST, API_PORT)
+
+
+async def _on_cleanup(app: web.Application) -> None:
+    if 'worker' in app:
+        # Воркер дожидается текущих задач, новые не берёт
+        app['worker'].stop()
+        await app['worker_task']
+    if 'metrics_runner' in app:
+        await app['metrics_runner'].cleanup()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    web.run_app(create_app(), host=API_HOST, port=API_PORT, print=None)
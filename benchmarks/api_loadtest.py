@@ -0,0 +1,232 @@
+"""Load test of the HTTP API (``api.py``): N clients submitting WB and Ozon jobs at once.
+
+Launches ``api.py`` with an inline worker against a throwaway SQLite database
+and workspace, gives every client its own access key (a separate tenant of the
+fair queue) and lets it upload the synthetic files and get the PDF, either in
+one request (``--mode wait``) or by polling the job (``--mode poll``). Nothing
+leaves the machine.
+
+    python -m benchmarks.api_loadtest --clients 20 --flows 3 --pages 100 --out api_load.json
+
+Reported as in ``benchmarks.loadtest``: completed flows per second, latency
+percentiles per step, error and rejection (429) rates.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, ClientTimeout, FormData
+
+from benchmarks.fixtures import make_ozon_fixture, make_wb_fixture
+from benchmarks.loadtest import ROOT, FlowError, Stats, print_report
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Client:
+    def __init__(self, session: ClientSession, base_url: str, key: str, files: dict, stats: Stats, args):
+        self.session = session
+        self.base_url = base_url
+        self.headers = {"Authorization": f"Bearer {key}"}
+        self.files = files
+        self.stats = stats
+        self.mode = args.mode
+        self.timeout = args.timeout
+
+    def _form(self, pipeline: str) -> FormData:
+        form = FormData()
+        if pipeline == "wb":
+            excel, pdf = self.files["wb"]
+            form.add_field("excel", open(excel, "rb"), filename="pick_list.xlsx", content_type=XLSX_MIME)
+            form.add_field("pdf", open(pdf, "rb"), filename="stickers.pdf", content_type="application/pdf")
+        else:
+            assembly, ticket = self.files["ozon"]
+            form.add_field("assembly", open(assembly, "rb"), filename="assembly.pdf", content_type="application/pdf")
+            form.add_field("ticket", open(ticket, "rb"), filename="ticket.pdf", content_type="application/pdf")
+        return form
+
+    async def _read_result(self, response, step: str, started: float) -> None:
+        body = await response.read()
+        if response.status != 200 or not body.startswith(b"%PDF"):
+            raise FlowError("bad_result", f"{response.status} {body[:80]!r}")
+        self.stats.observe(step, time.perf_counter() - started)
+
+    async def run_flow(self, pipeline: str) -> None:
+        started = time.perf_counter()
+        wait = f"?wait={self.timeout}" if self.mode == "wait" else ""
+        async with self.session.post(f"{self.base_url}/v1/{pipeline}{wait}", data=self._form(pipeline),
+                                     headers=self.headers) as response:
+            if response.status == 429:
+                raise FlowError("rejected", "429")
+            if response.status == 200:
+                await self._read_result(response, f"{pipeline}.result", started)
+                return
+            job = await response.json()
+            if response.status != 202:
+                raise FlowError("bot_error", f"{response.status} {job.get('error') or job.get('status')}")
+        self.stats.observe(f"{pipeline}.accepted", time.perf_counter() - started)
+
+        deadline = started + self.timeout
+        while time.perf_counter() < deadline:
+            async with self.session.get(f"{self.base_url}/v1/jobs/{job['id']}", headers=self.headers) as response:
+                job = await response.json()
+            if job["status"] == "done":
+                break
+            if job["status"] in ("failed", "cancelled"):
+                raise FlowError("bot_error", f"{job['status']} {job.get('error')}")
+            await asyncio.sleep(0.2)
+        else:
+            raise FlowError("timeout", f"{pipeline}.result")
+        async with self.session.get(f"{self.base_url}{job['output']}", headers=self.headers) as response:
+            await self._read_result(response, f"{pipeline}.result", started)
+
+    async def run(self, flows: int, pipelines: list[str], rng: random.Random) -> None:
+        for _ in range(flows):
+            pipeline = rng.choice(pipelines)
+            started = time.perf_counter()
+            try:
+                await self.run_flow(pipeline)
+            except FlowError as exc:
+                if exc.kind == "rejected":
+                    self.stats.rejected += 1
+                else:
+                    self.stats.failed += 1
+                self.stats.errors[f"{pipeline}.{exc}"] = self.stats.errors.get(f"{pipeline}.{exc}", 0) + 1
+            else:
+                self.stats.completed += 1
+                self.stats.observe(f"{pipeline}.flow", time.perf_counter() - started)
+
+
+def _api_env(workdir: str, port: int, extra: list[str]) -> dict:
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'api_load.db')}",
+        "JOB_WORKSPACE": os.path.join(workdir, "workspace"),
+        "API_HOST": "127.0.0.1",
+        "API_PORT": str(port),
+        "API_WORKER_INLINE": "1",
+        "PYTHONUNBUFFERED": "1",
+    }
+    for item in extra:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+def _create_keys(database: str, count: int) -> list[str]:
+    keys = [secrets.token_urlsafe(16) for _ in range(count)]
+    with sqlite3.connect(database) as conn:
+        conn.executemany("INSERT INTO access_keys (key, used) VALUES (?, 0)", [(key,) for key in keys])
+    return keys
+
+
+async def _wait_healthy(session: ClientSession, base_url: str, service: subprocess.Popen, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if service.poll() is not None:
+            raise RuntimeError(f"api.py завершился с кодом {service.returncode}")
+        try:
+            async with session.get(f"{base_url}/healthz") as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("api.py не запустился вовремя")
+
+
+async def run_load(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="wb_stickers_api_load_")
+    fixtures = os.path.join(args.workdir, "fixtures")
+    files = {}
+    if "wb" in args.pipelines:
+        files["wb"] = make_wb_fixture(fixtures, args.pages, args.articles)
+    if "ozon" in args.pipelines:
+        files["ozon"] = make_ozon_fixture(fixtures, args.pages, args.articles)
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    log = open(os.path.join(workdir, "api.log"), "wb")
+    service = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "api.py")],
+        cwd=ROOT, env=_api_env(workdir, port, args.env), stdout=log, stderr=subprocess.STDOUT,
+    )
+    print(f"API запущен (pid {service.pid}), лог: {log.name}", file=sys.stderr)
+
+    try:
+        async with ClientSession(timeout=ClientTimeout(total=args.timeout + 30)) as session:
+            await _wait_healthy(session, base_url, service, args.startup_timeout)
+            keys = _create_keys(os.path.join(workdir, "api_load.db"), args.clients)
+            stats = Stats()
+            rng = random.Random(args.seed)
+            clients = [Client(session, base_url, key, files, stats, args) for key in keys]
+
+            async def start(client: Client, delay: float) -> None:
+                await asyncio.sleep(delay)
+                await client.run(args.flows, args.pipelines, random.Random(rng.random()))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                start(client, args.ramp * index / max(1, args.clients)) for index, client in enumerate(clients)
+            ))
+            report = stats.summary(time.perf_counter() - started)
+        report["params"] = {
+            key: getattr(args, key)
+            for key in ("clients", "flows", "mode", "pipelines", "pages", "articles", "ramp", "env")
+        }
+        return report
+    finally:
+        service.send_signal(signal.SIGINT)
+        try:
+            service.wait(30)
+        except subprocess.TimeoutExpired:
+            service.kill()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест HTTP API на локальной машине.")
+    parser.add_argument("--clients", type=int, default=20, help="Одновременных клиентов, у каждого свой ключ.")
+    parser.add_argument("--flows", type=int, default=1, help="Задач на клиента.")
+    parser.add_argument("--mode", choices=("wait", "poll"), default="wait",
+                        help="wait — результат в ответе на загрузку, poll — опрос статуса задачи.")
+    parser.add_argument("--pipelines", nargs="+", choices=("wb", "ozon"), default=["wb", "ozon"])
+    parser.add_argument("--pages", type=int, default=100, help="Страниц в синтетических файлах.")
+    parser.add_argument("--articles", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=5.0, help="За сколько секунд подключаются все клиенты.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Ожидание результата задачи, сек.")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="Доп. переменные окружения api.py.")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "wb_stickers_bench"))
+    parser.add_argument("--out", help="Файл для JSON с результатами.")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load(args))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""Performance regression gate against the stored benchmark baseline.
+
+Runs the benchmark suite (or reads a results file), reduces every stage to the
+median of its runs and compares it with ``benchmarks/baseline.json``. A stage
+regresses when its median exceeds the baseline by more than the stage's
+relative tolerance *and* by more than the noise floor (an absolute minimum or
+three baseline MADs, whichever is larger). Exit code is 1 on any regression
+and on any baseline case, stage or metric missing from the current run.
+
+    python -m benchmarks.compare --repeat 5              # проверить
+    python -m benchmarks.compare --repeat 5 --update     # записать новый baseline
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+
+from benchmarks.run import PIPELINES, environment, run_suite
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Относительный допуск и абсолютный порог шума по метрикам
+DEFAULT_TOLERANCES = {
+    "wall": {"relative": 0.15, "absolute": 0.02},
+    "peak_rss_mb": {"relative": 0.10, "absolute": 5.0},
+}
+# Для отдельных стадий допуск можно переопределить в baseline.json -> "tolerances"
+GATED_STAGES = ("extract", "order", "overlay", "save", "write", "total")
+
+
+def _mad(values: list[float]) -> float:
+    median = statistics.median(values)
+    return statistics.median(abs(v - median) for v in values)
+
+
+def summarize(report: dict) -> dict:
+    """Reduce raw runs to {case: {stage: {metric: {median, mad, n}}}}."""
+    cases = {}
+    for result in report["results"]:
+        stages: dict[str, dict[str, list[float]]] = {}
+        for run in result["runs"]:
+            for name, metrics in {**run["stages"], "total": run["total"]}.items():
+                for metric, value in metrics.items():
+                    stages.setdefault(name, {}).setdefault(metric, []).append(value)
+        cases[result["case"]] = {
+            name: {
+                metric: {"median": statistics.median(values), "mad": _mad(values), "n": len(values)}
+                for metric, values in metrics.items()
+            }
+            for name, metrics in stages.items()
+        }
+    return cases
+
+
+def _tolerance(tolerances: dict, stage: str, metric: str) -> dict:
+    override = tolerances.get(stage, {}).get(metric, {})
+    return {**DEFAULT_TOLERANCES[metric], **override}
+
+
+def compare(baseline: dict, current: dict) -> list[dict]:
+    """Return one row per gated (case, stage, metric) of the baseline.
+
+    A case, stage or metric the current run lacks gets a ``missing`` row: a
+    benchmark that stopped reporting must not pass the gate silently.
+    """
+    rows = []
+    tolerances = baseline.get("tolerances", {})
+    for case, stages in sorted(baseline["cases"].items()):
+        for stage in GATED_STAGES:
+            for metric in DEFAULT_TOLERANCES:
+                base = stages.get(stage, {}).get(metric)
+                if base is None:
+                    continue
+                new = current.get(case, {}).get(stage, {}).get(metric)
+                row = {"case": case, "stage": stage, "metric": metric, "base": base["median"]}
+                if new is None:
+                    rows.append({**row, "new": None, "change": None, "regressed": False, "missing": True})
+                    continue
+                tolerance = _tolerance(tolerances, stage, metric)
+                delta = new["median"] - base["median"]
+                noise = max(tolerance["absolute"], 3 * base["mad"])
+                limit = base["median"] * tolerance["relative"]
+                regressed = delta > limit and delta > noise
+                rows.append({
+                    **row,
+                    "new": new["median"],
+                    "change": delta / base["median"] if base["median"] else 0.0,
+                    "regressed": regressed,
+                    "missing": False,
+                })
+    return rows
+
+
+def print_table(rows: list[dict], out=sys.stdout) -> None:
+    header = f"{'case':<22} {'stage':<9} {'metric':<12} {'baseline':>10} {'current':>10} {'change':>8}  status"
+    print(header, file=out)
+    print("-" * len(header), file=out)
+    for row in rows:
+        if row["missing"]:
+            print(
+                f"{row['case']:<22} {row['stage']:<9} {row['metric']:<12} "
+                f"{row['base']:>10.3f} {'—':>10} {'':>8}  MISSING",
+                file=out,
+            )
+            continue
+        status = "REGRESSION" if row["regressed"] else "ok"
+        print(
+            f"{row['case']:<22} {row['stage']:<9} {row['metric']:<12} "
+            f"{row['base']:>10.3f} {row['new']:>10.3f} {row['change']:>+7.1%}  {status}",
+            file=out,
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Проверка регрессий производительности.")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--results", help="Готовый JSON из benchmarks.run вместо нового прогона.")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000])
+    parser.add_argument("--articles", nargs="+", type=int, default=[10, 100])
+    parser.add_argument("--repeat", type=int, default=5, help="Запусков на случай; сравниваются медианы.")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "wb_stickers_bench"))
+    parser.add_argument("--update", action="store_true", help="Перезаписать baseline текущими результатами.")
+    args = parser.parse_args(argv)
+
+    if args.results:
+        with open(args.results, encoding="utf-8") as fh:
+            report = json.load(fh)
+    else:
+        report = run_suite(args.pipelines, args.sizes, args.articles, args.repeat, args.workdir)
+    current = summarize(report)
+
+    if args.update:
+        previous = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as fh:
+                previous = json.load(fh)
+        baseline = {
+            "meta": report.get("meta") or environment(),
+            "tolerances": previous.get("tolerances", {}),
+            "cases": current,
+        }
+        with open(args.baseline, "w", encoding="utf-8") as fh:
+            json.dump(baseline, fh, ensure_ascii=False, indent=2)
+        print(f"Baseline записан: {args.baseline}", file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Нет baseline {args.baseline}; создайте его с --update на эталонной машине.", file=sys.stderr)
+        return 2
+    with open(args.baseline, encoding="utf-8") as fh:
+        baseline = json.load(fh)
+
+    rows = compare(baseline, current)
+    print_table(rows)
+    regressions = [row for row in rows if row["regressed"]]
+    missing = [row for row in rows if row["missing"]]
+    if regressions:
+        print(f"\nРегрессий: {len(regressions)}", file=sys.stderr)
+    if missing:
+        # Случай из baseline не прогнан (другие --pipelines/--sizes) или стадия перестала замеряться
+        print(f"\nНет в текущем прогоне: {len(missing)}", file=sys.stderr)
+    return 1 if regressions or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""Local stand-in for the Telegram Bot API used by the load test.
+
+Implements what the bot calls: getMe, getUpdates (long polling), getFile and
+file downloads, sendMessage, sendDocument, sendPhoto, editMessage*,
+answerCallbackQuery, deleteMessage, setMyCommands, getWebhookInfo and deleteWebhook. Unknown
+methods answer ``{"ok": true, "result": true}``. Updates are injected with
+``push_update``; every call the bot makes for a chat is published to that
+chat's event queue, so simulated users can wait for the bot's answers.
+
+The bot is pointed here with ``TELEGRAM_API_SERVER=http://127.0.0.1:<port>``.
+
+With ``files_dir`` it behaves like a server started with ``--local``: added
+files are placed in that directory, ``getFile`` returns their absolute paths
+and uploads are accepted up to 2000 MB (run the bot with
+``TELEGRAM_API_LOCAL=1``).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import shutil
+import time
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "LoadTestBot", "username": "load_test_bot"}
+
+
+@dataclass
+class BotEvent:
+    method: str
+    params: dict
+    at: float = field(default_factory=time.perf_counter)
+    size: int = 0  # Размер загруженного файла для sendDocument/sendPhoto
+
+    @property
+    def text(self) -> str:
+        return str(self.params.get("text") or self.params.get("caption") or "")
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, files_dir: str | None = None):
+        self.host = host
+        self.port = port
+        self.files_dir = os.path.abspath(files_dir) if files_dir else None
+        self._updates: list[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_update = asyncio.Event()
+        self._files: dict[str, str] = {}
+        self._chats: dict[int, asyncio.Queue[BotEvent]] = {}
+        self.calls: dict[str, int] = {}
+        self.polling = asyncio.Event()  # Бот начал long polling
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        app = web.Application(client_max_size=(2000 if self.files_dir else 64) * 2**20)
+        app.router.add_route("*", "/bot{token}/{method}", self._handle_method)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._handle_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    # --- Управление со стороны теста ---
+
+    def events(self, chat_id: int) -> asyncio.Queue[BotEvent]:
+        return self._chats.setdefault(chat_id, asyncio.Queue())
+
+    def add_file(self, path: str) -> tuple[str, int]:
+        """Register a local file for getFile; return (file_id, size)."""
+        file_id = f"f{len(self._files)}_{os.path.basename(path)}"
+        if self.files_dir:
+            # Как у сервера с --local: файл лежит в его каталоге, getFile отдаёт абсолютный путь
+            stored = os.path.join(self.files_dir, "documents", file_id)
+            os.makedirs(os.path.dirname(stored), exist_ok=True)
+            try:
+                os.link(path, stored)
+            except OSError:
+                shutil.copyfile(path, stored)
+            path = stored
+        self._files[file_id] = path
+        return file_id, os.path.getsize(path)
+
+    def push_update(self, update: dict) -> int:
+        update_id = next(self._update_ids)
+        self._updates.append({"update_id": update_id, **update})
+        self._new_update.set()
+        return update_id
+
+    # --- Bot API ---
+
+    async def _params(self, request: web.Request) -> tuple[dict, int]:
+        params = dict(request.query)
+        size = 0
+        if request.content_type == "application/json":
+            params.update(await request.json())
+        elif request.content_type == "multipart/form-data":
+            reader = await request.multipart()
+            async for part in reader:
+                if part.filename:
+                    while chunk := await part.read_chunk(2**16):
+                        size += len(chunk)
+                    params[part.name] = part.filename
+                else:
+                    params[part.name] = await part.text()
+        elif request.can_read_body:
+            params.update(await request.post())
+        for key in ("chat_id", "message_id", "offset", "timeout", "limit"):
+            if key in params and isinstance(params[key], str) and params[key].lstrip("-").isdigit():
+                params[key] = int(params[key])
+        return params, size
+
+    def _message(self, chat_id, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **fields,
+        }
+
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params, size = await self._params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method == "getMe":
+            result = BOT_USER
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        elif method == "getFile":
+            path = self._files.get(params.get("file_id"))
+            if path is None:
+                return web.json_response({"ok": False, "error_code": 400, "description": "Bad Request: invalid file_id"})
+            result = {
+                "file_id": params["file_id"],
+                "file_unique_id": params["file_id"],
+                "file_size": os.path.getsize(path),
+                "file_path": path if self.files_dir else params["file_id"],
+            }
+        elif method in ("sendMessage", "sendDocument", "sendPhoto"):
+            chat_id = params.get("chat_id")
+            fields = {"text": params.get("text")} if method == "sendMessage" else {"caption": params.get("caption")}
+            if method == "sendDocument":
+                fields["document"] = {"file_id": f"out{next(self._message_ids)}", "file_unique_id": "out",
+                                      "file_name": str(params.get("document")), "file_size": size}
+            if method == "sendPhoto":
+                fields["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 1, "height": 1}]
+            result = self._message(chat_id, **{k: v for k, v in fields.items() if v is not None})
+            self._publish(chat_id, BotEvent(method, params, size=size))
+        elif method.startswith("editMessage"):
+            chat_id = params.get("chat_id")
+            result = self._message(chat_id, text=params.get("text") or "")
+            self._publish(chat_id, BotEvent(method, params))
+        else:
+            result = True
+            if "chat_id" in params:
+                self._publish(params["chat_id"], BotEvent(method, params))
+        return web.json_response({"ok": True, "result": result})
+
+    def _publish(self, chat_id, event: BotEvent) -> None:
+        if isinstance(chat_id, int):
+            self.events(chat_id).put_nowait(event)
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = params.get("offset") or 0
+        if offset < 0:
+            # skip_updates: бот спрашивает только последний апдейт
+            return self._updates[-1:]
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        self.polling.set()
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = params.get("limit") or 100
+        return self._updates[:limit]
+
+    async def _handle_file(self, request: web.Request) -> web.StreamResponse:
+        path = self._files.get(request.match_info["path"])
+        if path is None:
+            raise web.HTTPNotFound()
+        return web.FileResponse(path)
+
+
+def user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"Seller {user_id}", "username": f"seller{user_id}"}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    return {
+        "callback_query": {
+            "id": str(user_id * 1000 + int(time.time() * 1000) % 1000),
+            "from": user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "menu",
+            },
+        }
+    }
+
+
+def document_update(user_id: int, file_id: str, file_name: str, mime_type: str, size: int) -> dict:
+    return {
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user(user_id),
+            "document": {
+                "file_id": file_id,
+                "file_unique_id": file_id,
+                "file_name": file_name,
+                "mime_type": mime_type,
+                "file_size": size,
+            },
+        }
+    }
+
@@ -0,0 +1,125 @@
+"""Synthetic WB and Ozon inputs for the benchmark suite.
+
+The generated files mimic what the marketplaces export closely enough for the
+pipelines: WB stickers carry the "WB" mark, a vector barcode and a two-part
+sticker number, the pick list has the usual eight columns; Ozon assembly
+sheets have the column header on the first page and ticket PDFs have two
+pages per shipment. Output is deterministic for a given seed.
+"""
+
+from __future__ import annotations
+
+import os
+import random
+
+import fitz  # PyMuPDF
+from openpyxl import Workbook
+
+from config import FONT_PATH
+
+MM = 72 / 25.4
+WB_PAGE = (58 * MM, 40 * MM)
+OZON_TICKET_PAGE = (75 * MM, 120 * MM)
+A4 = (595, 842)
+
+PICK_LIST_COLUMNS = ['Номер задания', 'Фото', 'Бренд', 'Наименование', 'Размер', 'Цвет', 'Артикул', 'Стикер']
+ASSEMBLY_COLUMNS = [("№", 30), ("Номер отправления", 60), ("Фото", 190), ("Товар", 240),
+                    ("Артикул", 370), ("Кол-во", 480), ("Этикетка", 530)]
+ASSEMBLY_ROWS_PER_PAGE = 30
+
+
+def _draw_barcode(page: fitz.Page, rect: fitz.Rect, rng: random.Random) -> None:
+    x = rect.x0
+    shape = page.new_shape()
+    while x < rect.x1:
+        width = rng.choice((0.6, 1.2, 1.8))
+        shape.draw_rect(fitz.Rect(x, rect.y0, x + width, rect.y1))
+        x += width + rng.choice((0.6, 1.2))
+    shape.finish(color=None, fill=(0, 0, 0))
+    shape.commit()
+
+
+def wb_sticker_number(index: int) -> str:
+    return f"{10_000_000 + index} {1000 + (index * 7919) % 9000}"
+
+
+def make_wb_fixture(directory: str, pages: int, articles: int, seed: int = 0) -> tuple[str, str]:
+    """Write a WB sticker PDF and its pick list; return (excel_path, pdf_path)."""
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"wb_{pages}p_{articles}a_s{seed}")
+    excel_path, pdf_path = f"{base}.xlsx", f"{base}.pdf"
+    if os.path.exists(excel_path) and os.path.exists(pdf_path):
+        return excel_path, pdf_path
+
+    rng = random.Random(seed)
+    stickers = [wb_sticker_number(i) for i in range(pages)]
+    article_of = {sticker: f"ART-{rng.randrange(articles):05d}" for sticker in stickers}
+
+    doc = fitz.open()
+    page_order = stickers[:]
+    rng.shuffle(page_order)
+    width, height = WB_PAGE
+    for sticker in page_order:
+        page = doc.new_page(width=width, height=height)
+        _draw_barcode(page, fitz.Rect(24, 8, width - 8, 60), rng)
+        page.insert_text((6, 70), "WB", fontsize=14)
+        page.insert_text((30, 100), sticker, fontsize=16)
+    doc.save(pdf_path, garbage=3, deflate=True)
+    doc.close()
+
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["Лист подбора"])
+    sheet.append(PICK_LIST_COLUMNS)
+    rows = stickers[:]
+    rng.shuffle(rows)
+    for task_id, sticker in enumerate(rows, start=1):
+        article = article_of[sticker]
+        sheet.append([task_id, "", "Brand", f"Товар {article}", "M", "черный", article, sticker])
+    workbook.save(excel_path)
+    return excel_path, pdf_path
+
+
+def ozon_shipment_number(index: int) -> str:
+    return f"{50_000_000 + index // 3}-{index % 3 + 1:04d}-1"
+
+
+def make_ozon_fixture(directory: str, pages: int, articles: int, seed: int = 0) -> tuple[str, str]:
+    """Write an Ozon assembly sheet and ticket PDF (two pages per shipment); return their paths."""
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"ozon_{pages}p_{articles}a_s{seed}")
+    assembly_path, ticket_path = f"{base}_assembly.pdf", f"{base}_ticket.pdf"
+    if os.path.exists(assembly_path) and os.path.exists(ticket_path):
+        return assembly_path, ticket_path
+
+    rng = random.Random(seed)
+    shipments = [ozon_shipment_number(i) for i in range(max(1, pages // 2))]
+    article_of = {ship: f"OZ-{rng.randrange(articles):05d}" for ship in shipments}
+
+    assembly = fitz.open()
+    for start in range(0, len(shipments), ASSEMBLY_ROWS_PER_PAGE):
+        page = assembly.new_page(width=A4[0], height=A4[1])
+        for title, x in ASSEMBLY_COLUMNS:
+            page.insert_text((x, 60), title, fontsize=8, fontname="dejavu", fontfile=FONT_PATH)
+        for row, ship in enumerate(shipments[start:start + ASSEMBLY_ROWS_PER_PAGE]):
+            y = 90 + row * 24
+            values = [(30, str(start + row + 1)), (60, ship), (240, "Товар"), (370, article_of[ship]), (480, "1")]
+            for x, value in values:
+                page.insert_text((x, y), value, fontsize=8, fontname="dejavu", fontfile=FONT_PATH)
+    assembly.save(assembly_path, garbage=3, deflate=True)
+    assembly.close()
+
+    ticket = fitz.open()
+    order = shipments[:]
+    rng.shuffle(order)
+    width, height = OZON_TICKET_PAGE
+    for ship in order:
+        barcode_page = ticket.new_page(width=width, height=height)
+        _draw_barcode(barcode_page, fitz.Rect(16, 40, width - 16, 200), rng)
+        barcode_page.insert_text((16, 230), ship, fontsize=12)
+        card = ticket.new_page(width=width, height=height)
+        card.insert_text((16, 40), ship, fontsize=12)
+        card.insert_text((16, 70), article_of[ship], fontsize=10)
+    ticket.save(ticket_path, garbage=3, deflate=True)
+    ticket.close()
+    return assembly_path, ticket_path
@@ -0,0 +1,295 @@
+"""Load test: N simulated sellers walking the WB and Ozon flows at once.
+
+Starts the fake Bot API (``benchmarks.fake_bot_api``), launches ``main.py``
+against it with a throwaway SQLite database and workspace, and lets every
+simulated user press the button, upload the synthetic files and wait for the
+document. Nothing leaves the machine.
+
+    python -m benchmarks.loadtest --users 200 --flows 2 --pages 100 --out load.json
+
+Reported: completed flows per second, latency percentiles from each update to
+the bot's answer (per step), error and rejection rates, Bot API call counts.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fake_bot_api import FakeBotAPI, callback_update, document_update
+from benchmarks.fixtures import make_ozon_fixture, make_wb_fixture
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIRST_USER_ID = 10_000
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Признаки ответов бота: очередь переполнена и ошибка обработки
+QUEUE_FULL_MARKERS = ("очередь обработки заполнена", "файла в очереди")
+ERROR_MARKERS = ("Пожалуйста", "ошибка", "Не удалось", "превышает", "слишком большой")
+
+
+class FlowError(Exception):
+    def __init__(self, kind: str, detail: str = ""):
+        super().__init__(f"{kind}: {detail}")
+        self.kind = kind
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def observe(self, step: str, seconds: float) -> None:
+        self.latencies.setdefault(step, []).append(seconds)
+
+    def summary(self, wall: float) -> dict:
+        flows = self.completed + self.rejected + self.failed
+        return {
+            "flows": flows,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "error_rate": self.failed / flows if flows else 0.0,
+            "rejection_rate": self.rejected / flows if flows else 0.0,
+            "wall_seconds": wall,
+            "throughput_flows_per_s": self.completed / wall if wall else 0.0,
+            "latency": {step: _percentiles(values) for step, values in sorted(self.latencies.items())},
+            "errors": self.errors,
+        }
+
+
+def _percentiles(values: list[float]) -> dict:
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+    }
+
+
+class SimulatedUser:
+    def __init__(self, api: FakeBotAPI, user_id: int, files: dict, stats: Stats, timeout: float):
+        self.api = api
+        self.user_id = user_id
+        self.files = files
+        self.stats = stats
+        self.timeout = timeout
+        self.events = api.events(user_id)
+
+    async def _send(self, update: dict) -> float:
+        # Ответы на предыдущие шаги (снятие клавиатур и т.п.) к этому шагу не относятся
+        while not self.events.empty():
+            self.events.get_nowait()
+        self.api.push_update(update)
+        return time.perf_counter()
+
+    async def _expect(self, sent: float, step: str, predicate, timeout: float | None = None, first=True) -> None:
+        """Wait for the bot's message matching ``predicate``; record the latency of the step.
+
+        With ``first`` the time to the bot's first reaction of any kind is recorded too.
+        """
+        deadline = sent + (timeout or self.timeout)
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise FlowError("timeout", step)
+            try:
+                event = await asyncio.wait_for(self.events.get(), remaining)
+            except asyncio.TimeoutError:
+                raise FlowError("timeout", step) from None
+            if first:
+                self.stats.observe(f"{step}.first_response", event.at - sent)
+                first = False
+            if event.method not in ("sendMessage", "sendDocument"):
+                continue
+            if predicate(event):
+                self.stats.observe(step, event.at - sent)
+                return
+            if any(marker in event.text for marker in QUEUE_FULL_MARKERS):
+                raise FlowError("rejected", event.text[:80])
+            if any(marker in event.text for marker in ERROR_MARKERS):
+                raise FlowError("bot_error", event.text[:80])
+
+    def _document(self, key: str, name: str, mime: str) -> dict:
+        file_id, size = self.files[key]
+        return document_update(self.user_id, file_id, name, mime, size)
+
+    async def run_wb(self) -> None:
+        sent = await self._send(callback_update(self.user_id, "process_orders_wb"))
+        await self._expect(sent, "wb.button", lambda e: "1️⃣" in e.text)
+        sent = await self._send(self._document("wb_excel", "pick_list.xlsx", XLSX_MIME))
+        await self._expect(sent, "wb.excel", lambda e: "2️⃣" in e.text)
+        sent = await self._send(self._document("wb_pdf", "stickers.pdf", "application/pdf"))
+        await self._expect(sent, "wb.pdf_ack", lambda e: "Готово" in e.text)
+        sent = await self._send(callback_update(self.user_id, "wb_pdfs_done"))
+        await self._expect(sent, "wb.done_ack", lambda e: "подожди" in e.text)
+        await self._expect(sent, "wb.result", lambda e: e.method == "sendDocument",
+                           timeout=self.timeout * 10, first=False)
+
+    async def run_ozon(self) -> None:
+        sent = await self._send(callback_update(self.user_id, "process_orders_ozon"))
+        await self._expect(sent, "ozon.button", lambda e: "1️⃣" in e.text)
+        sent = await self._send(self._document("ozon_assembly", "assembly.pdf", "application/pdf"))
+        await self._expect(sent, "ozon.assembly", lambda e: "2️⃣" in e.text)
+        sent = await self._send(self._document("ozon_ticket", "ticket.pdf", "application/pdf"))
+        await self._expect(sent, "ozon.ticket_ack", lambda e: "подожди" in e.text)
+        await self._expect(sent, "ozon.result", lambda e: e.method == "sendDocument",
+                           timeout=self.timeout * 10, first=False)
+
+    async def run(self, flows: int, pipelines: list[str], rng: random.Random) -> None:
+        for _ in range(flows):
+            pipeline = rng.choice(pipelines)
+            started = time.perf_counter()
+            try:
+                await (self.run_wb() if pipeline == "wb" else self.run_ozon())
+            except FlowError as exc:
+                if exc.kind == "rejected":
+                    self.stats.rejected += 1
+                else:
+                    self.stats.failed += 1
+                self.stats.errors[f"{pipeline}.{exc}"] = self.stats.errors.get(f"{pipeline}.{exc}", 0) + 1
+            else:
+                self.stats.completed += 1
+                self.stats.observe(f"{pipeline}.flow", time.perf_counter() - started)
+
+
+def _bot_env(api: FakeBotAPI, workdir: str, extra: list[str]) -> dict:
+    env = {
+        **os.environ,
+        "TOKEN": "123456:LOADTEST",
+        "TELEGRAM_API_SERVER": api.base_url,
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        "JOB_WORKSPACE": os.path.join(workdir, "workspace"),
+        "WEBHOOK_URL": "",
+        "PYTHONUNBUFFERED": "1",
+    }
+    for item in extra:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+async def run_load(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="wb_stickers_load_")
+    fixtures = os.path.join(args.workdir, "fixtures")
+    api = FakeBotAPI(files_dir=os.path.join(workdir, "bot_api") if args.local_api else None)
+    if args.local_api:
+        args.env = ["TELEGRAM_API_LOCAL=1", *args.env]
+    await api.start()
+
+    files = {}
+    if "wb" in args.pipelines:
+        excel, pdf = make_wb_fixture(fixtures, args.pages, args.articles)
+        files["wb_excel"], files["wb_pdf"] = api.add_file(excel), api.add_file(pdf)
+    if "ozon" in args.pipelines:
+        assembly, ticket = make_ozon_fixture(fixtures, args.pages, args.articles)
+        files["ozon_assembly"], files["ozon_ticket"] = api.add_file(assembly), api.add_file(ticket)
+
+    bot = None
+    if not args.no_bot:
+        log = open(os.path.join(workdir, "bot.log"), "wb")
+        bot = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "main.py")],
+            cwd=ROOT, env=_bot_env(api, workdir, args.env), stdout=log, stderr=subprocess.STDOUT,
+        )
+        print(f"Бот запущен (pid {bot.pid}), лог: {log.name}", file=sys.stderr)
+    else:
+        print(f"Ожидаю бота с TELEGRAM_API_SERVER={api.base_url}", file=sys.stderr)
+
+    try:
+        await asyncio.wait_for(api.polling.wait(), args.startup_timeout)
+        stats = Stats()
+        rng = random.Random(args.seed)
+        users = [
+            SimulatedUser(api, FIRST_USER_ID + index, files, stats, args.timeout)
+            for index in range(args.users)
+        ]
+
+        async def start(user: SimulatedUser, delay: float) -> None:
+            await asyncio.sleep(delay)
+            await user.run(args.flows, args.pipelines, random.Random(rng.random()))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            start(user, args.ramp * index / max(1, args.users)) for index, user in enumerate(users)
+        ))
+        report = stats.summary(time.perf_counter() - started)
+        report["api_calls"] = dict(sorted(api.calls.items()))
+        report["params"] = {
+            key: getattr(args, key)
+            for key in ("users", "flows", "pipelines", "pages", "articles", "ramp", "env", "local_api")
+        }
+        return report
+    finally:
+        if bot is not None:
+            bot.send_signal(signal.SIGINT)
+            try:
+                bot.wait(30)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+        await api.stop()
+
+
+def print_report(report: dict, out=sys.stderr) -> None:
+    print(
+        f"Сценариев: {report['flows']}, успешно: {report['completed']}, отказов (очередь): {report['rejected']}, "
+        f"ошибок: {report['failed']} ({report['error_rate']:.1%})",
+        file=out,
+    )
+    print(f"Пропускная способность: {report['throughput_flows_per_s']:.2f} сценариев/с "
+          f"за {report['wall_seconds']:.1f} с", file=out)
+    print(f"{'шаг':<28} {'n':>5} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}", file=out)
+    for step, p in report["latency"].items():
+        print(f"{step:<28} {p['n']:>5} {p['p50']:>8.3f} {p['p90']:>8.3f} {p['p99']:>8.3f} {p['max']:>8.3f}", file=out)
+    for error, count in sorted(report["errors"].items()):
+        print(f"  {count:>5} × {error}", file=out)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальной заглушке Bot API.")
+    parser.add_argument("--users", type=int, default=50, help="Одновременных пользователей.")
+    parser.add_argument("--flows", type=int, default=1, help="Сценариев на пользователя.")
+    parser.add_argument("--pipelines", nargs="+", choices=("wb", "ozon"), default=["wb", "ozon"])
+    parser.add_argument("--pages", type=int, default=100, help="Страниц в синтетических файлах.")
+    parser.add_argument("--articles", type=int, default=10)
+    parser.add_argument("--ramp", type=float, default=5.0, help="За сколько секунд подключаются все пользователи.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Ожидание ответа на шаг, сек (результат — ×10).")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="Доп. переменные окружения бота.")
+    parser.add_argument("--no-bot", action="store_true", help="Не запускать main.py, ждать уже запущенного бота.")
+    parser.add_argument("--local-api", action="store_true",
+                        help="Заглушка в режиме локального сервера (--local): файлы читаются с диска, без лимита 20 МБ.")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "wb_stickers_bench"))
+    parser.add_argument("--out", help="Файл для JSON с результатами.")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load(args))
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
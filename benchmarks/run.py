@@ -0,0 +1,172 @@
+"""Benchmark the WB and Ozon pipelines on synthetic inputs.
+
+Every case runs in a fresh process so that peak RSS is not inherited from the
+previous case. Each pipeline stage is timed with wall time, CPU time and the
+peak RSS observed while it ran; results are written as JSON:
+
+    python -m benchmarks.run --sizes 100 1000 10000 --articles 10 100 --out bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import psutil
+
+from benchmarks.fixtures import make_ozon_fixture, make_wb_fixture
+
+PIPELINES = ("wb", "ozon")
+
+
+class _RssSampler(threading.Thread):
+    """Polls the process RSS in the background and keeps the maximum."""
+
+    def __init__(self, interval: float = 0.005):
+        super().__init__(daemon=True)
+        self._process = psutil.Process()
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self.peak = 0
+
+    def reset(self) -> None:
+        self.peak = self._process.memory_info().rss
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self._interval):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+class StageRecorder:
+    """Stage observer collecting wall time, CPU time and peak RSS per stage."""
+
+    def __init__(self):
+        self.stages: dict[str, dict[str, float]] = {}
+        self._sampler = _RssSampler()
+
+    def __enter__(self):
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._sampler.stop()
+
+    @contextmanager
+    def __call__(self, name: str, labels: dict):
+        self._sampler.reset()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            peak = max(self._sampler.peak, psutil.Process().memory_info().rss)
+            entry = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "peak_rss_mb": 0.0})
+            entry["wall"] += time.perf_counter() - wall
+            entry["cpu"] += time.process_time() - cpu
+            entry["peak_rss_mb"] = max(entry["peak_rss_mb"], peak / 2**20)
+
+
+def _run_case(pipeline: str, inputs: tuple[str, str], output: str) -> dict:
+    """Run one pipeline invocation in the current process and return its measurements."""
+    from pathlib import Path
+
+    from utils.create_ozon_pdf import build_ozon_pdf
+    from utils.create_pdf import build_wb_pdf
+    from utils.stages import add_observer, remove_observer
+
+    with StageRecorder() as recorder:
+        add_observer(recorder)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            if pipeline == "wb":
+                build_wb_pdf(inputs[0], inputs[1], output)
+            else:
+                build_ozon_pdf(Path(inputs[0]), Path(inputs[1]), Path(output))
+        finally:
+            remove_observer(recorder)
+        total = {
+            "wall": time.perf_counter() - wall,
+            "cpu": time.process_time() - cpu,
+            # ru_maxrss в Linux — в килобайтах
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+    return {"stages": recorder.stages, "total": total, "output_bytes": os.path.getsize(output)}
+
+
+def run_case(pipeline: str, inputs: tuple[str, str], output: str) -> dict:
+    """Run a case in a fresh process."""
+    with mp.get_context("spawn").Pool(1) as pool:
+        return pool.apply(_run_case, (pipeline, inputs, output))
+
+
+def run_suite(pipelines, sizes, articles, repeat: int, workdir: str, log=sys.stderr) -> dict:
+    fixtures = os.path.join(workdir, "fixtures")
+    results = []
+    for pipeline in pipelines:
+        make_fixture = make_wb_fixture if pipeline == "wb" else make_ozon_fixture
+        for pages in sizes:
+            for cardinality in articles:
+                cardinality = min(cardinality, pages)
+                inputs = make_fixture(fixtures, pages, cardinality)
+                case = f"{pipeline}-{pages}p-{cardinality}a"
+                runs = []
+                for attempt in range(repeat):
+                    output = os.path.join(workdir, f"{case}.out.pdf")
+                    runs.append(run_case(pipeline, inputs, output))
+                    print(f"{case} #{attempt + 1}: {runs[-1]['total']['wall']:.2f} s", file=log)
+                results.append({
+                    "case": case,
+                    "pipeline": pipeline,
+                    "pages": pages,
+                    "articles": cardinality,
+                    "runs": runs,
+                })
+    return {"meta": environment(), "results": results}
+
+
+def environment() -> dict:
+    import fitz
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "pymupdf": fitz.VersionBind,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк пайплайнов WB и Ozon.")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=list(PIPELINES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 10000], help="Количество страниц.")
+    parser.add_argument("--articles", nargs="+", type=int, default=[10, 100], help="Количество разных артикулов.")
+    parser.add_argument("--repeat", type=int, default=1, help="Запусков на каждый случай.")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "wb_stickers_bench"))
+    parser.add_argument("--out", default="-", help="Файл для JSON с результатами, '-' — stdout.")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.pipelines, args.sizes, args.articles, args.repeat, args.workdir)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out == "-":
+        print(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Start-up benchmark of the bot process with an ``-X importtime`` breakdown.
+
+Imports ``main`` (bot, dispatcher, handlers, database engine — everything the
+bot loads before it can answer ``/start``) in a fresh interpreter and reports
+the import wall time, peak RSS and the slowest imports. The same is measured
+for a baseline importing only aiogram and SQLAlchemy: the bot should cost
+little more than that. Modules of the processing stack (pandas, numpy,
+PyMuPDF, openpyxl) must not be imported by the bot at all; they are loaded in
+the worker pool processes only.
+
+    python -m benchmarks.startup --repeat 5 --top 25 --out startup.json
+
+Exit code is 1 when the bot process imports a heavy module.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("pandas", "numpy", "fitz", "pymupdf", "openpyxl", "PIL")
+
+TARGETS = {
+    "bot": "import main",
+    "baseline": "import aiogram, aiogram.contrib.fsm_storage.memory, sqlalchemy.ext.asyncio",
+}
+
+# Выполняется в новом интерпретаторе: время импорта, пиковый RSS и загруженные тяжёлые модули
+_PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "import_seconds": elapsed,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "heavy": sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy!r})),
+}}))
+"""
+
+
+def _env(workdir: str) -> dict:
+    return {
+        **os.environ,
+        "TOKEN": os.environ.get("TOKEN", "123456:STARTUP"),
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'startup.db')}",
+        "JOB_WORKSPACE": os.path.join(workdir, "workspace"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    }
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """Parse ``-X importtime`` lines into {module, self_us, cumulative_us, depth}."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        # Вложенность импорта — отступ имени модуля, по два пробела на уровень
+        name = name.rstrip()[1:]
+        entries.append({
+            "module": name.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+        })
+    return entries
+
+
+def measure(target: str, workdir: str) -> dict:
+    """Import the target in a fresh interpreter; return its measurements and import breakdown."""
+    probe = _PROBE.format(statement=TARGETS[target], heavy=HEAVY_MODULES)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=ROOT, env=_env(workdir), capture_output=True, text=True, check=False,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{target}: {completed.stderr.strip().splitlines()[-1:]}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["imports"] = parse_importtime(completed.stderr)
+    return result
+
+
+def packages(imports: list[dict]) -> dict[str, float]:
+    """Self import time per top-level package, ms."""
+    totals: dict[str, float] = {}
+    for entry in imports:
+        package = entry["module"].split(".")[0]
+        totals[package] = totals.get(package, 0.0) + entry["self_us"] / 1000
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def run(repeat: int, top: int, workdir: str) -> dict:
+    report = {}
+    for target in TARGETS:
+        runs = [measure(target, workdir) for _ in range(repeat)]
+        last = runs[-1]
+        report[target] = {
+            "import_seconds": statistics.median(r["import_seconds"] for r in runs),
+            "peak_rss_mb": statistics.median(r["peak_rss_mb"] for r in runs),
+            "modules": last["modules"],
+            "heavy": last["heavy"],
+            "packages_ms": dict(list(packages(last["imports"]).items())[:top]),
+            "slowest": [
+                {"module": e["module"], "cumulative_ms": e["cumulative_us"] / 1000, "self_ms": e["self_us"] / 1000}
+                for e in sorted(last["imports"], key=lambda e: -e["cumulative_us"])[:top]
+            ],
+        }
+    return report
+
+
+def print_report(report: dict, out=sys.stderr) -> None:
+    for target, result in report.items():
+        print(f"{target}: импорт {result['import_seconds'] * 1000:.0f} мс, пиковый RSS {result['peak_rss_mb']:.1f} МБ, "
+              f"модулей {result['modules']}", file=out)
+        if result["heavy"]:
+            print(f"  тяжёлые модули: {', '.join(result['heavy'])}", file=out)
+    bot, baseline = report["bot"], report["baseline"]
+    print(f"бот сверх aiogram + SQLAlchemy: {(bot['import_seconds'] - baseline['import_seconds']) * 1000:+.0f} мс, "
+          f"{bot['peak_rss_mb'] - baseline['peak_rss_mb']:+.1f} МБ", file=out)
+    print(f"{'пакет':<32} {'self, мс':>10}", file=out)
+    for package, ms in bot["packages_ms"].items():
+        print(f"{package:<32} {ms:>10.1f}", file=out)
+    print(f"{'модуль':<48} {'cumul, мс':>10} {'self, мс':>10}", file=out)
+    for entry in bot["slowest"]:
+        print(f"{entry['module']:<48} {entry['cumulative_ms']:>10.1f} {entry['self_ms']:>10.1f}", file=out)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Время запуска процесса бота и разбор -X importtime.")
+    parser.add_argument("--repeat", type=int, default=3, help="Запусков на каждый вариант (берётся медиана).")
+    parser.add_argument("--top", type=int, default=20, help="Сколько пакетов и модулей показывать.")
+    parser.add_argument("--out", help="Файл для JSON с результатами.")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="wb_stickers_startup_") as workdir:
+        report = run(args.repeat, args.top, workdir)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+    return 1 if report["bot"]["heavy"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,34 @@
 import logging
 
 from aiogram import Bot, Dispatcher
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.contrib.middlewares.logging import LoggingMiddleware
 
-from config import TOKEN
+from config import FSM_CACHE_SIZE, FSM_CACHE_TTL, FSM_STORAGE, TELEGRAM_API_SERVER, TOKEN, TRACE_FILE
+from utils.logs import setup_logging
+from utils.telegram_logging import UpdateLogMiddleware
 
 # Настройка логгирования
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Инициализация и настройка бота
 
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
+if TELEGRAM_API_SERVER:
+    bot = Bot(token=TOKEN, server=TelegramAPIServer.from_base(TELEGRAM_API_SERVER))
+else:
+    bot = Bot(token=TOKEN)
+if FSM_STORAGE == 'db':
+    from database.fsm_storage import SQLAlchemyStorage
+
+    storage = SQLAlchemyStorage(cache_ttl=FSM_CACHE_TTL, cache_size=FSM_CACHE_SIZE)
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
 
-dp.middleware.setup(LoggingMiddleware(logger=logger))
+dp.middleware.setup(UpdateLogMiddleware())
+
+if TRACE_FILE:
+    from utils.telegram_tracing import TracingMiddleware
+
+    dp.middleware.setup(TracingMiddleware())
@@ -0,0 +1,258 @@
+"""Command-line processing on the bot's engine, without Telegram.
+
+Jobs run on the same process pool and pipelines as the bot (``utils.worker_pool``,
+``utils.pipelines``): same fonts, memory limits and stage timings. Progress and
+per-file timings go to stderr, the JSON summary to stdout (or ``--summary``):
+
+    python cli.py wb pick_list.xlsx stickers.pdf [stickers_2.pdf ...] -o out.pdf
+    python cli.py ozon assembly.pdf ticket.pdf -o out.pdf
+    python cli.py tree inputs/ -o outputs/ --jobs 4 --summary summary.json
+    python cli.py wb pick_list.xlsx stickers.pdf -o out.zpl --format zpl --dpi 203
+
+``tree`` walks the input directory; the files directly in each directory make
+its jobs:
+
+* one pick list (.xlsx/.xls) — a WB job with all PDFs of the directory as its
+  stickers (a set may be split across several files);
+* several pick lists — WB pairs matched like in the ZIP batch mode
+  (``utils.batch.pair_files``);
+* no pick list and two PDFs — an Ozon job; the assembly list is told by its
+  name ("сбор…", "assembl…") or by its table header.
+
+Outputs mirror the input tree: ``<output>/<relative dir>/<job name>.pdf``.
+With ``--format`` the labels are rasterised for a thermal printer instead
+(``utils.thermal``), and the extension follows the format. The exit code is 1
+if any job failed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+from config import WORKER_PROCESSES
+from utils.batch import EXCEL_EXTENSIONS, PDF_EXTENSIONS, pair_files
+from utils.cancellation import JobCancelled
+from utils.thermal import DEFAULT_DPI, DPIS, EXTENSIONS, FORMATS, render_on_pool
+from utils.worker_pool import JobFailed, JobTooLarge, ProcessPool, WorkerCrashed
+
+_ASSEMBLY_NAME = re.compile(r"сбор|assembl", re.IGNORECASE)
+
+
+def _is_assembly_list(path: str) -> bool:
+    import fitz  # PyMuPDF
+
+    with fitz.open(path) as doc:
+        return doc.page_count > 0 and "отправления" in doc[0].get_text()
+
+
+def _ozon_inputs(pdfs: list[str]) -> dict | None:
+    by_name = [path for path in pdfs if _ASSEMBLY_NAME.search(os.path.basename(path))]
+    assembly = by_name if len(by_name) == 1 else [path for path in pdfs if _is_assembly_list(path)]
+    if len(assembly) != 1:
+        return None
+    ticket = next(path for path in pdfs if path != assembly[0])
+    return {"assembly": assembly[0], "ticket": ticket}
+
+
+def discover(root: str, output_root: str, extension: str = ".pdf") -> tuple[list[dict], list[dict]]:
+    """Jobs found under ``root``; return (jobs, skipped directories with the reason)."""
+    root, output_root = os.path.abspath(root), os.path.abspath(output_root)
+    jobs, skipped = [], []
+    for directory, subdirs, names in os.walk(root):
+        # Результаты прошлых запусков внутри входного каталога не обрабатываются повторно
+        subdirs[:] = sorted(d for d in subdirs if os.path.join(directory, d) != output_root and not d.startswith("."))
+        files = [os.path.join(directory, name) for name in sorted(names) if not name.startswith(".")]
+        excels = [path for path in files if path.lower().endswith(EXCEL_EXTENSIONS)]
+        pdfs = [path for path in files if path.lower().endswith(PDF_EXTENSIONS)]
+        if not excels and not pdfs:
+            continue
+        relative = os.path.relpath(directory, root)
+        target = os.path.join(output_root, relative)
+        default_name = os.path.basename(directory if relative != "." else root)
+
+        def add(kind: str, name: str, inputs: dict) -> None:
+            jobs.append({
+                "name": os.path.normpath(os.path.join(relative, name)),
+                "kind": kind,
+                "inputs": inputs,
+                "output": os.path.join(target, f"{name}{extension}"),
+            })
+
+        if len(excels) == 1 and pdfs:
+            inputs = {"excel": excels[0], "pdf": pdfs[0]}
+            inputs.update({f"pdf_{n}": path for n, path in enumerate(pdfs[1:], start=2)})
+            add("wb", default_name, inputs)
+        elif len(excels) > 1:
+            pairs, unpaired = pair_files(files)
+            for pair in pairs:
+                add("wb", pair["name"], {"excel": pair["excel"], "pdf": pair["pdf"]})
+            if unpaired:
+                skipped.append({"path": relative, "reason": f"без пары: {', '.join(unpaired)}"})
+        elif excels:
+            skipped.append({"path": relative, "reason": "лист подбора без PDF со стикерами"})
+        elif len(pdfs) == 2 and (inputs := _ozon_inputs(pdfs)):
+            add("ozon", default_name, inputs)
+        else:
+            skipped.append({"path": relative, "reason": "нет листа подбора, и это не пара сборочный лист + этикетки Ozon"})
+    return jobs, skipped
+
+
+async def _run_labels(pool: ProcessPool, job: dict, output_format: str, dpi: int) -> dict:
+    planned = await pool.run(job["kind"], {**job["inputs"], "format": output_format}, job["output"], key=job["name"])
+    rendered = await render_on_pool(
+        pool, planned.pop("plan"), output_format, dpi, job["output"], job["name"], pool.size
+    )
+    stages = dict(planned["stages"])
+    for name, seconds in rendered["stages"].items():
+        stages[name] = round(stages.get(name, 0.0) + seconds, 4)
+    return {**planned, "stages": stages, "peak_rss_mb": max(planned["peak_rss_mb"], rendered["peak_rss_mb"])}
+
+
+async def _run_one(pool: ProcessPool, job: dict, profile: bool, output_format: str, dpi: int) -> dict:
+    os.makedirs(os.path.dirname(job["output"]) or ".", exist_ok=True)
+    started = time.perf_counter()
+    record = {**job, "status": "done", "error": None}
+    try:
+        if output_format == "pdf":
+            result = await pool.run(job["kind"], job["inputs"], job["output"], key=job["name"], profile=profile)
+        else:
+            result = await _run_labels(pool, job, output_format, dpi)
+        record.update({key: result[key] for key in ("pages", "articles", "peak_rss_mb", "stages")})
+    except JobTooLarge as exc:
+        record.update(status="too_large", error=str(exc))
+    except (JobFailed, WorkerCrashed) as exc:
+        record.update(status="failed", error=str(exc))
+    except JobCancelled:
+        record.update(status="cancelled")
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def _progress_line(done: int, total: int, record: dict) -> str:
+    line = f"[{done}/{total}] {record['name']} ({record['kind']}): {record['status']} за {record['seconds']:.2f} с"
+    if record["status"] == "done":
+        stages = ", ".join(f"{name} {seconds:.2f}" for name, seconds in record["stages"].items())
+        line += f"; стикеров {record['pages']}, артикулов {record['articles']}, {record['peak_rss_mb']} МБ; {stages}"
+    elif record["error"]:
+        line += f": {record['error']}"
+    return line
+
+
+async def run_jobs(
+    jobs: list[dict],
+    processes: int,
+    profile: bool = False,
+    log=sys.stderr,
+    output_format: str = "pdf",
+    dpi: int = DEFAULT_DPI,
+) -> list[dict]:
+    """Run ``jobs`` on a pool of ``processes``; return their records in the order of ``jobs``."""
+    # Этикетки одной задачи растрируются частями во всех процессах пула
+    size = processes if output_format != "pdf" else min(processes, len(jobs))
+    pool = ProcessPool(max(1, size))
+    pool.start()
+    done = 0
+
+    async def run(job: dict) -> dict:
+        nonlocal done
+        record = await _run_one(pool, job, profile, output_format, dpi)
+        done += 1
+        print(_progress_line(done, len(jobs), record), file=log, flush=True)
+        return record
+
+    try:
+        return list(await asyncio.gather(*(run(job) for job in jobs)))
+    finally:
+        pool.close()
+
+
+def summarize(records: list[dict], skipped: list[dict], seconds: float) -> dict:
+    statuses = [record["status"] for record in records]
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "cpu_count": os.cpu_count(),
+        },
+        "totals": {
+            "jobs": len(records),
+            "done": statuses.count("done"),
+            "failed": len(statuses) - statuses.count("done"),
+            "skipped": len(skipped),
+            "pages": sum(record.get("pages", 0) for record in records),
+            "seconds": round(seconds, 3),
+        },
+        "jobs": records,
+        "skipped": skipped,
+    }
+
+
+def _single_job(args) -> dict:
+    if args.command == "wb":
+        inputs = {"excel": args.excel, "pdf": args.pdf[0]}
+        inputs.update({f"pdf_{n}": path for n, path in enumerate(args.pdf[1:], start=2)})
+    else:
+        inputs = {"assembly": args.assembly, "ticket": args.ticket}
+    name = os.path.splitext(os.path.basename(args.output))[0]
+    return {"name": name, "kind": args.command, "inputs": inputs, "output": os.path.abspath(args.output)}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Обработка стикеров WB и Ozon без Telegram.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--summary", default="-", help="Файл для JSON с итогами, '-' — stdout.")
+    common.add_argument("--profile", action="store_true", help="Профилировать задачи, отчёт рядом с результатом.")
+    common.add_argument("--format", choices=FORMATS, default="pdf",
+                        help="pdf или формат термопринтера: zpl, png (ZIP с PNG), pbm.")
+    common.add_argument("--dpi", type=int, choices=DPIS, default=DEFAULT_DPI, help="Разрешение термопринтера.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    wb = commands.add_parser("wb", parents=[common], help="Лист подбора и стикеры WB.")
+    wb.add_argument("excel", help="Лист подбора (.xlsx).")
+    wb.add_argument("pdf", nargs="+", help="PDF со стикерами, можно несколько файлов одной поставки.")
+    wb.add_argument("-o", "--output", required=True, help="Куда сохранить результат.")
+
+    ozon = commands.add_parser("ozon", parents=[common], help="Сборочный лист и этикетки Ozon.")
+    ozon.add_argument("assembly", help="PDF сборочного листа.")
+    ozon.add_argument("ticket", help="PDF этикеток.")
+    ozon.add_argument("-o", "--output", required=True, help="Куда сохранить результат.")
+
+    tree = commands.add_parser("tree", parents=[common], help="Все входные файлы каталога и подкаталогов.")
+    tree.add_argument("input", help="Каталог с входными файлами.")
+    tree.add_argument("-o", "--output", required=True, help="Каталог для результатов.")
+    tree.add_argument("--jobs", type=int, default=WORKER_PROCESSES, help="Процессов обработки.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr, format="%(levelname)s: %(message)s")
+    started = time.perf_counter()
+    if args.command == "tree":
+        jobs, skipped = discover(args.input, args.output, EXTENSIONS[args.format])
+        for entry in skipped:
+            print(f"Пропущен {entry['path']}: {entry['reason']}", file=sys.stderr)
+        processes = args.jobs
+    else:
+        jobs, skipped, processes = [_single_job(args)], [], 1 if args.format == "pdf" else WORKER_PROCESSES
+    if args.format == "pdf":
+        processes = min(processes, len(jobs))
+    print(f"Задач: {len(jobs)}, процессов: {processes if jobs else 0}", file=sys.stderr)
+
+    records = asyncio.run(run_jobs(jobs, processes, args.profile, output_format=args.format, dpi=args.dpi)) if jobs else []
+    summary = summarize(records, skipped, time.perf_counter() - started)
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary == "-":
+        print(text)
+    else:
+        with open(args.summary, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    return 1 if summary["totals"]["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
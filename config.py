@@ -7,10 +7,96 @@ load_dotenv()
 ADMINS = [306083015, 669479300]
 
 TOKEN = os.getenv('TOKEN')
+# Адрес Bot API, если не api.telegram.org (локальный Bot API сервер или заглушка для нагрузочного теста)
+TELEGRAM_API_SERVER = os.getenv('TELEGRAM_API_SERVER')
+# Локальный сервер запущен с --local: документы читаются прямо из его каталога, без лимита 20 МБ, отправка до 2000 МБ
+TELEGRAM_API_LOCAL = os.getenv('TELEGRAM_API_LOCAL', '0') == '1'
+# 'каталог_на_сервере=каталог_здесь', если --dir сервера смонтирован у бота и воркеров по другому пути
+TELEGRAM_API_PATH_MAP = os.getenv('TELEGRAM_API_PATH_MAP', '')
 DATABASE_URL = os.getenv('DATABASE_URL')
+# Пул соединений с БД на процесс. Суммарно по всем процессам бота и воркеров не должен превышать max_connections Postgres
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '5'))  # Дополнительные соединения сверх пула при пиках
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))  # Ожидание свободного соединения, сек
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # Пересоздавать соединения старше, сек
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '500'))  # Кэш скомпилированных и подготовленных запросов
 
 IMAGE_NAME = 'stickers.webp'
 MAX_ARTICLE_LENGTH = 50  # Максимальная длина артикула
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Хранилище состояний FSM: 'db' (общая БД, переживает рестарт) или 'memory'
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'db')
+FSM_CACHE_TTL = float(os.getenv('FSM_CACHE_TTL', '300'))  # Время жизни записи в локальном кэше, сек
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))  # Максимум записей в локальном кэше
+FSM_STATE_TTL = float(os.getenv('FSM_STATE_TTL', '86400'))  # Незавершённый сценарий сбрасывается после стольких секунд бездействия, 0 — никогда
+
+# Режим вебхука: если задан WEBHOOK_URL, main.py запускает webhook.serve() вместо polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес, например https://example.com/webhook
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # Проверяется по заголовку X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))  # Количество процессов-воркеров
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))  # Время на дочитывание очереди при остановке, сек
+
+# HTTP API для складских систем (api.py): авторизация ключами из access_keys
+API_HOST = os.getenv('API_HOST', '0.0.0.0')
+API_PORT = int(os.getenv('API_PORT', '8081'))
+API_MAX_UPLOAD_MB = int(os.getenv('API_MAX_UPLOAD_MB', '200'))  # Максимальный суммарный размер файлов одного запроса, МБ
+API_MAX_WAIT = float(os.getenv('API_MAX_WAIT', '300'))  # Предел синхронного ожидания результата (?wait=), сек
+API_KEY_CACHE_TTL = float(os.getenv('API_KEY_CACHE_TTL', '60'))  # Сколько помнить проверенный ключ, сек
+API_WORKER_INLINE = os.getenv('API_WORKER_INLINE', '0') == '1'  # Запускать воркер внутри процесса API (одна нода, нагрузочный тест)
+
+# Очередь задач обработки
+# Каталог для входных и выходных файлов задач. Если воркеры запущены на других
+# машинах, каталог должен быть общим (NFS и т.п.)
+JOB_WORKSPACE = os.getenv('JOB_WORKSPACE', os.path.join(BASE_DIR, 'workspace'))
+WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', str(os.cpu_count() or 2)))  # Процессов обработки PDF на воркер
+WORKER_INLINE = os.getenv('WORKER_INLINE', '1') == '1'  # Запускать воркер внутри процесса бота (одна нода)
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '60'))  # Аренда задачи, продлевается пока задача выполняется
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))  # Сколько раз пробовать задачу после падения воркера
+WB_MAX_PDFS = int(os.getenv('WB_MAX_PDFS', '20'))  # Максимум PDF со стикерами в одном сценарии WB
+JOB_MAX_CRASHES = int(os.getenv('JOB_MAX_CRASHES', '2'))  # Падений процесса на задаче подряд, после которых файл считается слишком тяжёлым
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1.0'))  # Период опроса очереди, сек
+DELIVERY_CONCURRENCY = int(os.getenv('DELIVERY_CONCURRENCY', '8'))  # Результатов, отправляемых в чаты одновременно
+DELIVERY_MAX_ATTEMPTS = int(os.getenv('DELIVERY_MAX_ATTEMPTS', '5'))  # Попыток отправить результат, дальше задача считается доставленной
+JOB_QUEUE_LIMIT = int(os.getenv('JOB_QUEUE_LIMIT', '200'))  # Максимум задач в очереди, дальше новые не принимаются
+JOB_USER_QUEUE_LIMIT = int(os.getenv('JOB_USER_QUEUE_LIMIT', '3'))  # Максимум ожидающих задач одного пользователя
+JOB_USER_CONCURRENCY = int(os.getenv('JOB_USER_CONCURRENCY', '1'))  # Одновременно выполняемых задач одного пользователя
+JOB_CANCEL_GRACE = float(os.getenv('JOB_CANCEL_GRACE', '5'))  # Сколько ждать остановки отменённой задачи перед kill, сек
+WORKSPACE_ORPHAN_TTL = float(os.getenv('WORKSPACE_ORPHAN_TTL', '86400'))  # Файлы без владельца старше стольких секунд удаляются, 0 — не удалять
+JANITOR_INTERVAL = float(os.getenv('JANITOR_INTERVAL', '600'))  # Период уборки сценариев и рабочего каталога, сек (0 — выключить)
+WORKER_WARMUP = os.getenv('WORKER_WARMUP', '1') == '1'  # Прогревать процессы обработки тестовой задачей до приёма задач
+WORKER_MEMORY_LIMIT_MB = int(os.getenv('WORKER_MEMORY_LIMIT_MB', '2048'))  # Предел адресного пространства процесса обработки (RLIMIT_AS), 0 — без предела
+WORKER_MAX_JOBS = int(os.getenv('WORKER_MAX_JOBS', '200'))  # Процесс обработки заменяется новым после стольких задач (0 — без ограничения)
+WORKER_MAX_RSS_GROWTH_MB = int(os.getenv('WORKER_MAX_RSS_GROWTH_MB', '512'))  # ...или когда его RSS вырос на столько МБ с прогрева (0 — не следить)
+FONT_PATH = os.getenv('FONT_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')  # Шрифт страниц-заголовков и артикулов
+# Пачки больше стольких страниц пишутся по частям: память ограничена размером части, а не файла (0 — всегда целиком)
+PDF_CHUNK_PAGES = int(os.getenv('PDF_CHUNK_PAGES', '500'))
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '40'))  # Максимум файлов Excel и PDF в ZIP пакетного режима
+BATCH_MAX_UNPACKED_MB = int(os.getenv('BATCH_MAX_UNPACKED_MB', '2048'))  # Максимальный размер распакованного архива, МБ
+# Режим WB «только стикеры»: артикулы берутся из листов подбора, присланных продавцом раньше
+STICKER_ARTICLES_MIN_COVERAGE = float(os.getenv('STICKER_ARTICLES_MIN_COVERAGE', '0.95'))  # Доля стикеров с известным артикулом, ниже — просим Excel
+STICKER_ARTICLES_TTL_DAYS = float(os.getenv('STICKER_ARTICLES_TTL_DAYS', '90'))  # Артикулы стикеров, не обновлявшиеся столько дней, удаляются (0 — хранить всегда)
+
+# Метрики в формате Prometheus: GET /metrics на локальном порту, 0 — не поднимать
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # Порт метрик бота
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', '0'))  # Порт метрик отдельного воркера (worker.py)
+API_METRICS_PORT = int(os.getenv('API_METRICS_PORT', '0'))  # Порт метрик HTTP API (api.py)
+
+# Трассировка: спаны пишутся в файл в формате OTLP/JSON (пусто — выключено)
+TRACE_FILE = os.getenv('TRACE_FILE', '')
+TRACE_SERVICE = os.getenv('TRACE_SERVICE', 'wb-stickers-bot')
+
+# Логирование: JSON-строки с выборкой по категориям (см. utils/logs.py)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' или 'text'
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_UPDATES_RATE = float(os.getenv('LOG_UPDATES_RATE', '0.01'))  # Доля апдейтов, попадающих в лог
+LOG_SQL_RATE = float(os.getenv('LOG_SQL_RATE', '0'))  # Доля SQL-запросов в логе (медленные пишутся всегда)
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))  # Порог медленного запроса, мс
+LOG_RATES_REFRESH = float(os.getenv('LOG_RATES_REFRESH', '30'))  # Как часто перечитывать настройки из БД, сек
+PROFILING_REFRESH = float(os.getenv('PROFILING_REFRESH', '30'))  # Как часто проверять, есть ли запросы профилирования, сек
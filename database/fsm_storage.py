@@ -0,0 +1,196 @@
+"""FSM storage backed by the shared SQLAlchemy database.
+
+State survives restarts and can be shared by several bot processes. Hot
+records are kept in a small write-through cache. Every row carries a version
+bumped by each write, from any process: a cached record is served only after
+a cheap ``SELECT version`` confirms it is still current, otherwise the row is
+reloaded. Writes are compare-and-swap on the version, so read-modify-write
+updates (``update_data``) from several processes do not lose each other's
+changes.
+"""
+
+from __future__ import annotations
+
+import copy
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable
+
+from aiogram.dispatcher.storage import BaseStorage
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.exc import IntegrityError
+
+from database.setup import FSMRecord, get_read_session, get_session
+from utils.tracing import span
+
+VERSION_BY_KEY = select(FSMRecord.version).where(
+    FSMRecord.chat_id == bindparam('chat_id'), FSMRecord.user_id == bindparam('user_id')
+)
+WRITE_ATTEMPTS = 10  # Попыток записи при одновременных изменениях из других процессов
+
+
+def _record(row: FSMRecord | None) -> dict[str, Any]:
+    if row is None:
+        return {"state": None, "data": {}, "bucket": {}, "version": 0}
+    return {"state": row.state, "data": row.data or {}, "bucket": row.bucket or {}, "version": row.version}
+
+
+class SQLAlchemyStorage(BaseStorage):
+    """aiogram storage keeping state, data and bucket in the ``fsm_states`` table."""
+
+    def __init__(self, cache_ttl: float = 300.0, cache_size: int = 10000):
+        self._cache_ttl = cache_ttl
+        self._cache_size = cache_size
+        self._cache: OrderedDict[tuple[int, int], tuple[float, dict[str, Any]]] = OrderedDict()
+
+    async def close(self):
+        self._cache.clear()
+
+    async def wait_closed(self):
+        pass
+
+    def _key(self, chat, user) -> tuple[int, int]:
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    def _cache_get(self, key: tuple[int, int]) -> dict[str, Any] | None:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        stored_at, record = entry
+        if time.monotonic() - stored_at > self._cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return record
+
+    def _cache_put(self, key: tuple[int, int], record: dict[str, Any]) -> None:
+        self._cache[key] = (time.monotonic(), record)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: tuple[int, int]) -> dict[str, Any]:
+        cached = self._cache_get(key)
+        async with get_read_session() as session:
+            if cached is not None:
+                # Запись могли изменить другие процессы: сверяем версию, данные не читаем
+                version = await session.scalar(VERSION_BY_KEY, {'chat_id': key[0], 'user_id': key[1]})
+                if (version or 0) == cached["version"]:
+                    return cached
+            record = _record(await session.get(FSMRecord, key))
+
+        self._cache_put(key, record)
+        return record
+
+    async def _write(self, key: tuple[int, int], change: Callable[[dict[str, Any]], dict[str, Any]]) -> None:
+        """Apply ``change(current record) -> fields to set`` to the row read in the same transaction.
+
+        The row is updated only if its version is still the one read; otherwise
+        the change is applied again to the fresh row.
+        """
+        for _ in range(WRITE_ATTEMPTS):
+            try:
+                async with get_session() as session:
+                    row = await session.get(FSMRecord, key)
+                    current = _record(row)
+                    fields = change(current)
+                    record = {**current, **fields, "version": current["version"] + 1}
+                    if row is None:
+                        session.add(FSMRecord(
+                            chat_id=key[0], user_id=key[1], state=record["state"], data=record["data"],
+                            bucket=record["bucket"], version=record["version"],
+                        ))
+                    else:
+                        result = await session.execute(
+                            update(FSMRecord)
+                            .where(
+                                FSMRecord.chat_id == key[0],
+                                FSMRecord.user_id == key[1],
+                                FSMRecord.version == current["version"],
+                            )
+                            .values(**fields, version=record["version"])
+                        )
+                        if result.rowcount != 1:
+                            continue
+            except IntegrityError:
+                continue  # Запись одновременно создал другой процесс
+            self._cache_put(key, record)
+            return
+        raise RuntimeError(f"FSM record {key} is changed concurrently, {WRITE_ATTEMPTS} attempts failed")
+
+    async def get_state(self, *, chat=None, user=None, default=None) -> str | None:
+        record = await self._load(self._key(chat, user))
+        state = record["state"]
+        return state if state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None) -> dict:
+        record = await self._load(self._key(chat, user))
+        data = record["data"] or (default or {})
+        return copy.deepcopy(data)
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        state = self.resolve_state(state)
+        with span("fsm.set_state", state=state):
+            await self._write(self._key(chat, user), lambda current: {"state": state})
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        data = copy.deepcopy(data or {})
+        await self._write(self._key(chat, user), lambda current: {"data": data})
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        changes = copy.deepcopy({**(data or {}), **kwargs})
+        await self._write(self._key(chat, user), lambda current: {"data": {**current["data"], **changes}})
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        fields: dict[str, Any] = {"state": None}
+        if with_data:
+            fields["data"] = {}
+        with span("fsm.reset_state"):
+            await self._write(self._key(chat, user), lambda current: fields)
+
+    async def expire(self, before: datetime) -> list[dict[str, Any]]:
+        """Reset state and data of records not updated since ``before``; return the data dropped."""
+        async with get_read_session() as session:
+            result = await session.execute(
+                select(FSMRecord.chat_id, FSMRecord.user_id, FSMRecord.data)
+                .where(FSMRecord.updated_at < before, FSMRecord.state.isnot(None))
+            )
+            stale = result.all()
+
+        expired = []
+        for chat_id, user_id, data in stale:
+            async with get_session() as session:
+                # Пользователь мог продолжить сценарий после выборки: такую запись не трогаем
+                result = await session.execute(
+                    update(FSMRecord)
+                    .where(FSMRecord.chat_id == chat_id, FSMRecord.user_id == user_id, FSMRecord.updated_at < before)
+                    .values(state=None, data={}, version=FSMRecord.version + 1)
+                )
+            if result.rowcount == 1:
+                self._cache.pop((chat_id, user_id), None)
+                expired.append(data or {})
+        return expired
+
+    async def active_data(self) -> list[dict[str, Any]]:
+        """Data of all records in the middle of a scenario."""
+        async with get_read_session() as session:
+            result = await session.execute(select(FSMRecord.data).where(FSMRecord.state.isnot(None)))
+            return [data for data in result.scalars().all() if data]
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None) -> dict:
+        record = await self._load(self._key(chat, user))
+        bucket = record["bucket"] or (default or {})
+        return copy.deepcopy(bucket)
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        bucket = copy.deepcopy(bucket or {})
+        await self._write(self._key(chat, user), lambda current: {"bucket": bucket})
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        changes = copy.deepcopy({**(bucket or {}), **kwargs})
+        await self._write(self._key(chat, user), lambda current: {"bucket": {**current["bucket"], **changes}})
@@ -1,6 +1,8 @@
-from sqlalchemy import select
+from sqlalchemy import bindparam, select
 
-from database.setup import ImageFile, get_session
+from database.setup import ImageFile, get_read_session, get_session
+
+IMAGE_BY_TAG = select(ImageFile.file_id).where(ImageFile.tag == bindparam('tag'))
 
 
 async def save_image_file_id(tag, file_id):
@@ -10,10 +12,6 @@ async def save_image_file_id(tag, file_id):
 
 
 async def get_image_file_id(tag):
-    async with get_session() as session:
-        query = select(ImageFile).where(ImageFile.tag == tag)
-        result = await session.execute(query)
-        video_file = result.scalars().first()
-        if video_file:
-            return video_file.file_id
-        return None
\ No newline at end of file
+    async with get_read_session() as session:
+        result = await session.execute(IMAGE_BY_TAG, {'tag': tag})
+        return result.scalars().first()
\ No newline at end of file
@@ -0,0 +1,18 @@
+from database.setup import RuntimeSetting, get_read_session, get_session
+
+
+async def get_setting(key, default=None):
+    async with get_read_session() as session:
+        setting = await session.get(RuntimeSetting, key)
+        if setting is None:
+            return default
+        return setting.value
+
+
+async def set_setting(key, value):
+    async with get_session() as session:
+        setting = await session.get(RuntimeSetting, key)
+        if setting is None:
+            session.add(RuntimeSetting(key=key, value=value))
+        else:
+            setting.value = value
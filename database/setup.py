@@ -1,20 +1,83 @@
+import time
 from contextlib import asynccontextmanager
 
-from sqlalchemy import BigInteger, Column, DateTime, Integer, String, func, Boolean
+from sqlalchemy import JSON, BigInteger, Column, DateTime, Float, Integer, String, event, func, Boolean
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-from config import DATABASE_URL
-
-engine = create_async_engine(
+from config import (
     DATABASE_URL,
-    echo=True,
-    pool_size=100,  # Увеличьте размер пула соединений
-    max_overflow=200,  # Увеличьте максимальное количество дополнительных соединений
-    pool_timeout=120,  # Увеличьте тайм-аут ожидания свободного соединения в пуле
-    pool_recycle=1800  # Время в секундах для рециклирования соединений
+    DB_MAX_OVERFLOW,
+    DB_POOL_RECYCLE,
+    DB_POOL_SIZE,
+    DB_POOL_TIMEOUT,
+    DB_STATEMENT_CACHE_SIZE,
 )
+from utils.logs import install_query_log
+from utils.metrics import DB_CHECKOUT_WAIT_SECONDS, DB_CONNECTIONS_IN_USE, DB_POOL_CAPACITY
+from utils.tracing import span
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул соединений, замеряющий ожидание свободного соединения."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_CHECKOUT_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+
+url = make_url(DATABASE_URL)
+pool_args = dict(
+    poolclass=TimedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+)
+if url.get_backend_name() == 'sqlite':
+    # Однонодовый режим и тесты без Postgres
+    connect_args = {'timeout': 30}
+    if url.database in (None, '', ':memory:'):
+        pool_args = {}  # БД в памяти живёт в одном соединении, пул по умолчанию (StaticPool)
+    engine = create_async_engine(
+        url, connect_args=connect_args, query_cache_size=DB_STATEMENT_CACHE_SIZE, **pool_args
+    )
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL: читатели не блокируют писателя, важно для бота и воркера в одном файле БД
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+else:
+    if url.get_driver_name() == 'asyncpg' and 'prepared_statement_cache_size' not in url.query:
+        # Кэш подготовленных выражений asyncpg для частых запросов
+        url = url.update_query_dict({'prepared_statement_cache_size': str(DB_STATEMENT_CACHE_SIZE)})
+    engine = create_async_engine(url, query_cache_size=DB_STATEMENT_CACHE_SIZE, **pool_args)
+
+if pool_args:
+    DB_POOL_CAPACITY.set(DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _connection_checked_out(dbapi_connection, connection_record, connection_proxy):
+    DB_CONNECTIONS_IN_USE.inc()
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _connection_checked_in(dbapi_connection, connection_record):
+    DB_CONNECTIONS_IN_USE.dec()
+
+
+# Запросы пишутся в лог через utils.logs: медленные всегда, остальные по выборке
+install_query_log(engine)
 
 Base = declarative_base()
 
@@ -46,17 +109,99 @@ class ImageFile(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)  # Индекс для created_at
 
 
+class FSMRecord(Base):
+    __tablename__ = "fsm_states"
+
+    chat_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(JSON, nullable=False, default=dict)
+    bucket = Column(JSON, nullable=False, default=dict)
+    version = Column(Integer, nullable=False, default=0, server_default='0')  # Растёт с каждой записью; по ней сверяется локальный кэш
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # 'wb' или 'ozon'
+    status = Column(String, nullable=False, default='queued', index=True)  # queued, running, done, failed, cancelled
+    chat_id = Column(BigInteger, nullable=True)
+    user_id = Column(BigInteger, nullable=True, index=True)
+    tenant = Column(String, nullable=False, index=True)  # Ключ справедливой очереди, например 'tg:<user_id>'
+    cost = Column(Float, nullable=False, default=1.0)  # Оценка стоимости: страницы x артикулы
+    vfinish = Column(Float, nullable=False, default=0.0, index=True)  # Виртуальное время завершения (WFQ)
+    payload = Column(JSON, nullable=False, default=dict)  # Пути к входным файлам
+    result = Column(JSON, nullable=True)  # Путь к результату или текст ошибки
+    attempts = Column(Integer, nullable=False, default=0)
+    crashes = Column(Integer, nullable=False, default=0, server_default='0')  # Попыток подряд, убивших процесс пула или воркер
+    worker = Column(String, nullable=True)  # Идентификатор воркера, взявшего задачу
+    locked_until = Column(DateTime(timezone=True), nullable=True)  # Аренда задачи; по истечении её заберёт другой воркер
+    notified = Column(Boolean, nullable=False, default=False)  # Результат отправлен пользователю
+    delivery_failures = Column(Integer, nullable=False, default=0, server_default='0')  # Неудачных отправок результата
+    cancel_requested = Column(Boolean, nullable=False, default=False)  # Пользователь нажал «Отмена» во время обработки
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class ProfileRequest(Base):
+    __tablename__ = "profile_requests"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, nullable=True, index=True)  # Чьи задачи профилировать; NULL — любые
+    remaining = Column(Integer, nullable=False, default=1)  # Сколько задач ещё профилировать
+    admin_chat_id = Column(BigInteger, nullable=False)  # Куда отправить отчёт
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# Артикулы стикеров WB из листов подбора продавца: по ним стикеры группируются без Excel
+class StickerArticle(Base):
+    __tablename__ = "sticker_articles"
+
+    user_id = Column(BigInteger, primary_key=True)
+    sticker = Column(String, primary_key=True)  # Номер стикера, как на странице PDF: "1234567 8901"
+    article = Column(String, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), index=True)
+
+
+# Настройки, которые меняются из админ-панели без перезапуска
+class RuntimeSetting(Base):
+    __tablename__ = "runtime_settings"
+
+    key = Column(String, primary_key=True)
+    value = Column(JSON, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
 # Создайте асинхронный сеанс
 async_session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+
+async def init_db():
+    """Создаёт таблицы для SQLite; Postgres обновляется миграциями Alembic."""
+    if engine.dialect.name == 'sqlite':
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+
 @asynccontextmanager
 async def get_session():
-    async with async_session_factory() as session:
-        try:
+    with span("db.session"):
+        async with async_session_factory() as session:
+            try:
+                yield session
+                await session.commit()
+            except Exception as e:
+                await session.rollback()
+                raise e
+            finally:
+                await session.close()
+
+
+@asynccontextmanager
+async def get_read_session():
+    """Сессия только для чтения: без commit, транзакция откатывается при закрытии."""
+    with span("db.read_session"):
+        async with async_session_factory() as session:
             yield session
-            await session.commit()
-        except Exception as e:
-            await session.rollback()
-            raise e
-        finally:
-            await session.close()
@@ -0,0 +1,52 @@
+from sqlalchemy import bindparam, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database.setup import StickerArticle, engine, get_read_session, get_session
+
+# Строк в одном INSERT/IN: держимся ниже лимита параметров SQLite (32766) и не раздуваем запросы Postgres
+BATCH_SIZE = 1000
+
+ARTICLES_BY_STICKERS = select(StickerArticle.sticker, StickerArticle.article).where(
+    StickerArticle.user_id == bindparam('user_id'),
+    StickerArticle.sticker.in_(bindparam('stickers', expanding=True)),
+)
+
+
+def _upsert(rows):
+    insert = postgresql.insert if engine.dialect.name == 'postgresql' else sqlite.insert
+    statement = insert(StickerArticle).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[StickerArticle.user_id, StickerArticle.sticker],
+        set_={'article': statement.excluded.article, 'updated_at': func.now()},
+    )
+
+
+async def save_sticker_articles(user_id, sticker_articles):
+    """Сохраняет (обновляет) артикулы стикеров из листа подбора продавца одной транзакцией."""
+    rows = [
+        {'user_id': user_id, 'sticker': sticker, 'article': article}
+        for sticker, article in sticker_articles.items()
+    ]
+    async with get_session() as session:
+        for start in range(0, len(rows), BATCH_SIZE):
+            await session.execute(_upsert(rows[start:start + BATCH_SIZE]))
+
+
+async def get_sticker_articles(user_id, stickers):
+    """Известные артикулы стикеров продавца: стикер -> артикул (стикеров без артикула в ответе нет)."""
+    stickers = list(stickers)
+    found = {}
+    async with get_read_session() as session:
+        for start in range(0, len(stickers), BATCH_SIZE):
+            result = await session.execute(
+                ARTICLES_BY_STICKERS, {'user_id': user_id, 'stickers': stickers[start:start + BATCH_SIZE]}
+            )
+            found.update(result.tuples().all())
+    return found
+
+
+async def delete_stale_sticker_articles(before):
+    """Удаляет артикулы стикеров, не обновлявшиеся с ``before``; возвращает число удалённых."""
+    async with get_session() as session:
+        result = await session.execute(delete(StickerArticle).where(StickerArticle.updated_at < before))
+        return result.rowcount
@@ -0,0 +1,18 @@
+from sqlalchemy import bindparam, func, select
+
+from database.setup import User, get_read_session
+
+# Частые запросы собираются один раз: ключ кэша SQLAlchemy и подготовленное выражение asyncpg переиспользуются
+USER_BY_TELEGRAM_ID = select(User).where(User.telegram_id == bindparam('telegram_id'))
+USER_COUNT = select(func.count()).select_from(User)
+
+
+async def get_user(telegram_id):
+    async with get_read_session() as session:
+        result = await session.execute(USER_BY_TELEGRAM_ID, {'telegram_id': telegram_id})
+        return result.scalars().first()
+
+
+async def count_users():
+    async with get_read_session() as session:
+        return await session.scalar(USER_COUNT)
@@ -11,6 +11,9 @@ from sqlalchemy import select
 from bot_setup import bot, dp, logger
 from config import ADMINS
 from database.setup import AccessKey, User, get_session
+from database.users import count_users
+from utils import logs
+from utils.job_queue import pending_profiling, request_profiling, stop_profiling
 
 
 # Состояние для написания поста
@@ -18,6 +21,12 @@ class PostWritingState(StatesGroup):
     content = State()
 
 
+# Состояния для включения профилирования
+class ProfilingState(StatesGroup):
+    user = State()
+    count = State()
+
+
 # Команда для администратора
 @dp.message_handler(Command('admin'), state='*')
 async def admin_command(message: types.Message, state: FSMContext):
@@ -25,15 +34,14 @@ async def admin_command(message: types.Message, state: FSMContext):
         return
 
     # Получение количества уникальных пользователей
-    async with get_session() as session:
-        user_count_result = await session.execute(select(User))
-        user_count = len(user_count_result.scalars().all())
+    user_count = await count_users()
 
     keyboard = InlineKeyboardMarkup(row_width=1).add(
         InlineKeyboardButton(text="Написать пост всем", callback_data="write_post_to_all"),
         #generate_link
         InlineKeyboardButton(text="Сгенерировать ссылку", callback_data="generate_link"),
-
+        InlineKeyboardButton(text="Профилирование", callback_data="profiling"),
+        InlineKeyboardButton(text="Логи", callback_data="log_settings"),
     )
 
     await message.answer(f"Количество уникальных пользователей: {user_count}", reply_markup=keyboard)
@@ -43,13 +51,13 @@ async def admin_menu(callback_query: types.CallbackQuery, state: FSMContext):
     await state.finish()
 
     # Получение количества уникальных пользователей
-    async with get_session() as session:
-        user_count_result = await session.execute(select(User))
-        user_count = len(user_count_result.scalars().all())
+    user_count = await count_users()
 
     keyboard = InlineKeyboardMarkup(row_width=1).add(
         InlineKeyboardButton(text="Написать пост всем", callback_data="write_post_to_all"),
         InlineKeyboardButton(text="Сгенерировать ссылку", callback_data="generate_link"),
+        InlineKeyboardButton(text="Профилирование", callback_data="profiling"),
+        InlineKeyboardButton(text="Логи", callback_data="log_settings"),
     )
 
     await callback_query.message.answer(f"Количество уникальных пользователей: {user_count}", reply_markup=keyboard)
@@ -130,4 +138,156 @@ async def generate_link(callback_query: types.CallbackQuery):
     await callback_query.answer()
 
 
+def _profiling_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(row_width=1).add(
+        InlineKeyboardButton(text="Следующие задачи пользователя", callback_data="profile_user"),
+        InlineKeyboardButton(text="Следующие N задач", callback_data="profile_next"),
+        InlineKeyboardButton(text="Выключить", callback_data="profile_off"),
+        InlineKeyboardButton(text="Админ меню", callback_data="admin"),
+    )
+
+
+async def _profiling_status() -> str:
+    requests = await pending_profiling()
+    if not requests:
+        return "Профилирование выключено."
+    lines = ["Будут профилированы:"]
+    for request in requests:
+        target = f"пользователь {request.user_id}" if request.user_id else "любые пользователи"
+        lines.append(f"• {target}: ещё {request.remaining} задач(и)")
+    return "\n".join(lines)
+
+
+# Профилирование задач: отчёт приходит в чат администратора вместе с результатом задачи
+@dp.callback_query_handler(text="profiling", state="*")
+async def profiling_menu(callback_query: types.CallbackQuery, state: FSMContext):
+    if callback_query.from_user.id not in ADMINS:
+        await callback_query.answer()
+        return
+    await state.finish()
+    await callback_query.message.answer(await _profiling_status(), reply_markup=_profiling_keyboard())
+    await callback_query.answer()
+
+
+@dp.callback_query_handler(text="profile_user", state="*")
+async def profile_user(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id not in ADMINS:
+        await callback_query.answer()
+        return
+    await ProfilingState.user.set()
+    cancel_keyboard = InlineKeyboardMarkup().add(InlineKeyboardButton(text="Отмена", callback_data="profiling"))
+    await callback_query.message.answer(
+        "Отправьте Telegram ID пользователя и, через пробел, количество задач (по умолчанию 1):",
+        reply_markup=cancel_keyboard,
+    )
+    await callback_query.answer()
+
+
+@dp.callback_query_handler(text="profile_next", state="*")
+async def profile_next(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id not in ADMINS:
+        await callback_query.answer()
+        return
+    await ProfilingState.count.set()
+    cancel_keyboard = InlineKeyboardMarkup().add(InlineKeyboardButton(text="Отмена", callback_data="profiling"))
+    await callback_query.message.answer("Сколько следующих задач профилировать?", reply_markup=cancel_keyboard)
+    await callback_query.answer()
+
+
+@dp.message_handler(state=ProfilingState.user)
+async def profile_user_entered(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMINS:
+        return
+    parts = message.text.split()
+    if not parts or len(parts) > 2 or not all(part.isdigit() for part in parts):
+        await message.answer("Нужно число — ID пользователя, и при желании количество задач, например: 123456789 3")
+        return
+    user_id, count = int(parts[0]), int(parts[1]) if len(parts) == 2 else 1
+    await request_profiling(message.chat.id, max(count, 1), user_id=user_id)
+    await state.finish()
+    await message.answer(await _profiling_status(), reply_markup=_profiling_keyboard())
+
+
+@dp.message_handler(state=ProfilingState.count)
+async def profile_next_entered(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMINS:
+        return
+    if not message.text.strip().isdigit() or int(message.text) < 1:
+        await message.answer("Нужно целое число больше нуля.")
+        return
+    await request_profiling(message.chat.id, int(message.text))
+    await state.finish()
+    await message.answer(await _profiling_status(), reply_markup=_profiling_keyboard())
+
+
+@dp.callback_query_handler(text="profile_off", state="*")
+async def profile_off(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id not in ADMINS:
+        await callback_query.answer()
+        return
+    await stop_profiling()
+    await callback_query.message.answer("Профилирование выключено.", reply_markup=_profiling_keyboard())
+    await callback_query.answer()
+
+
+# Доли событий, между которыми переключается кнопка категории логов
+LOG_RATE_STEPS = (0.0, 0.01, 0.1, 1.0)
+LOG_CATEGORY_TITLES = {
+    'updates': "Апдейты Telegram",
+    'sql': "SQL-запросы",
+    'jobs': "Итоги задач",
+}
+
 
+def _rate_text(rate: float) -> str:
+    if rate <= 0:
+        return "выкл"
+    if rate >= 1:
+        return "все"
+    return f"{rate:.0%}"
+
+
+def _log_settings_keyboard() -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    for category, rate in logs.rates().items():
+        title = LOG_CATEGORY_TITLES.get(category, category)
+        keyboard.add(InlineKeyboardButton(text=f"{title}: {_rate_text(rate)}", callback_data=f"log_rate:{category}"))
+    keyboard.add(InlineKeyboardButton(text="Админ меню", callback_data="admin"))
+    return keyboard
+
+
+LOG_SETTINGS_TEXT = (
+    "Логирование. Нажмите на категорию, чтобы переключить долю записываемых событий "
+    "(выкл → 1% → 10% → все). Медленные запросы и ошибки пишутся всегда."
+)
+
+
+@dp.callback_query_handler(text="log_settings", state="*")
+async def log_settings(callback_query: types.CallbackQuery, state: FSMContext):
+    if callback_query.from_user.id not in ADMINS:
+        await callback_query.answer()
+        return
+    await state.finish()
+    await logs.load_rates()
+    await callback_query.message.answer(LOG_SETTINGS_TEXT, reply_markup=_log_settings_keyboard())
+    await callback_query.answer()
+
+
+@dp.callback_query_handler(lambda c: c.data and c.data.startswith('log_rate:'), state="*")
+async def toggle_log_rate(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id not in ADMINS:
+        await callback_query.answer()
+        return
+    category = callback_query.data.split(':', 1)[1]
+    current = logs.rates().get(category)
+    if current is None:
+        await callback_query.answer()
+        return
+    # Следующий шаг после текущего значения, по кругу
+    rate = next((step for step in LOG_RATE_STEPS if step > current), LOG_RATE_STEPS[0])
+    await logs.save_rate(category, rate)
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=_log_settings_keyboard())
+    except Exception:
+        pass
+    await callback_query.answer(f"{LOG_CATEGORY_TITLES.get(category, category)}: {_rate_text(rate)}")
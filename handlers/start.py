@@ -9,6 +9,8 @@ from bot_setup import dp, bot
 from config import BASE_DIR, IMAGE_NAME
 from database.image import get_image_file_id, save_image_file_id
 from database.setup import AccessKey, User, get_session
+from database.users import get_user
+from handlers.sticker import finish_flow
 from texts.start import START_TEXT
 
 # Настройка логгера
@@ -34,6 +36,12 @@ async def grant_access_to_bot(message: types.Message, user_id: int):
         keyboard_start.add(
             InlineKeyboardButton("📝 Умная лента сборки заказов WB FBS", callback_data='process_orders_wb')
         )
+        keyboard_start.add(
+            InlineKeyboardButton("⚡️ WB без Excel: только стикеры", callback_data='process_orders_wb_stickers')
+        )
+        keyboard_start.add(
+            InlineKeyboardButton("🗂 Пакет WB: несколько складов одним ZIP", callback_data='process_orders_wb_batch')
+        )
         keyboard_start.add(
             InlineKeyboardButton("📦 Группировка стикеров OZON", callback_data='process_orders_ozon')
         )
@@ -51,7 +59,7 @@ async def grant_access_to_bot(message: types.Message, user_id: int):
 # Обработчик команды /start
 @dp.message_handler(commands=['start'], state="*")
 async def start(message: types.Message, state: FSMContext):
-    await state.finish()
+    await finish_flow(state)
 
     user_id = message.from_user.id
 
@@ -78,8 +86,7 @@ async def start(message: types.Message, state: FSMContext):
                 return
         else:
             # Проверяем, существует ли уже пользователь в базе данных
-            result = await session.execute(select(User).filter(User.telegram_id == user_id))
-            user = result.scalars().first()
+            user = await get_user(user_id)
 
             if not user:
                 await message.answer("Доступ ограничен. Обратитесь к администратору.")
@@ -91,7 +98,7 @@ async def start(message: types.Message, state: FSMContext):
 
 @dp.callback_query_handler(lambda c: c.data == 'menu', state="*")
 async def start(callback_query: types.CallbackQuery, state: FSMContext):
-    await state.finish()
+    await finish_flow(state)
 
     user_id = callback_query.from_user.id
 
@@ -112,6 +119,12 @@ async def start(callback_query: types.CallbackQuery, state: FSMContext):
         keyboard_start.add(
             InlineKeyboardButton("📝 Умная лента сборки заказов WB FBS", callback_data='process_orders_wb')
         )
+        keyboard_start.add(
+            InlineKeyboardButton("⚡️ WB без Excel: только стикеры", callback_data='process_orders_wb_stickers')
+        )
+        keyboard_start.add(
+            InlineKeyboardButton("🗂 Пакет WB: несколько складов одним ZIP", callback_data='process_orders_wb_batch')
+        )
         keyboard_start.add(
             InlineKeyboardButton("📦 Группировка стикеров OZON", callback_data='process_orders_ozon')
         )
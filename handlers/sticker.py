@@ -1,15 +1,33 @@
+import asyncio
 import os
+import weakref
+import zipfile
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-
-from bot_setup import bot, dp
-from utils.create_pdf import process_files
-from utils.create_ozon_pdf import process_ozon_files
-
-
-TELEGRAM_DOWNLOAD_LIMIT = 20 * 1024 * 1024  # 20 MB bot download limit
+from aiogram.utils.exceptions import RetryAfter
+
+from bot_setup import bot, dp, logger
+from config import DELIVERY_CONCURRENCY, JOB_POLL_INTERVAL, WB_MAX_PDFS
+from database.setup import Job
+from utils.batch import BatchError, estimate_batch_cost, report_lines
+from utils.job_queue import (
+    cancel_subtasks,
+    check_admission,
+    claim_delivery,
+    enqueue_job,
+    finished_jobs,
+    get_job,
+    release_delivery,
+    request_cancel,
+)
+from utils.metrics import BYTES, STAGE_SECONDS
+from utils.profiling import profile_paths
+from utils.scheduler import QueueFull, count_pdf_pages, estimate_ozon_cost, estimate_wb_cost, tenant_for_user
+from utils.telegram_files import UPLOAD_LIMIT, exceeds_download_limit, exceeds_upload_limit, fetch_document
+from utils.tracing import current_context, span
+from utils.workspace import job_dir, new_user_file, remove_job_files, safe_remove, wb_pdf_inputs
 
 
 class Form(StatesGroup):
@@ -17,19 +35,63 @@ class Form(StatesGroup):
     waiting_for_wb_pdf = State()
     waiting_for_ozon_assembly = State()
     waiting_for_ozon_ticket = State()
+    waiting_for_wb_batch = State()
 
 
 def _cancel_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup().add(InlineKeyboardButton(text="Отмена", callback_data="menu"))
 
 
+def _job_cancel_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup().add(InlineKeyboardButton(text="Отмена", callback_data=f"cancel_job:{job_id}"))
+
+
 def _menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup().add(InlineKeyboardButton(text="Главное меню", callback_data="menu"))
 
 
-def _safe_remove(path: str | None) -> None:
-    if path and os.path.exists(path):
-        os.remove(path)
+def _waiting_text(position: int) -> str:
+    text = "Немного подожди, сейчас я сформирую файл."
+    if position:
+        text += f"\nПеред тобой в очереди: {position}."
+    return text
+
+
+async def _answer_queue_full(
+    message: types.Message, state: FSMContext, exc: QueueFull, keyboard: InlineKeyboardMarkup | None = None
+) -> None:
+    if exc.per_tenant:
+        text = f"У тебя уже {exc.queued} файла в очереди. Дождись результата и отправь файл снова."
+    else:
+        text = f"Сейчас очередь обработки заполнена ({exc.queued} задач). Попробуй отправить файл через несколько минут."
+    msg = await message.answer(text, reply_markup=keyboard or _cancel_keyboard())
+    await state.update_data(message_id=msg.message_id)
+
+
+async def _download(message: types.Message, name: str, pipeline: str) -> str:
+    """Возвращает путь к документу: скачанному в рабочий каталог или файлу локального сервера Bot API."""
+    destination = new_user_file(message.from_user.id, name)
+    with STAGE_SECONDS.time(pipeline=pipeline, stage="download"), \
+            span("telegram.download", pipeline=pipeline, file_size=message.document.file_size):
+        path, downloaded = await fetch_document(message.document, destination)
+    if downloaded:
+        BYTES.inc(message.document.file_size or os.path.getsize(path), pipeline=pipeline, direction="in")
+    return path
+
+
+async def _remember_trace(state: FSMContext) -> None:
+    """Следующие апдейты сценария продолжат трассу первого (см. utils.telegram_tracing)."""
+    trace = current_context()
+    if trace is not None:
+        await state.update_data(trace=trace)
+
+
+async def finish_flow(state: FSMContext) -> None:
+    """Завершает сценарий пользователя; поставленные для него индексации PDF больше не нужны."""
+    index_jobs = (await state.get_data()).get('index_jobs')
+    if index_jobs:
+        await cancel_subtasks(index_jobs)
+    await state.finish()
 
 
 async def _clear_previous_keyboard(state: FSMContext, user_id: int) -> None:
@@ -44,7 +106,7 @@ async def _clear_previous_keyboard(state: FSMContext, user_id: int) -> None:
 
 @dp.callback_query_handler(lambda c: c.data == 'process_orders_wb', state='*')
 async def process_orders_wb(callback_query: types.CallbackQuery, state: FSMContext):
-    await state.finish()
+    await finish_flow(state)
     await Form.waiting_for_wb_excel.set()
     keyboard = _cancel_keyboard()
     try:
@@ -55,13 +117,53 @@ async def process_orders_wb(callback_query: types.CallbackQuery, state: FSMConte
         "1️⃣ Пришли мне лист подбора в формате Excel❗️",
         reply_markup=keyboard,
     )
+    await _remember_trace(state)
+    await state.update_data(message_id=msg.message_id)
+    await bot.answer_callback_query(callback_query.id)
+
+
+@dp.callback_query_handler(lambda c: c.data == 'process_orders_wb_stickers', state='*')
+async def process_orders_wb_stickers(callback_query: types.CallbackQuery, state: FSMContext):
+    # Тот же шаг PDF, что и после Excel: без excel_file в сценарии артикулы берутся из прошлых листов подбора
+    await finish_flow(state)
+    await Form.waiting_for_wb_pdf.set()
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    msg = await callback_query.message.answer(
+        "Пришли мне все стикеры в формате PDF — можно несколькими файлами❗️\n"
+        "Артикулы возьму из листов подбора, которые ты присылал раньше. "
+        "Если для части стикеров их не окажется, попрошу лист подбора.",
+        reply_markup=_cancel_keyboard(),
+    )
+    await _remember_trace(state)
+    await state.update_data(message_id=msg.message_id)
+    await bot.answer_callback_query(callback_query.id)
+
+
+@dp.callback_query_handler(lambda c: c.data == 'process_orders_wb_batch', state='*')
+async def process_orders_wb_batch(callback_query: types.CallbackQuery, state: FSMContext):
+    await finish_flow(state)
+    await Form.waiting_for_wb_batch.set()
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    msg = await callback_query.message.answer(
+        "Пришли ZIP-архив с листами подбора (Excel) и стикерами (PDF) всех складов❗️\n"
+        "Пары найдутся по названиям файлов (например, «склад1 лист подбора.xlsx» и «склад1 стикеры.pdf») "
+        "или по номерам стикеров. В ответ придёт один архив с готовыми файлами и отчётом.",
+        reply_markup=_cancel_keyboard(),
+    )
+    await _remember_trace(state)
     await state.update_data(message_id=msg.message_id)
     await bot.answer_callback_query(callback_query.id)
 
 
 @dp.callback_query_handler(lambda c: c.data == 'process_orders_ozon', state='*')
 async def process_orders_ozon(callback_query: types.CallbackQuery, state: FSMContext):
-    await state.finish()
+    await finish_flow(state)
     await Form.waiting_for_ozon_assembly.set()
     keyboard = _cancel_keyboard()
     try:
@@ -72,6 +174,7 @@ async def process_orders_ozon(callback_query: types.CallbackQuery, state: FSMCon
         "1️⃣ Пришли PDF сборочного листа (assembly)❗️",
         reply_markup=keyboard,
     )
+    await _remember_trace(state)
     await state.update_data(message_id=msg.message_id)
     await bot.answer_callback_query(callback_query.id)
 
@@ -85,67 +188,173 @@ async def handle_wb_excel(message: types.Message, state: FSMContext):
         'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
         'application/vnd.ms-excel',
     }:
-        if message.document.file_size and message.document.file_size > TELEGRAM_DOWNLOAD_LIMIT:
+        if exceeds_download_limit(message.document.file_size):
             msg = await message.answer(
                 "Файл превышает 20 МБ и не может быть получен ботом.",
                 reply_markup=_cancel_keyboard(),
             )
             await state.update_data(message_id=msg.message_id)
             return
-        excel_file = f"excel_{message.from_user.id}.xlsx"
-        await message.document.download(destination_file=excel_file)
+        excel_file = await _download(message, "excel.xlsx", 'wb')
         await state.update_data(excel_file=excel_file)
         await Form.waiting_for_wb_pdf.set()
-        msg = await message.answer("2️⃣ Пришли мне все стикеры в формате PDF❗️", reply_markup=_cancel_keyboard())
+        if (await state.get_data()).get('pdf_files'):
+            # Стикеры уже присланы в режиме «только стикеры», не хватило сохранённых артикулов
+            await _enqueue_wb(message, state, message.from_user.id)
+            return
+        msg = await message.answer(
+            "2️⃣ Пришли мне все стикеры в формате PDF — можно несколькими файлами❗️", reply_markup=_cancel_keyboard()
+        )
     else:
         msg = await message.answer("Пожалуйста, отправьте файл в формате Excel.", reply_markup=_cancel_keyboard())
 
     await state.update_data(message_id=msg.message_id)
 
 
+# Стикеры WB можно прислать несколькими PDF: скачивания идут параллельно (апдейты одной
+# пачки polling обрабатывает одновременно), список файлов в FSM меняется под замком
+_wb_pdf_downloads: dict[int, set[asyncio.Future]] = {}
+_wb_pdf_locks = weakref.WeakValueDictionary()  # user_id -> asyncio.Lock списка файлов сценария
+
+
+def _pdfs_keyboard() -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    keyboard.add(
+        InlineKeyboardButton(text="Готово", callback_data="wb_pdfs_done"),
+        InlineKeyboardButton(text="Отмена", callback_data="menu"),
+    )
+    return keyboard
+
+
+async def _enqueue_wb_index(pdf_file: str, user_id: int) -> int | None:
+    """Ставит в очередь индексацию PDF, пока пользователь присылает остальные; возвращает номер задачи."""
+    try:
+        cost = await asyncio.to_thread(count_pdf_pages, pdf_file)
+        enqueued = await enqueue_job(
+            'wb_index',
+            {'inputs': {'pdf': pdf_file}, 'output_name': ''},
+            tenant=tenant_for_user(user_id),
+            cost=cost,
+            user_id=user_id,
+        )
+    except Exception:
+        # Без готового индекса файл проиндексирует сама задача WB
+        logger.exception("Не удалось поставить в очередь индексацию %s", pdf_file)
+        return None
+    return enqueued.job_id
+
+
+async def _receive_wb_pdf(message: types.Message, state: FSMContext) -> int:
+    """Скачивает PDF и добавляет его в список файлов сценария; возвращает число принятых файлов."""
+    pdf_file = await _download(message, "stickers.pdf", 'wb')
+    index_job = await _enqueue_wb_index(pdf_file, message.from_user.id)
+    lock = _wb_pdf_locks.setdefault(message.from_user.id, asyncio.Lock())
+    async with lock:
+        user_data = await state.get_data()
+        pdf_files = user_data.get('pdf_files', []) + [pdf_file]
+        # Номера задач индексации идут в том же порядке, что и файлы
+        index_jobs = user_data.get('index_jobs', []) + [index_job]
+        await state.update_data(pdf_files=pdf_files, index_jobs=index_jobs)
+    return len(pdf_files)
+
+
 @dp.message_handler(state=Form.waiting_for_wb_pdf, content_types=types.ContentType.DOCUMENT)
 async def handle_wb_pdf(message: types.Message, state: FSMContext):
     await _clear_previous_keyboard(state, message.from_user.id)
 
     if message.document.mime_type != 'application/pdf':
-        msg = await message.answer("Пожалуйста, отправьте файл в формате PDF.", reply_markup=_cancel_keyboard())
+        msg = await message.answer("Пожалуйста, отправьте файл в формате PDF.", reply_markup=_pdfs_keyboard())
         await state.update_data(message_id=msg.message_id)
         return
 
-    if message.document.file_size and message.document.file_size > TELEGRAM_DOWNLOAD_LIMIT:
+    if exceeds_download_limit(message.document.file_size):
         msg = await message.answer(
             "Файл превышает 20 МБ и не может быть получен ботом.",
-            reply_markup=_cancel_keyboard(),
+            reply_markup=_pdfs_keyboard(),
         )
         await state.update_data(message_id=msg.message_id)
         return
 
-    pdf_file = f"pdf_{message.from_user.id}.pdf"
-    await message.document.download(destination_file=pdf_file)
-    await state.update_data(pdf_file=pdf_file)
-    await message.answer("Немного подожди, сейчас я сформирую файл.")
+    user_id = message.from_user.id
+    received = len((await state.get_data()).get('pdf_files', [])) + len(_wb_pdf_downloads.get(user_id, ()))
+    if received >= WB_MAX_PDFS:
+        # Каждый файл сразу ставится на индексацию: число файлов сценария ограничено
+        msg = await message.answer(
+            f"Можно прислать не больше {WB_MAX_PDFS} файлов со стикерами. Нажми «Готово»❗️",
+            reply_markup=_pdfs_keyboard(),
+        )
+        await state.update_data(message_id=msg.message_id)
+        return
 
-    user_data = await state.get_data()
-    excel_path = user_data.get('excel_file')
-    pdf_path = user_data.get('pdf_file')
-    output_pdf_path = f"modified_{message.from_user.id}.pdf"
+    tenant = tenant_for_user(user_id)
+    try:
+        await check_admission(tenant)
+    except QueueFull as exc:
+        await _answer_queue_full(message, state, exc, _pdfs_keyboard())
+        return
 
-    success = await process_files(excel_path, pdf_path, output_pdf_path)
-    keyboard = _menu_keyboard()
+    receiving = asyncio.ensure_future(_receive_wb_pdf(message, state))
+    _wb_pdf_downloads.setdefault(user_id, set()).add(receiving)
+    try:
+        count = await receiving
+    finally:
+        pending = _wb_pdf_downloads.get(user_id, set())
+        pending.discard(receiving)
+        if not pending:
+            _wb_pdf_downloads.pop(user_id, None)
+
+    msg = await message.answer(
+        f"Принято файлов со стикерами: {count}. Если стикеры поставки в нескольких PDF — пришли остальные, "
+        "затем нажми «Готово»❗️",
+        reply_markup=_pdfs_keyboard(),
+    )
+    await state.update_data(message_id=msg.message_id)
 
-    if success and os.path.exists(output_pdf_path):
-        with open(output_pdf_path, 'rb') as file:
-            await bot.send_document(message.from_user.id, file)
-        await message.answer("✅ Обработка завершена.", reply_markup=keyboard)
-    else:
-        await message.answer(
-            "Произошла ошибка при обработке файлов. Пожалуйста, проверьте формат файлов и попробуйте снова.",
-            reply_markup=keyboard,
+
+@dp.callback_query_handler(lambda c: c.data == 'wb_pdfs_done', state=Form.waiting_for_wb_pdf)
+async def handle_wb_pdfs_done(callback_query: types.CallbackQuery, state: FSMContext):
+    user_id = callback_query.from_user.id
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    await asyncio.gather(*_wb_pdf_downloads.get(user_id, ()), return_exceptions=True)
+
+    if not (await state.get_data()).get('pdf_files'):
+        await bot.answer_callback_query(callback_query.id, "Сначала пришли PDF со стикерами.")
+        return
+    await bot.answer_callback_query(callback_query.id)
+    await _enqueue_wb(callback_query.message, state, user_id)
+
+
+async def _enqueue_wb(message: types.Message, state: FSMContext, user_id: int) -> None:
+    """Ставит в очередь задачу WB из файлов сценария; без листа подбора — по сохранённым артикулам."""
+    user_data = await state.get_data()
+    excel_file = user_data.get('excel_file')
+    pdf_files = user_data['pdf_files']
+    cost = await asyncio.to_thread(estimate_wb_cost, excel_file, pdf_files)
+    inputs = {'excel': excel_file} if excel_file else {}
+    inputs['pdf'] = pdf_files[0]
+    inputs.update({f'pdf_{n}': path for n, path in enumerate(pdf_files[1:], start=2)})
+    try:
+        enqueued = await enqueue_job(
+            'wb',
+            {
+                'inputs': inputs,
+                'output_name': f"modified_{user_id}.pdf",
+                'index_jobs': user_data.get('index_jobs', []),
+            },
+            tenant=tenant_for_user(user_id),
+            cost=cost,
+            chat_id=message.chat.id,
+            user_id=user_id,
         )
+    except QueueFull as exc:
+        # Файлы остаются в сценарии: можно нажать «Готово» ещё раз, когда очередь освободится
+        await _answer_queue_full(message, state, exc, _pdfs_keyboard())
+        return
 
-    _safe_remove(excel_path)
-    _safe_remove(pdf_path)
-    _safe_remove(output_pdf_path)
+    await message.answer(_waiting_text(enqueued.position), reply_markup=_job_cancel_keyboard(enqueued.job_id))
     await state.finish()
 
 
@@ -158,7 +367,7 @@ async def handle_ozon_assembly(message: types.Message, state: FSMContext):
         await state.update_data(message_id=msg.message_id)
         return
 
-    if message.document.file_size and message.document.file_size > TELEGRAM_DOWNLOAD_LIMIT:
+    if exceeds_download_limit(message.document.file_size):
         msg = await message.answer(
             "Файл превышает 20 МБ и не может быть получен ботом.",
             reply_markup=_cancel_keyboard(),
@@ -166,8 +375,7 @@ async def handle_ozon_assembly(message: types.Message, state: FSMContext):
         await state.update_data(message_id=msg.message_id)
         return
 
-    assembly_file = f"ozon_assembly_{message.from_user.id}.pdf"
-    await message.document.download(destination_file=assembly_file)
+    assembly_file = await _download(message, "assembly.pdf", 'ozon')
     await state.update_data(assembly_file=assembly_file)
     await Form.waiting_for_ozon_ticket.set()
     msg = await message.answer("2️⃣ Пришли PDF со стикерами (ticket)❗️", reply_markup=_cancel_keyboard())
@@ -183,7 +391,7 @@ async def handle_ozon_ticket(message: types.Message, state: FSMContext):
         await state.update_data(message_id=msg.message_id)
         return
 
-    if message.document.file_size and message.document.file_size > TELEGRAM_DOWNLOAD_LIMIT:
+    if exceeds_download_limit(message.document.file_size):
         msg = await message.answer(
             "Файл превышает 20 МБ и не может быть получен ботом.",
             reply_markup=_cancel_keyboard(),
@@ -191,30 +399,303 @@ async def handle_ozon_ticket(message: types.Message, state: FSMContext):
         await state.update_data(message_id=msg.message_id)
         return
 
-    ticket_file = f"ozon_ticket_{message.from_user.id}.pdf"
-    await message.document.download(destination_file=ticket_file)
-    await state.update_data(ticket_file=ticket_file)
-    await message.answer("Немного подожди, сейчас я сформирую файл.")
+    tenant = tenant_for_user(message.from_user.id)
+    try:
+        await check_admission(tenant)
+    except QueueFull as exc:
+        await _answer_queue_full(message, state, exc)
+        return
+
+    ticket_file = await _download(message, "ticket.pdf", 'ozon')
 
     user_data = await state.get_data()
-    assembly_path = user_data.get('assembly_file')
-    ticket_path = user_data.get('ticket_file')
-    output_pdf_path = f"ozon_sorted_{message.from_user.id}.pdf"
+    cost = await asyncio.to_thread(estimate_ozon_cost, ticket_file)
+    try:
+        enqueued = await enqueue_job(
+            'ozon',
+            {
+                'inputs': {'assembly': user_data.get('assembly_file'), 'ticket': ticket_file},
+                'output_name': f"ozon_sorted_{message.from_user.id}.pdf",
+            },
+            tenant=tenant,
+            cost=cost,
+            chat_id=message.chat.id,
+            user_id=message.from_user.id,
+        )
+    except QueueFull as exc:
+        safe_remove(ticket_file)
+        await _answer_queue_full(message, state, exc)
+        return
 
-    success = await process_ozon_files(assembly_path, ticket_path, output_pdf_path)
-    keyboard = _menu_keyboard()
+    await message.answer(_waiting_text(enqueued.position), reply_markup=_job_cancel_keyboard(enqueued.job_id))
+    await state.finish()
 
-    if success and os.path.exists(output_pdf_path):
-        with open(output_pdf_path, 'rb') as file:
-            await bot.send_document(message.from_user.id, file)
-        await message.answer("✅ Обработка завершена.", reply_markup=keyboard)
-    else:
-        await message.answer(
-            "Не удалось обработать файлы OZON. Проверь, что отправил сборочный лист и стикеры в формате PDF и попробуй снова.",
-            reply_markup=keyboard,
+
+_ZIP_MIME_TYPES = {'application/zip', 'application/x-zip-compressed', 'application/x-zip'}
+
+
+@dp.message_handler(state=Form.waiting_for_wb_batch, content_types=types.ContentType.DOCUMENT)
+async def handle_wb_batch(message: types.Message, state: FSMContext):
+    await _clear_previous_keyboard(state, message.from_user.id)
+
+    file_name = (message.document.file_name or '').lower()
+    if message.document.mime_type not in _ZIP_MIME_TYPES and not file_name.endswith('.zip'):
+        msg = await message.answer("Пожалуйста, отправьте ZIP-архив.", reply_markup=_cancel_keyboard())
+        await state.update_data(message_id=msg.message_id)
+        return
+
+    if exceeds_download_limit(message.document.file_size):
+        msg = await message.answer(
+            "Файл превышает 20 МБ и не может быть получен ботом.",
+            reply_markup=_cancel_keyboard(),
+        )
+        await state.update_data(message_id=msg.message_id)
+        return
+
+    tenant = tenant_for_user(message.from_user.id)
+    try:
+        await check_admission(tenant)
+    except QueueFull as exc:
+        await _answer_queue_full(message, state, exc)
+        return
+
+    archive_file = await _download(message, "batch.zip", 'wb_batch')
+    try:
+        cost = await asyncio.to_thread(estimate_batch_cost, archive_file)
+    except (BatchError, zipfile.BadZipFile) as exc:
+        safe_remove(archive_file)
+        msg = await message.answer(f"Не удалось прочитать архив: {exc}", reply_markup=_cancel_keyboard())
+        await state.update_data(message_id=msg.message_id)
+        return
+    try:
+        enqueued = await enqueue_job(
+            'wb_batch',
+            {
+                'inputs': {'archive': archive_file},
+                'output_name': f"stickers_{message.from_user.id}.zip",
+            },
+            tenant=tenant,
+            cost=cost,
+            chat_id=message.chat.id,
+            user_id=message.from_user.id,
         )
+    except QueueFull as exc:
+        safe_remove(archive_file)
+        await _answer_queue_full(message, state, exc)
+        return
 
-    _safe_remove(assembly_path)
-    _safe_remove(ticket_path)
-    _safe_remove(output_pdf_path)
+    await message.answer(_waiting_text(enqueued.position), reply_markup=_job_cancel_keyboard(enqueued.job_id))
     await state.finish()
+
+
+@dp.callback_query_handler(lambda c: c.data and c.data.startswith('cancel_job:'), state='*')
+async def cancel_job(callback_query: types.CallbackQuery, state: FSMContext):
+    job_id = int(callback_query.data.split(':', 1)[1])
+    status, payload = await request_cancel(job_id, callback_query.from_user.id)
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+
+    if status == 'cancelled':
+        # Задача ещё не начиналась — файлы удаляем сами, воркер её уже не увидит
+        remove_job_files(job_id, payload)
+    if status in ('cancelled', 'cancelling') and 'profile' in payload:
+        # Результат отменённой задачи не доставляется: администратор узнаёт о судьбе профиля здесь
+        try:
+            await bot.send_message(
+                payload['profile']['admin_chat_id'], f"Профиль задачи {job_id} не создан: пользователь отменил обработку."
+            )
+        except Exception:
+            logger.exception("Не удалось сообщить об отмене профилируемой задачи %s", job_id)
+    if status in ('cancelled', 'cancelling'):
+        await callback_query.message.answer("Обработка отменена.", reply_markup=_menu_keyboard())
+        await bot.answer_callback_query(callback_query.id)
+    else:
+        await bot.answer_callback_query(callback_query.id, "Обработка уже завершена.")
+
+
+_FAILURE_TEXT = {
+    'wb': "Произошла ошибка при обработке файлов. Пожалуйста, проверьте формат файлов и попробуйте снова.",
+    'ozon': "Не удалось обработать файлы OZON. Проверь, что отправил сборочный лист и стикеры в формате PDF и попробуй снова.",
+    'wb_batch': "Не удалось обработать архив. Проверь, что в ZIP лежат листы подбора Excel и стикеры PDF, и попробуй снова.",
+}
+_MESSAGE_LIMIT = 4096
+_TOO_LARGE_TEXT = (
+    "Файл слишком большой или сложный для обработки. "
+    "Попробуй разбить заказы на несколько файлов поменьше и отправить их по очереди."
+)
+_UPLOAD_TOO_LARGE_TEXT = (
+    f"Готовый файл больше {UPLOAD_LIMIT // 2**20} МБ, бот не может его отправить. "
+    "Попробуй разбить заказы на несколько файлов поменьше и отправить их по очереди."
+)
+
+
+async def _deliver(job: Job) -> None:
+    with span("job.deliver", parent=job.payload.get('trace'), job_id=job.id, status=job.status):
+        await _deliver_result(job)
+
+
+async def _deliver_result(job: Job) -> None:
+    keyboard = _menu_keyboard()
+    output_pdf_path = (job.result or {}).get('output')
+    keep_inputs = False
+
+    # Ошибка отправки уходит наверх, файлы задачи остаются для повторной попытки (release_delivery)
+    if job.status == 'done' and output_pdf_path and os.path.exists(output_pdf_path) \
+            and exceeds_upload_limit(os.path.getsize(output_pdf_path)):
+        await bot.send_message(job.chat_id, _UPLOAD_TOO_LARGE_TEXT, reply_markup=keyboard)
+    elif job.status == 'done' and output_pdf_path and os.path.exists(output_pdf_path):
+        with open(output_pdf_path, 'rb') as file, STAGE_SECONDS.time(pipeline=job.kind, stage="upload"), \
+                span("telegram.send_document", file_size=os.path.getsize(output_pdf_path)):
+            await bot.send_document(job.chat_id, file)
+        BYTES.inc(os.path.getsize(output_pdf_path), pipeline=job.kind, direction="out")
+        await bot.send_message(job.chat_id, _done_text(job), reply_markup=keyboard)
+    elif (job.result or {}).get('reason') == 'needs_excel':
+        await _ask_for_excel(job)
+        keep_inputs = True
+    elif (job.result or {}).get('reason') == 'too_large':
+        await bot.send_message(job.chat_id, _TOO_LARGE_TEXT, reply_markup=keyboard)
+    else:
+        await bot.send_message(job.chat_id, _failure_text(job), reply_markup=keyboard)
+    if 'profile' in job.payload:
+        await _send_profile(job)
+    # PDF, к которым можно дослать лист подбора, удалит уборщик, если их не заберёт сценарий
+    remove_job_files(job.id, {} if keep_inputs else job.payload)
+
+
+async def _ask_for_excel(job: Job) -> None:
+    """Для задачи «только стикеры» не хватило артикулов: предлагаем дослать лист подбора к тем же PDF.
+
+    Сценарий здесь не меняется: в режиме вебхука результаты отправляет не тот
+    процесс, что обслуживает чат. Его начинает кнопка (handle_wb_add_excel).
+    """
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    keyboard.add(
+        InlineKeyboardButton(text="Прислать лист подбора", callback_data=f"wb_add_excel:{job.id}"),
+        InlineKeyboardButton(text="Главное меню", callback_data="menu"),
+    )
+    await bot.send_message(
+        job.chat_id,
+        f"Не нашёл сохранённых артикулов для части стикеров: {job.result['error']}.\n"
+        "Пришли к этим стикерам лист подбора в формате Excel — стикеры заново отправлять не нужно.",
+        reply_markup=keyboard,
+    )
+
+
+@dp.callback_query_handler(lambda c: c.data and c.data.startswith('wb_add_excel:'), state='*')
+async def handle_wb_add_excel(callback_query: types.CallbackQuery, state: FSMContext):
+    job = await get_job(int(callback_query.data.split(':', 1)[1]))
+    try:
+        await callback_query.message.edit_reply_markup(reply_markup=None)
+    except Exception:
+        pass
+    owned = job is not None and job.user_id == callback_query.from_user.id
+    pdf_files = wb_pdf_inputs(job.payload['inputs']) if owned else []
+    if not pdf_files or not all(os.path.exists(path) for path in pdf_files):
+        # PDF задачи без сценария удаляет уборщик через WORKSPACE_ORPHAN_TTL
+        await bot.answer_callback_query(callback_query.id)
+        await callback_query.message.answer(
+            "Стикеры этой задачи уже удалены. Начни заново и пришли стикеры вместе с листом подбора.",
+            reply_markup=_menu_keyboard(),
+        )
+        return
+
+    await finish_flow(state)
+    await Form.waiting_for_wb_excel.set()
+    msg = await callback_query.message.answer(
+        "Пришли мне лист подбора в формате Excel — стикеры у меня уже есть❗️", reply_markup=_cancel_keyboard()
+    )
+    await _remember_trace(state)
+    await state.update_data(
+        pdf_files=pdf_files, index_jobs=job.payload.get('index_jobs', []), message_id=msg.message_id
+    )
+    await bot.answer_callback_query(callback_query.id)
+
+
+def _done_text(job: Job) -> str:
+    text = "✅ Обработка завершена."
+    if job.result.get('unknown'):
+        text += (
+            f"\nДля {job.result['unknown']} стикеров не нашлось сохранённых артикулов — "
+            "они в конце, в группе «Без артикула»."
+        )
+    if job.kind == 'wb_batch':
+        # Отчёт по парам; полный — в архиве
+        report = "\n".join(report_lines(job.result.get('pairs', []), job.result.get('unpaired', [])))
+        text = f"{text}\n\n{report}"
+        if len(text) > _MESSAGE_LIMIT:
+            text = text[:_MESSAGE_LIMIT - 30].rsplit("\n", 1)[0] + "\n… полный отчёт в архиве"
+    return text
+
+
+def _failure_text(job: Job) -> str:
+    error = (job.result or {}).get('error') or ''
+    if job.kind == 'wb_batch' and error.startswith(f"{BatchError.__name__}: "):
+        # Причина понятна пользователю: не тот архив, нет пар и т.п.
+        return f"Не удалось обработать архив: {error.split(': ', 1)[1]}."
+    return _FAILURE_TEXT[job.kind]
+
+
+async def _send_profile(job: Job) -> None:
+    """Отправляет администратору профиль задачи, включённый из админ-панели."""
+    admin_chat_id = job.payload['profile']['admin_chat_id']
+    output = os.path.join(job_dir(job.id), job.payload['output_name'])
+    paths = [path for path in profile_paths(output) if os.path.exists(path)]
+    try:
+        if not paths:
+            await bot.send_message(admin_chat_id, f"Профиль задачи {job.id} не создан (статус: {job.status}).")
+            return
+        await bot.send_message(
+            admin_chat_id,
+            f"Профиль задачи {job.id} ({job.kind}, пользователь {job.user_id}, статус: {job.status}).\n"
+            "Файл .collapsed открывается в speedscope или flamegraph.pl.",
+        )
+        for path in paths:
+            filename = f"job{job.id}_{os.path.basename(path)}"
+            with open(path, 'rb') as file:
+                await bot.send_document(admin_chat_id, types.InputFile(file, filename=filename))
+    except Exception:
+        logger.exception("Не удалось отправить профиль задачи %s", job.id)
+
+
+async def _deliver_claimed(job: Job) -> None:
+    """Отправляет результат задачи; при ошибке возвращает его в очередь доставки."""
+    if not await claim_delivery(job.id):
+        return
+    try:
+        await _deliver(job)
+    except Exception as exc:
+        logger.exception("Не удалось отправить результат задачи %s", job.id)
+        retry_in = exc.timeout if isinstance(exc, RetryAfter) else min(300, 5 * 2 ** job.delivery_failures)
+        if not await release_delivery(job.id, retry_in):
+            logger.error("Результат задачи %s так и не отправлен, попытки исчерпаны", job.id)
+            if 'profile' in job.payload:
+                await _send_profile(job)
+            remove_job_files(job.id, job.payload)
+
+
+async def deliver_results() -> None:
+    """Send finished jobs back to their chats; runs for the lifetime of the bot."""
+    # Отправки идут параллельно: большой файл одного чата не задерживает остальные
+    sending = asyncio.Semaphore(DELIVERY_CONCURRENCY)
+    in_flight: set[int] = set()
+
+    async def deliver(job: Job) -> None:
+        try:
+            async with sending:
+                await _deliver_claimed(job)
+        except Exception:
+            logger.exception("Ошибка при доставке задачи %s", job.id)
+        finally:
+            in_flight.discard(job.id)
+
+    while True:
+        try:
+            for job in await finished_jobs():
+                if job.id not in in_flight:
+                    in_flight.add(job.id)
+                    asyncio.ensure_future(deliver(job))
+        except Exception:
+            logger.exception("Ошибка при опросе готовых задач")
+        await asyncio.sleep(JOB_POLL_INTERVAL)
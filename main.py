@@ -1,8 +1,17 @@
+import asyncio
+
 from aiogram import executor
 from aiogram.types import BotCommand
 
 from bot_setup import bot, dp
+from config import METRICS_HOST, METRICS_PORT, WEBHOOK_URL, WORKER_INLINE
+from database.setup import init_db
 from handlers import admin, start, sticker
+from utils.janitor import start_janitor
+from utils.job_queue import start_profiling_refresh
+from utils.logs import start_rate_refresh
+from utils.metrics import STARTUP_SECONDS
+from utils.warmup import process_uptime, warm_up_bot
 
 
 async def set_commands():
@@ -11,8 +20,49 @@ async def set_commands():
     ]
     await bot.set_my_commands(commands)
 
+_delivery_task = None
+_inline_worker = None
+_inline_worker_task = None
+_metrics_runner = None
+
+
 async def on_startup(_):
+    global _delivery_task, _inline_worker, _inline_worker_task, _metrics_runner
+    await init_db()
+    await warm_up_bot()
     await set_commands()
+    start_rate_refresh()
+    start_profiling_refresh()
+    start_janitor(dp.storage)
+    if METRICS_PORT:
+        from utils.metrics import start_metrics_server
+
+        _metrics_runner = await start_metrics_server(METRICS_PORT, METRICS_HOST)
+    _delivery_task = asyncio.ensure_future(sticker.deliver_results())
+    if WORKER_INLINE:
+        from utils.job_worker import JobWorker
+
+        _inline_worker = JobWorker()
+        # Бот начинает принимать обновления, когда процессы обработки прогреты
+        _inline_worker_task = await _inline_worker.start()
+    STARTUP_SECONDS.set(process_uptime(), process="bot")
+
+
+async def on_shutdown(_):
+    if _inline_worker is not None:
+        # Воркер дожидается текущих задач, новые не берёт
+        _inline_worker.stop()
+        await _inline_worker_task
+    if _delivery_task is not None:
+        _delivery_task.cancel()
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+
 
 if __name__ == '__main__':
-    executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+    if WEBHOOK_URL:
+        import webhook
+
+        webhook.serve()
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
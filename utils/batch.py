@@ -0,0 +1,232 @@
+"""Batch mode: a ZIP archive with several WB pick list / sticker PDF pairs.
+
+``plan_batch`` runs in a pool process: it unpacks the archive, pairs every
+pick list with its stickers and returns the pairs. Files are paired by name
+first ("склад1 лист подбора.xlsx" and "склад1 стикеры.pdf" share the key
+"склад1"); what is left is paired by the sticker numbers the pick list and
+the first pages of the PDF have in common. Each pair is then an ordinary
+``wb`` run on the pool (see ``utils.job_worker``) and ``pack_results`` puts
+the outputs and a per-pair report into one ZIP.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import zipfile
+from collections import Counter
+
+from config import BATCH_MAX_FILES, BATCH_MAX_UNPACKED_MB
+from utils.cancellation import NEVER, CancelToken
+from utils.scheduler import AVG_PAGE_BYTES, count_pages_in_stream, estimate_cost
+
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+PDF_EXTENSIONS = (".pdf",)
+REPORT_NAME = "отчёт.txt"
+SAMPLE_PAGES = 20  # Страниц PDF, по которым ищутся общие со списком подбора стикеры
+
+# Слова, которыми в имени файла отличаются лист подбора и стикеры одного склада
+_NAME_NOISE = re.compile(
+    r"лист[а-я]*|подбор[а-я]*|стикер[а-я]*|этикет[а-я]*|заказ[а-я]*|поставк[а-я]*|"
+    r"pick(ing)?|list|stickers?|labels?|orders?|supply",
+    re.IGNORECASE,
+)
+_NAME_SEPARATORS = re.compile(r"[\W_]+")
+
+
+class BatchError(ValueError):
+    """The archive cannot be processed as a batch."""
+
+
+def _pair_key(name: str) -> str:
+    stem = os.path.splitext(os.path.basename(name))[0].lower()
+    return _NAME_SEPARATORS.sub("", _NAME_NOISE.sub(" ", stem))
+
+
+def _members(archive: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    """Pick lists and PDFs of the archive, without folders and macOS metadata."""
+    members = []
+    for info in archive.infolist():
+        base = os.path.basename(info.filename)
+        if info.is_dir() or not base or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+            continue
+        if base.lower().endswith(EXCEL_EXTENSIONS + PDF_EXTENSIONS):
+            members.append(info)
+    if not members:
+        raise BatchError("в архиве нет файлов Excel и PDF")
+    if len(members) > BATCH_MAX_FILES:
+        raise BatchError(f"в архиве {len(members)} файлов, максимум {BATCH_MAX_FILES}")
+    if sum(info.file_size for info in members) > BATCH_MAX_UNPACKED_MB * 2**20:
+        raise BatchError(f"архив распаковывается больше чем в {BATCH_MAX_UNPACKED_MB} МБ")
+    return members
+
+
+def _member_name(info: zipfile.ZipInfo) -> str:
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        # Без флага UTF-8 zipfile читает имена как cp437; архиваторы Windows пишут их в cp866
+        try:
+            name = name.encode("cp437").decode("cp866")
+        except UnicodeError:
+            pass
+    return os.path.basename(name)
+
+
+def unpack(archive_path: str, directory: str) -> list[str]:
+    """Extract pick lists and PDFs into ``directory`` (flat, names made unique); return their paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in _members(archive):
+            name = _member_name(info)
+            stem, extension = os.path.splitext(name)
+            path, n = os.path.join(directory, name), 1
+            while path in paths:
+                n += 1
+                path = os.path.join(directory, f"{stem} ({n}){extension}")
+            with archive.open(info) as src, open(path, "wb") as dst:
+                while chunk := src.read(2**20):
+                    dst.write(chunk)
+            paths.append(path)
+    return paths
+
+
+def _excel_stickers(path: str) -> set[str]:
+    import pandas as pd
+
+    data = pd.read_excel(path, header=1)
+    return {str(value).strip() for value in data.iloc[:, 7].dropna()}
+
+
+def _pdf_stickers(path: str, cancel: CancelToken) -> set[str]:
+    import fitz  # PyMuPDF
+
+    from utils.create_pdf import _sticker_number
+
+    stickers = set()
+    with fitz.open(path) as doc:
+        for page in doc.pages(0, min(SAMPLE_PAGES, doc.page_count)):
+            cancel.check()
+            number = _sticker_number(page.get_text())
+            if number:
+                stickers.add(number)
+    return stickers
+
+
+def pair_files(paths: list[str], cancel: CancelToken = NEVER) -> tuple[list[dict], list[str]]:
+    """Pair pick lists with sticker PDFs; return (pairs, names of files left without a pair).
+
+    A pair is {"name", "excel", "pdf", "matched_by"}.
+    """
+    excels = [path for path in paths if path.lower().endswith(EXCEL_EXTENSIONS)]
+    pdfs = [path for path in paths if path.lower().endswith(PDF_EXTENSIONS)]
+    pairs = []
+
+    by_key: dict[str, list[str]] = {}
+    for path in excels + pdfs:
+        by_key.setdefault(_pair_key(path), []).append(path)
+    for key, group in by_key.items():
+        group_excels = [path for path in group if path in excels]
+        group_pdfs = [path for path in group if path in pdfs]
+        # По имени — только однозначные пары; остальное решают номера стикеров
+        if key and len(group_excels) == 1 and len(group_pdfs) == 1:
+            pairs.append({"name": key, "excel": group_excels[0], "pdf": group_pdfs[0], "matched_by": "name"})
+            excels.remove(group_excels[0])
+            pdfs.remove(group_pdfs[0])
+
+    if excels and pdfs:
+        excel_stickers = {}
+        for path in excels:
+            try:
+                excel_stickers[path] = _excel_stickers(path)
+            except Exception:
+                excel_stickers[path] = set()  # Не лист подбора: останется без пары
+        pdf_stickers = {path: _pdf_stickers(path, cancel) for path in pdfs}
+        candidates = sorted(
+            (
+                (len(excel_stickers[excel] & pdf_stickers[pdf]), excel, pdf)
+                for excel in excels for pdf in pdfs
+            ),
+            reverse=True,
+        )
+        for common, excel, pdf in candidates:
+            if not common:
+                break
+            if excel in excels and pdf in pdfs:
+                name = os.path.splitext(os.path.basename(excel))[0]
+                pairs.append({"name": name, "excel": excel, "pdf": pdf, "matched_by": "stickers"})
+                excels.remove(excel)
+                pdfs.remove(pdf)
+
+    names = Counter(pair["name"] for pair in pairs)
+    for pair in pairs:
+        # Одинаковые ключи у разных пар не должны перезаписать результаты друг друга
+        if not pair["name"] or names[pair["name"]] > 1:
+            pair["name"] = os.path.splitext(os.path.basename(pair["pdf"]))[0]
+    pairs.sort(key=lambda pair: pair["name"])
+    return pairs, [os.path.basename(path) for path in excels + pdfs]
+
+
+def plan_batch(archive_path: str, directory: str, cancel: CancelToken = NEVER) -> dict:
+    """Unpack the archive into ``directory`` and pair its files (pool-side step of a batch job)."""
+    try:
+        paths = unpack(archive_path, os.path.join(directory, "inputs"))
+    except zipfile.BadZipFile as exc:
+        raise BatchError(f"не ZIP-архив: {exc}") from exc
+    pairs, unpaired = pair_files(paths, cancel)
+    if not pairs:
+        raise BatchError("в архиве не нашлось ни одной пары лист подбора + стикеры")
+    return {"pairs": pairs, "unpaired": unpaired}
+
+
+def estimate_batch_cost(archive_path: str) -> float:
+    """Cost of a batch job from a cheap look into the archive: all pages x the largest pick list."""
+    pages, articles = 0, 1
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in _members(archive):
+            name = info.filename.lower()
+            if name.endswith(PDF_EXTENSIONS):
+                with archive.open(info) as fh:
+                    pages += count_pages_in_stream(fh) or max(1, info.file_size // AVG_PAGE_BYTES)
+            elif name.endswith(".xlsx"):
+                from utils.scheduler import count_excel_articles
+
+                try:
+                    with archive.open(info) as fh:
+                        articles = max(articles, count_excel_articles(fh))
+                except Exception:
+                    pass
+    return estimate_cost(pages, articles)
+
+
+_STATUS_TEXT = {
+    "done": "готово",
+    "failed": "ошибка",
+    "too_large": "слишком большой",
+    "cancelled": "отменено",
+}
+
+
+def report_lines(pairs: list[dict], unpaired: list[str]) -> list[str]:
+    lines = []
+    for pair in pairs:
+        line = f"{pair['name']}: {_STATUS_TEXT.get(pair['status'], pair['status'])}"
+        if pair["status"] == "done":
+            line += f", стикеров {pair.get('pages', 0)}, артикулов {pair.get('articles', 0)}"
+        elif pair.get("error"):
+            line += f" ({pair['error']})"
+        line += f" — {os.path.basename(pair['excel'])} + {os.path.basename(pair['pdf'])}"
+        lines.append(line)
+    for name in unpaired:
+        lines.append(f"{name}: без пары, не обработан")
+    return lines
+
+
+def pack_results(output: str, pairs: list[dict], unpaired: list[str]) -> None:
+    """Write the outputs of successful pairs and the report into the ``output`` ZIP."""
+    # PDF уже сжаты: повторное сжатие только тратит процессор
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as archive:
+        for pair in pairs:
+            if pair["status"] == "done":
+                archive.write(pair["output"], f"{pair['name']}.pdf")
+        archive.writestr(REPORT_NAME, "\n".join(report_lines(pairs, unpaired)) + "\n")
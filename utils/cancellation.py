@@ -0,0 +1,29 @@
+"""Cooperative cancellation of running pipelines."""
+
+from __future__ import annotations
+
+
+class JobCancelled(Exception):
+    """The user cancelled the job while it was running."""
+
+
+class CancelToken:
+    """Checked by the pipelines between pages and stages.
+
+    Wraps a ``multiprocessing.Event`` set by the parent process; a token
+    without an event is never cancelled.
+    """
+
+    def __init__(self, event=None):
+        self._event = event
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event is not None and self._event.is_set()
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise JobCancelled()
+
+
+NEVER = CancelToken()
@@ -9,6 +9,13 @@ from pathlib import Path
 
 import fitz  # PyMuPDF
 
+from config import FONT_PATH, PDF_CHUNK_PAGES
+from utils.cancellation import NEVER, CancelToken
+from utils.fonts import FONT_NAME, use_font
+from utils.pdf_writer import write_grouped
+from utils.stages import stage
+from utils.thermal import DEFAULT_DPI, label_plan, render_labels
+
 
 OZON_SHIP_RE = re.compile(r"\b\d{6,}-\d{3,5}-\d\b")
 
@@ -69,7 +76,11 @@ def _normalize_text(value: str) -> str:
     return value.strip()
 
 
-def _extract_full_artikul_map(asm_pdf: Path, y_band: float = 12.0) -> tuple[list[str], dict[str, str]]:
+def _extract_full_artikul_map(
+    asm_pdf: Path,
+    y_band: float = 12.0,
+    cancel: CancelToken = NEVER,
+) -> tuple[list[str], dict[str, str]]:
     doc = fitz.open(asm_pdf)
     try:
         x_cols = _detect_columns_from_header(doc)
@@ -79,6 +90,7 @@ def _extract_full_artikul_map(asm_pdf: Path, y_band: float = 12.0) -> tuple[list
         art_by_ship: dict[str, str] = OrderedDict()
 
         for page in doc:
+            cancel.check()
             words = [tuple(w) for w in page.get_text("words")]
             words_sorted = sorted(words, key=lambda w: (w[1], w[0]))
             art_words = [w for w in words_sorted if art_left <= w[0] < art_right and w[4].strip()]
@@ -117,11 +129,12 @@ def _extract_full_artikul_map(asm_pdf: Path, y_band: float = 12.0) -> tuple[list
         doc.close()
 
 
-def _map_ticket_pages(ticket_pdf: Path) -> dict[str, list[int]]:
+def _map_ticket_pages(ticket_pdf: Path, cancel: CancelToken = NEVER) -> dict[str, list[int]]:
     doc = fitz.open(ticket_pdf)
     try:
         ship_to_pages: dict[str, list[int]] = defaultdict(list)
         for i, page in enumerate(doc):
+            cancel.check()
             text = page.get_text("text")
             ships = OZON_SHIP_RE.findall(text)
             for ship in ships:
@@ -132,26 +145,18 @@ def _map_ticket_pages(ticket_pdf: Path) -> dict[str, list[int]]:
         doc.close()
 
 
-def _build_pdf_wbstyle(
-    asm_pdf: Path,
-    ticket_pdf: Path,
-    out_pdf: Path,
-    font_path: str = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-) -> None:
-    ship_order, art_by_ship = _extract_full_artikul_map(asm_pdf, y_band=12.0)
-    ship_to_pages = _map_ticket_pages(ticket_pdf)
-
+def _order_ticket_pages(
+    ship_order: list[str],
+    art_by_ship: dict[str, str],
+    ship_to_pages: dict[str, list[int]],
+    total_pages: int,
+) -> tuple[list[int], list[tuple[int, str, int]]]:
+    """Return the new page order and (position, article, count) of each group header."""
     by_art: dict[str, list[str]] = defaultdict(list)
     for ship in ship_order:
         by_art[art_by_ship.get(ship, "—")].append(ship)
     arts_sorted = sorted(by_art.keys(), key=lambda x: (x is None, str(x)))
 
-    ticket_doc = fitz.open(ticket_pdf)
-    try:
-        total_pages = len(ticket_doc)
-    finally:
-        ticket_doc.close()
-
     ordered_indices: list[int] = []
     group_meta: list[tuple[int, str, int]] = []
 
@@ -164,46 +169,133 @@ def _build_pdf_wbstyle(
     seen = set(ordered_indices)
     leftovers = [i for i in range(total_pages) if i not in seen]
     ordered_indices.extend(leftovers)
+    return ordered_indices, group_meta
+
+
+def _insert_group_pages(
+    doc: fitz.Document,
+    group_meta: list[tuple[int, str, int]],
+    font_path: str,
+    cancel: CancelToken = NEVER,
+) -> None:
+    offset = 0
+    for insert_idx, art, count in group_meta:
+        cancel.check()
+        insert_at = min(insert_idx + offset, len(doc))
+        page = doc.new_page(
+            pno=insert_at,
+            width=doc[0].rect.width,
+            height=doc[0].rect.height,
+        )
+        _write_group_header(page, art, count, font_path)
+        offset += 1
+
+
+def _write_group_header(page: fitz.Page, art: str, count: int, font_path: str) -> None:
+    text = f"Артикул: {art}\nКоличество: {count}"
+    page.insert_textbox(
+        rect=page.rect,
+        buffer=text,
+        fontsize=12,
+        fontname=use_font(page, FONT_NAME, font_path),
+        color=(0, 0, 0),
+        align=0,
+    )
+
+
+def build_ozon_pdf(
+    asm_pdf: Path,
+    ticket_pdf: Path,
+    out_pdf: Path,
+    font_path: str = FONT_PATH,
+    cancel: CancelToken = NEVER,
+    stats: dict | None = None,
+) -> None:
+    """Reorder ticket pages by article and insert a header page before each group.
+
+    If ``stats`` is given, the number of ticket pages and articles is stored in it.
+    Batches of more than ``PDF_CHUNK_PAGES`` pages are written in chunks
+    (see ``utils.pdf_writer``).
+    """
+    with stage("assembly_parse", pipeline="ozon"):
+        ship_order, art_by_ship = _extract_full_artikul_map(asm_pdf, y_band=12.0, cancel=cancel)
+    with stage("extract", pipeline="ozon"):
+        ship_to_pages = _map_ticket_pages(ticket_pdf, cancel=cancel)
 
     doc = fitz.open(ticket_pdf)
     try:
-        doc.select(ordered_indices)
-
-        font_name = "DejaVuSans"
-        offset = 0
-        for insert_idx, art, count in group_meta:
-            insert_at = min(insert_idx + offset, len(doc))
-            page = doc.new_page(
-                pno=insert_at,
-                width=doc[0].rect.width,
-                height=doc[0].rect.height,
-            )
-            text = f"Артикул: {art}\nКоличество: {count}"
-            page.insert_textbox(
-                rect=page.rect,
-                buffer=text,
-                fontsize=12,
-                fontname=font_name,
-                fontfile=font_path,
-                color=(0, 0, 0),
-                align=0,
-            )
-            offset += 1
-
-        doc.save(out_pdf, garbage=4)
+        with stage("order", pipeline="ozon"):
+            ordered_indices, group_meta = _order_ticket_pages(ship_order, art_by_ship, ship_to_pages, len(doc))
+        if stats is not None:
+            stats.update(pages=len(ordered_indices), articles=len(group_meta))
+
+        if not (PDF_CHUNK_PAGES and len(ordered_indices) > PDF_CHUNK_PAGES):
+            with stage("order", pipeline="ozon"):
+                doc.select(ordered_indices)
+
+            with stage("overlay", pipeline="ozon"):
+                _insert_group_pages(doc, group_meta, font_path, cancel)
+
+            cancel.check()
+            with stage("save", pipeline="ozon"):
+                doc.save(out_pdf, garbage=4)
+            return
     finally:
         doc.close()
 
+    # Large batch: the source is closed and pages are copied from the file in chunks
+    with stage("write", pipeline="ozon"):
+        write_grouped(
+            str(ticket_pdf),
+            ordered_indices,
+            group_meta,
+            str(out_pdf),
+            header=lambda page, art, count: _write_group_header(page, art, count, font_path),
+            cancel=cancel,
+            font_path=font_path,
+        )
+
+
+def plan_ozon_labels(
+    asm_pdf: Path,
+    ticket_pdf: Path,
+    font_path: str = FONT_PATH,
+    cancel: CancelToken = NEVER,
+    stats: dict | None = None,
+) -> dict:
+    """Thermal printer plan of the grouped tickets (see ``utils.thermal``) instead of a PDF."""
+    with stage("assembly_parse", pipeline="ozon"):
+        ship_order, art_by_ship = _extract_full_artikul_map(asm_pdf, y_band=12.0, cancel=cancel)
+    with stage("extract", pipeline="ozon"):
+        ship_to_pages = _map_ticket_pages(ticket_pdf, cancel=cancel)
+    with fitz.open(ticket_pdf) as doc:
+        total_pages = len(doc)
+    with stage("order", pipeline="ozon"):
+        ordered_indices, group_meta = _order_ticket_pages(ship_order, art_by_ship, ship_to_pages, total_pages)
+    if stats is not None:
+        stats.update(pages=len(ordered_indices), articles=len(group_meta))
+    return label_plan("ozon", [str(ticket_pdf)], ordered_indices, group_meta, font_path=font_path)
+
 
 async def process_ozon_files(
     assembly_pdf_path: str,
     ticket_pdf_path: str,
     output_pdf_path: str,
-    font_path: str = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    font_path: str = FONT_PATH,
+    output_format: str = "pdf",
+    dpi: int = DEFAULT_DPI,
 ) -> bool:
-    """Convert Ozon assembly/ticket PDFs into grouped ticket output."""
+    """Convert Ozon assembly/ticket PDFs into grouped ticket output.
+
+    ``output_format`` is "pdf" or a thermal printer format ("zpl", "png",
+    "pbm") rendered at ``dpi``.
+    """
     try:
-        _build_pdf_wbstyle(Path(assembly_pdf_path), Path(ticket_pdf_path), Path(output_pdf_path), font_path=font_path)
+        if output_format == "pdf":
+            build_ozon_pdf(Path(assembly_pdf_path), Path(ticket_pdf_path), Path(output_pdf_path), font_path=font_path)
+        else:
+            plan = plan_ozon_labels(Path(assembly_pdf_path), Path(ticket_pdf_path), font_path=font_path)
+            render_labels(plan, output_format, dpi, output_pdf_path)
         return True
     except Exception as exc:
         logging.error("Ошибка при обработке OZON файлов: %s", exc)
@@ -3,120 +3,334 @@ import logging
 import re
 
 import pandas as pd
-from config import MAX_ARTICLE_LENGTH
+from config import MAX_ARTICLE_LENGTH, PDF_CHUNK_PAGES
 import fitz  # PyMuPDFи
 
-async def process_files(excel_path, pdf_path, output_pdf_path):
+from utils.cancellation import NEVER
+from utils.fonts import FONT_NAME, use_font
+from utils.pdf_writer import write_grouped
+from utils.stages import stage
+from utils.thermal import DEFAULT_DPI, label_plan, render_labels
+
+NUMBER_REGEX = re.compile(r'\b\d+\b')
+UNKNOWN_ARTICLE = 'Без артикула'  # Группа стикеров, для которых нет сохранённого артикула
+
+
+def _sticker_number(text):
+    """Номер стикера WB — два последних числа на странице, либо None."""
+    numbers = NUMBER_REGEX.findall(text)
+    if len(numbers) >= 2:
+        return f"{numbers[-2]} {numbers[-1]}"
+    return None
+
+
+def read_pick_list(excel_path):
+    """Читает лист подбора и возвращает (стикер -> артикул, данные, сгруппированные по артикулу)."""
+    data = pd.read_excel(excel_path, header=1)
+
+    # Оставляем только первые 8 столбцов
+    data = data.iloc[:, :8]
+
+    # Дальше как было
+    required_columns = ['Номер задания', 'Фото', 'Бренд', 'Наименование',
+                        'Размер', 'Цвет', 'Артикул', 'Стикер']
+    data.columns = required_columns
+    data['Стикер'] = data['Стикер'].astype(str).str.strip()
+
+    # Создание отображений
+    sticker_to_article = data.set_index('Стикер')['Артикул'].to_dict()
+    return sticker_to_article, _group_by_article(data)
+
+
+def _group_by_article(data):
+    return data.groupby('Артикул').agg({
+        'Стикер': list,
+        'Наименование': 'count'
+    }).reset_index()
+
+
+def stored_pick_list(sticker_articles, stickers, stats=None):
+    """Лист подбора из сохранённых артикулов (database.sticker_articles) для стикеров PDF.
+
+    ``stickers`` — номера стикеров в порядке страниц. Стикеры без сохранённого
+    артикула идут последней группой UNKNOWN_ARTICLE, артикул на них не пишется.
+    """
+    stickers = list(stickers)
+    articles = [sticker_articles.get(sticker, UNKNOWN_ARTICLE) for sticker in stickers]
+    data = pd.DataFrame({'Стикер': stickers, 'Артикул': articles, 'Наименование': stickers})
+    grouped_data = _group_by_article(data)
+    unknown = grouped_data['Артикул'] == UNKNOWN_ARTICLE
+    grouped_data = pd.concat([grouped_data[~unknown], grouped_data[unknown]], ignore_index=True)
+    if stats is not None:
+        stats['unknown'] = articles.count(UNKNOWN_ARTICLE)
+    return sticker_articles, grouped_data
+
+
+def _read_pick_list(excel_path, stats):
+    with stage("excel_parse", pipeline="wb"):
+        sticker_to_article, grouped_data = read_pick_list(excel_path)
+    if stats is not None:
+        # Воркер сохраняет их для режима «только стикеры» и убирает из результата задачи
+        stats['sticker_articles'] = {
+            sticker: str(article)
+            for sticker, article in sticker_to_article.items()
+            if sticker != 'nan' and pd.notna(article)
+        }
+    return sticker_to_article, grouped_data
+
+
+def map_sticker_pages(doc, cancel=NEVER):
+    """Сопоставляет номер стикера с индексом страницы PDF."""
+    sticker_page_map = {}
+    for page_index, page in enumerate(doc):
+        cancel.check()
+        sticker_number = _sticker_number(page.get_text())
+        if sticker_number:
+            sticker_page_map[sticker_number] = page_index
+    return sticker_page_map
+
+
+def index_sticker_pages(pdf_path, cancel=NEVER):
+    """Индекс одного PDF со стикерами: номер стикера -> индекс страницы."""
+    doc = fitz.open(pdf_path)
     try:
-        # Чтение Excel-файла
-        data = pd.read_excel(excel_path, header=1)
-
-        # Оставляем только первые 8 столбцов
-        data = data.iloc[:, :8]
-
-        # Дальше как было
-        required_columns = ['Номер задания', 'Фото', 'Бренд', 'Наименование',
-                            'Размер', 'Цвет', 'Артикул', 'Стикер']
-        data.columns = required_columns
-        data['Стикер'] = data['Стикер'].astype(str).str.strip()
-
-        # Создание отображений
-        sticker_to_article = data.set_index('Стикер')['Артикул'].to_dict()
-        grouped_data = data.groupby('Артикул').agg({
-            'Стикер': list,
-            'Наименование': 'count'
-        }).reset_index()
-
-        # Обработка PDF-файла
-        doc = fitz.open(pdf_path)
-        sticker_page_map = {}
-        number_regex = re.compile(r'\b\d+\b')
-
-        for page_index, page in enumerate(doc):
-            text = page.get_text()
-            numbers = number_regex.findall(text)
-            if len(numbers) >= 2:
-                sticker_number = f"{numbers[-2]} {numbers[-1]}"
-                sticker_page_map[sticker_number] = page_index
-            else:
-                continue  # Пропустить страницы без нужных чисел
-
-        # Подготовка упорядочивания страниц
-        ordered_page_indices = []
-        group_insert_indices = []
-        current_index = 0
-
-        for row in grouped_data.itertuples():
-            article = row.Артикул
-            stickers = row.Стикер
-            count = row.Наименование
-            group_insert_indices.append((current_index, article, count))
-            for sticker in stickers:
-                sticker = str(sticker).strip()
-                if sticker in sticker_page_map:
-                    ordered_page_indices.append(sticker_page_map[sticker])
-                    current_index += 1
-
-        if not ordered_page_indices:
-            return False
+        return map_sticker_pages(doc, cancel)
+    finally:
+        doc.close()
+
+
+def combine_sticker_pages(indexes):
+    """Общий индекс нескольких PDF: номер стикера -> (номер файла, индекс страницы)."""
+    combined = {}
+    for source, sticker_page_map in enumerate(indexes):
+        for sticker, page_index in sticker_page_map.items():
+            # Стикер, выгруженный в двух файлах, печатается один раз — из первого
+            combined.setdefault(sticker, (source, page_index))
+    return combined
+
+
+def order_pages(grouped_data, sticker_page_map):
+    """Возвращает порядок страниц и позиции групповых стикеров (позиция, артикул, количество)."""
+    ordered_page_indices = []
+    group_insert_indices = []
+    current_index = 0
+
+    for row in grouped_data.itertuples():
+        article = row.Артикул
+        stickers = row.Стикер
+        count = row.Наименование
+        group_insert_indices.append((current_index, article, count))
+        for sticker in stickers:
+            sticker = str(sticker).strip()
+            if sticker in sticker_page_map:
+                ordered_page_indices.append(sticker_page_map[sticker])
+                current_index += 1
+    return ordered_page_indices, group_insert_indices
+
+
+def write_group_header(page, article, count):
+    """Заполняет групповой стикер: артикул и количество."""
+    text = f"Артикул: {article}\nКоличество: {count}"
+    page.insert_textbox(
+        rect=page.rect,
+        buffer=text,
+        fontsize=12,
+        fontname=use_font(page),
+        color=(0, 0, 0),
+        align=1
+    )
+
+
+def insert_group_pages(doc, group_insert_indices, cancel=NEVER):
+    offset = 0
+    for insert_index, article, count in group_insert_indices:
+        cancel.check()
+        insert_at = min(insert_index + offset, len(doc))
+        new_page = doc.new_page(pno=insert_at, width=doc[0].rect.width, height=doc[0].rect.height)
+        write_group_header(new_page, article, count)
+        offset += 1
+
+
+def article_text(article):
+    """Текст артикула на стикере, длинный обрезается."""
+    text = str(article)
+    if len(text) > MAX_ARTICLE_LENGTH:
+        text = text[:MAX_ARTICLE_LENGTH] + '...'
+    return text
+
 
-        # Переупорядочивание страниц
-        doc.select(ordered_page_indices)
-
-        # Настройка шрифта
-        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"  # Обновите путь при необходимости
-        font_name = "DejaVuSans"
-        font = fitz.Font(fontname=font_name, fontfile=font_path)
-
-        # Вставка групповых стикеров
-        offset = 0
-        for insert_index, article, count in group_insert_indices:
-            insert_at = min(insert_index + offset, len(doc))
-            new_page = doc.new_page(pno=insert_at, width=doc[0].rect.width, height=doc[0].rect.height)
-            text = f"Артикул: {article}\nКоличество: {count}"
-            new_page.insert_textbox(
-                rect=new_page.rect,
-                buffer=text,
-                fontsize=12,
-                fontname=font_name,
-                fontfile=font_path,
-                color=(0, 0, 0),
-                align=1
+def write_article(page, rect, text):
+    """Пишет артикул вертикально в области ``rect`` (метка "WB", расширенная на 1 пт); шрифт уже на странице."""
+    page.insert_textbox(
+        rect=rect,
+        buffer=text,
+        fontsize=6,
+        fontname=FONT_NAME,
+        color=(0, 0, 0),
+        align=1,
+        rotate=90
+    )
+
+
+def overlay_article(page, sticker_to_article):
+    """Заменяет метку "WB" на артикул на одном стикере."""
+    text = page.get_text()
+    if "Артикул:" in text:
+        return
+    sticker_number = _sticker_number(text)
+    article = sticker_to_article.get(sticker_number) if sticker_number else None
+    if not article:
+        return
+    instances = page.search_for("WB")
+    if instances:
+        use_font(page)
+    for inst in instances:
+        page.draw_rect(inst, color=(1, 1, 1), fill=(1, 1, 1))
+        write_article(page, inst + (-1, -1, 1, 1), article_text(article))
+
+
+def overlay_articles(doc, sticker_to_article, cancel=NEVER):
+    """Заменяет метку "WB" на артикул на каждом стикере."""
+    for page in doc:
+        cancel.check()
+        overlay_article(page, sticker_to_article)
+
+
+def build_wb_pdf(
+    excel_path, pdf_path, output_pdf_path, cancel=NEVER, stats=None, sticker_pages=None, sticker_articles=None
+):
+    """Группирует стикеры WB по артикулам. Возвращает False, если ни один стикер не найден.
+
+    ``cancel`` проверяется между страницами; при отмене бросается JobCancelled.
+    В ``stats`` (если передан словарь) записываются количество страниц и артикулов.
+    Пачки больше PDF_CHUNK_PAGES страниц пишутся по частям (см. utils.pdf_writer).
+
+    ``pdf_path`` может быть списком файлов одной поставки: страницы берутся прямо
+    из них по общему индексу, объединённый PDF не создаётся. ``sticker_pages`` —
+    уже построенные индексы этих файлов (index_sticker_pages), если они есть.
+
+    Без листа подбора (``excel_path`` None) артикулы берутся из ``sticker_articles``
+    (см. stored_pick_list). Иначе в ``stats`` попадает и стикер -> артикул из листа.
+    """
+    if not isinstance(pdf_path, str):
+        if len(pdf_path) > 1:
+            return _build_wb_pdf_from_parts(
+                excel_path, list(pdf_path), output_pdf_path, cancel, stats, sticker_pages, sticker_articles
             )
-            offset += 1
-
-        # Замена "WB" на артикул
-        for page_index, page in enumerate(doc):
-            text = page.get_text()
-            if "Артикул:" in text:
-                continue
-            numbers = number_regex.findall(text)
-            if len(numbers) >= 2:
-                sticker_number = f"{numbers[-2]} {numbers[-1]}"
-                article = sticker_to_article.get(sticker_number)
-                if article:
-                    article_text = str(article)
-                    if len(article_text) > MAX_ARTICLE_LENGTH:
-                        article_text = article_text[:MAX_ARTICLE_LENGTH] + '...'
-                    text_instances = page.search_for("WB")
-                    if text_instances:
-                        for inst in text_instances:
-                            page.draw_rect(inst, color=(1, 1, 1), fill=(1, 1, 1))
-                            expanded_inst = inst + (-1, -1, 1, 1)
-                            page.insert_textbox(
-                                rect=expanded_inst,
-                                buffer=article_text,
-                                fontsize=6,
-                                fontname=font_name,
-                                fontfile=font_path,
-                                color=(0, 0, 0),
-                                align=1,
-                                rotate=90
-                            )
-        # Сохранение PDF
-        doc.save(output_pdf_path)
+        pdf_path = pdf_path[0]
+
+    if excel_path is not None:
+        sticker_to_article, grouped_data = _read_pick_list(excel_path, stats)
+
+    doc = fitz.open(pdf_path)
+    try:
+        with stage("extract", pipeline="wb"):
+            sticker_page_map = sticker_pages[0] if sticker_pages else map_sticker_pages(doc, cancel)
+        if excel_path is None:
+            sticker_to_article, grouped_data = stored_pick_list(sticker_articles, sticker_page_map, stats)
+
+        with stage("order", pipeline="wb"):
+            ordered_page_indices, group_insert_indices = order_pages(grouped_data, sticker_page_map)
+            if not ordered_page_indices:
+                return False
+        if stats is not None:
+            stats.update(pages=len(ordered_page_indices), articles=len(group_insert_indices))
+
+        if not (PDF_CHUNK_PAGES and len(ordered_page_indices) > PDF_CHUNK_PAGES):
+            with stage("order", pipeline="wb"):
+                doc.select(ordered_page_indices)
+
+            with stage("overlay", pipeline="wb"):
+                insert_group_pages(doc, group_insert_indices, cancel)
+                overlay_articles(doc, sticker_to_article, cancel)
+
+            cancel.check()
+            with stage("save", pipeline="wb"):
+                doc.save(output_pdf_path)
+            return True
+    finally:
         doc.close()
+
+    # Большая пачка: исходный документ закрыт, страницы копируются из файла по частям
+    with stage("write", pipeline="wb"):
+        write_grouped(
+            pdf_path,
+            ordered_page_indices,
+            group_insert_indices,
+            output_pdf_path,
+            header=write_group_header,
+            decorate=lambda page: overlay_article(page, sticker_to_article),
+            cancel=cancel,
+        )
+    return True
+
+
+def _order_parts(excel_path, pdf_paths, cancel, stats, sticker_pages, sticker_articles):
+    """Порядок страниц нескольких PDF: (стикер -> артикул, [(файл, страница)], групповые стикеры)."""
+    if excel_path is not None:
+        sticker_to_article, grouped_data = _read_pick_list(excel_path, stats)
+
+    with stage("extract", pipeline="wb"):
+        if sticker_pages is None:
+            sticker_pages = [index_sticker_pages(path, cancel) for path in pdf_paths]
+        sticker_page_map = combine_sticker_pages(sticker_pages)
+    if excel_path is None:
+        sticker_to_article, grouped_data = stored_pick_list(sticker_articles, sticker_page_map, stats)
+
+    with stage("order", pipeline="wb"):
+        ordered_pages, group_insert_indices = order_pages(grouped_data, sticker_page_map)
+    if stats is not None and ordered_pages:
+        stats.update(pages=len(ordered_pages), articles=len(group_insert_indices))
+    return sticker_to_article, ordered_pages, group_insert_indices
+
+
+def _build_wb_pdf_from_parts(excel_path, pdf_paths, output_pdf_path, cancel, stats, sticker_pages, sticker_articles):
+    sticker_to_article, ordered_pages, group_insert_indices = _order_parts(
+        excel_path, pdf_paths, cancel, stats, sticker_pages, sticker_articles
+    )
+    if not ordered_pages:
+        return False
+
+    # Страниц из нескольких документов нет в одном fitz.Document — всегда пишем копированием
+    with stage("write", pipeline="wb"):
+        write_grouped(
+            pdf_paths,
+            ordered_pages,
+            group_insert_indices,
+            output_pdf_path,
+            header=write_group_header,
+            decorate=lambda page: overlay_article(page, sticker_to_article),
+            cancel=cancel,
+        )
+    return True
+
+
+def plan_wb_labels(excel_path, pdf_path, cancel=NEVER, stats=None, sticker_pages=None, sticker_articles=None):
+    """План печати на термопринтере (см. utils.thermal) вместо PDF; None, если ни один стикер не найден."""
+    pdf_paths = [pdf_path] if isinstance(pdf_path, str) else list(pdf_path)
+    _, ordered_pages, group_insert_indices = _order_parts(
+        excel_path, pdf_paths, cancel, stats, sticker_pages, sticker_articles
+    )
+    if not ordered_pages:
+        return None
+    overlay = article_text if excel_path is not None else _stored_article_text
+    return label_plan("wb", pdf_paths, ordered_pages, group_insert_indices, overlay=overlay)
+
+
+def _stored_article_text(article):
+    return None if article == UNKNOWN_ARTICLE else article_text(article)
+
+
+async def process_files(excel_path, pdf_path, output_pdf_path, output_format="pdf", dpi=DEFAULT_DPI):
+    """``output_format`` — "pdf" или формат термопринтера ("zpl", "png", "pbm") с разрешением ``dpi``."""
+    try:
+        if output_format == "pdf":
+            return build_wb_pdf(excel_path, pdf_path, output_pdf_path)
+        plan = plan_wb_labels(excel_path, pdf_path)
+        if plan is None:
+            return False
+        render_labels(plan, output_format, dpi, output_pdf_path)
         return True
     except Exception as e:
         logging.error(f"Ошибка при обработке файлов: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,27 @@
+"""Fonts of the generated pages, read from disk once per process.
+
+``insert_textbox(fontfile=...)`` opens and parses the font file for every
+page it writes on. Instead the font is inserted into the page from a buffer
+kept in memory, and ``insert_textbox`` is called with just its ``fontname``:
+PyMuPDF finds the font already on the page and the document embeds it once.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+
+from config import FONT_PATH
+
+FONT_NAME = "DejaVuSans"
+
+
+@lru_cache(maxsize=None)
+def font_buffer(path: str = FONT_PATH) -> bytes:
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def use_font(page, name: str = FONT_NAME, path: str = FONT_PATH) -> str:
+    """Make the font available on ``page``; return the name for ``insert_textbox``."""
+    page.insert_font(fontname=name, fontbuffer=font_buffer(path))
+    return name
@@ -0,0 +1,214 @@
+"""Background cleanup of abandoned scenarios and orphaned workspace files.
+
+A user who sends the pick list and never sends the stickers leaves an upload in
+``JOB_WORKSPACE/users/<id>/`` and the path in their FSM data. The janitor runs
+every ``JANITOR_INTERVAL`` seconds in each bot process:
+
+* scenarios idle for ``FSM_STATE_TTL`` are reset and the uploads they
+  reference are deleted. The database storage knows when a record was last
+  updated; for ``MemoryStorage`` a record counts as idle from the first pass
+  that saw it in its current form;
+* files under ``users/`` older than ``WORKSPACE_ORPHAN_TTL`` that no scenario
+  and no live job references, and ``jobs/<id>/`` directories of jobs already
+  delivered, cancelled or deleted, are removed;
+* saved sticker articles (``database.sticker_articles``) not refreshed by a
+  pick list for ``STICKER_ARTICLES_TTL_DAYS`` are deleted.
+
+Passes in several processes may overlap, every step tolerates files that are
+already gone.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import FSM_STATE_TTL, JANITOR_INTERVAL, JOB_WORKSPACE, STICKER_ARTICLES_TTL_DAYS, WORKSPACE_ORPHAN_TTL
+from utils.metrics import JANITOR_BYTES_REMOVED, JANITOR_FILES_REMOVED, JANITOR_FSM_EXPIRED
+from utils.workspace import in_workspace
+
+logger = logging.getLogger(__name__)
+
+_task: asyncio.Task | None = None
+# MemoryStorage не хранит время изменения: (chat, user) -> (снимок записи, когда он впервые увиден)
+_memory_seen: dict[tuple[str, str], tuple[str, float]] = {}
+
+
+def _workspace_paths(data: dict) -> set[str]:
+    """Values of FSM data (or items of list values) that are files inside the job workspace."""
+    values = [item for value in data.values() for item in (value if isinstance(value, list) else [value])]
+    return {value for value in values if isinstance(value, str) and in_workspace(value)}
+
+
+def _remove_file(path: str, reason: str) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    JANITOR_FILES_REMOVED.inc(reason=reason)
+    JANITOR_BYTES_REMOVED.inc(size, reason=reason)
+    return 1
+
+
+def _remove_dir(path: str, reason: str) -> int:
+    files, size = 0, 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(directory, name))
+                files += 1
+            except FileNotFoundError:
+                pass
+    shutil.rmtree(path, ignore_errors=True)
+    JANITOR_FILES_REMOVED.inc(files, reason=reason)
+    JANITOR_BYTES_REMOVED.inc(size, reason=reason)
+    return files
+
+
+async def _expire_db(storage, ttl: float) -> list[dict]:
+    return await storage.expire(datetime.now(timezone.utc) - timedelta(seconds=ttl))
+
+
+def _expire_memory(storage, ttl: float) -> list[dict]:
+    now = time.monotonic()
+    expired, seen = [], set()
+    for chat, users in storage.data.items():
+        for user, record in users.items():
+            if record.get("state") is None:
+                continue
+            key = (chat, user)
+            seen.add(key)
+            snapshot = repr((record.get("state"), record.get("data")))
+            previous = _memory_seen.get(key)
+            if previous is None or previous[0] != snapshot:
+                _memory_seen[key] = (snapshot, now)
+            elif now - previous[1] >= ttl:
+                expired.append(record.get("data") or {})
+                record["state"], record["data"] = None, {}
+                del _memory_seen[key]
+    for key in set(_memory_seen) - seen:
+        del _memory_seen[key]
+    return expired
+
+
+def _active_memory_data(storage) -> list[dict]:
+    return [
+        record.get("data") or {}
+        for users in storage.data.values() for record in users.values()
+        if record.get("state") is not None
+    ]
+
+
+def _sweep_uploads(referenced: set[str], ttl: float) -> int:
+    users_root = os.path.join(JOB_WORKSPACE, "users")
+    if not os.path.isdir(users_root):
+        return 0
+    cutoff, removed = time.time() - ttl, 0
+    for entry in os.scandir(users_root):
+        try:
+            idle_dir = entry.is_dir() and entry.stat().st_mtime < cutoff
+        except FileNotFoundError:
+            continue
+        if not entry.is_dir():
+            continue
+        for upload in os.scandir(entry.path):
+            try:
+                stale = upload.is_file() and upload.stat().st_mtime < cutoff
+            except FileNotFoundError:
+                continue
+            if stale and os.path.realpath(upload.path) not in referenced:
+                removed += _remove_file(upload.path, "orphan")
+        if idle_dir:
+            try:
+                # Пустой каталог, в который давно ничего не загружали; свежий мог быть только что создан user_dir
+                os.rmdir(entry.path)
+            except OSError:
+                pass
+    return removed
+
+
+def _sweep_job_dirs(live_jobs: set[int], ttl: float) -> int:
+    jobs_root = os.path.join(JOB_WORKSPACE, "jobs")
+    if not os.path.isdir(jobs_root):
+        return 0
+    cutoff, removed = time.time() - ttl, 0
+    for entry in os.scandir(jobs_root):
+        if not entry.name.isdigit() or int(entry.name) in live_jobs:
+            continue
+        try:
+            stale = entry.is_dir() and entry.stat().st_mtime < cutoff
+        except FileNotFoundError:
+            continue
+        if stale:
+            removed += _remove_dir(entry.path, "job_dir")
+    return removed
+
+
+async def sweep(
+    storage,
+    fsm_ttl: float = FSM_STATE_TTL,
+    orphan_ttl: float = WORKSPACE_ORPHAN_TTL,
+    articles_ttl_days: float = STICKER_ARTICLES_TTL_DAYS,
+) -> dict[str, int]:
+    """One janitor pass; return the number of expired scenarios, removed files and sticker articles."""
+    from database.sticker_articles import delete_stale_sticker_articles
+    from utils.job_queue import cancel_subtasks, live_job_files
+
+    live_jobs, job_inputs = await live_job_files()
+    job_inputs = {os.path.realpath(path) for path in job_inputs}
+    is_db = hasattr(storage, "expire")
+
+    expired, removed = [], 0
+    if fsm_ttl:
+        expired = await _expire_db(storage, fsm_ttl) if is_db else _expire_memory(storage, fsm_ttl)
+    for data in expired:
+        for path in _workspace_paths(data):
+            if os.path.realpath(path) not in job_inputs:
+                removed += _remove_file(path, "fsm")
+    JANITOR_FSM_EXPIRED.inc(len(expired))
+    # Индексации PDF брошенных сценариев WB больше никому не нужны
+    await cancel_subtasks([job_id for data in expired for job_id in data.get("index_jobs") or []])
+
+    if orphan_ttl:
+        active = await storage.active_data() if is_db else _active_memory_data(storage)
+        referenced = set(job_inputs)
+        for data in active:
+            referenced.update(os.path.realpath(path) for path in _workspace_paths(data))
+        removed += await asyncio.to_thread(_sweep_uploads, referenced, orphan_ttl)
+        removed += await asyncio.to_thread(_sweep_job_dirs, live_jobs, orphan_ttl)
+
+    articles_expired = 0
+    if articles_ttl_days:
+        before = datetime.now(timezone.utc) - timedelta(days=articles_ttl_days)
+        articles_expired = await delete_stale_sticker_articles(before)
+
+    return {"fsm_expired": len(expired), "files_removed": removed, "articles_expired": articles_expired}
+
+
+async def _sweep_forever(storage) -> None:
+    while True:
+        try:
+            result = await sweep(storage)
+            if any(result.values()):
+                logger.info(
+                    "Уборка: сброшено сценариев %s, удалено файлов %s, артикулов стикеров %s",
+                    result["fsm_expired"],
+                    result["files_removed"],
+                    result["articles_expired"],
+                )
+        except Exception:
+            logger.exception("Уборка рабочего каталога не удалась")
+        await asyncio.sleep(JANITOR_INTERVAL)
+
+
+def start_janitor(storage) -> asyncio.Task | None:
+    """Start the periodic cleanup for ``storage`` (once per process); 0 interval disables it."""
+    global _task
+    if JANITOR_INTERVAL and (_task is None or _task.done()):
+        _task = asyncio.ensure_future(_sweep_forever(storage))
+    return _task
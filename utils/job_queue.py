@@ -0,0 +1,544 @@
+"""Durable processing queue stored in the ``jobs`` table.
+
+Workers claim jobs with ``SELECT ... FOR UPDATE SKIP LOCKED`` on Postgres and
+with a conditional ``UPDATE`` on SQLite. A claimed job is leased for
+``JOB_LEASE_SECONDS``; the worker keeps extending the lease while the job runs,
+so if the worker dies the job becomes claimable again and survives restarts.
+
+Jobs are claimed in order of their fair-queueing tag (see ``utils.scheduler``),
+skipping tenants that already run ``JOB_USER_CONCURRENCY`` jobs. New jobs are
+refused with ``QueueFull`` once the queue or the tenant's backlog is full.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.orm import aliased
+
+from config import (
+    DELIVERY_MAX_ATTEMPTS,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_MAX_CRASHES,
+    JOB_QUEUE_LIMIT,
+    JOB_USER_CONCURRENCY,
+    JOB_USER_QUEUE_LIMIT,
+    PROFILING_REFRESH,
+)
+from database.setup import Job, ProfileRequest, engine, get_read_session, get_session
+from utils.scheduler import QueueFull, virtual_finish
+from utils.tracing import current_context
+
+logger = logging.getLogger(__name__)
+
+# Есть ли неиспользованные запросы профилирования. Перечитывается каждые PROFILING_REFRESH
+# секунд (start_profiling_refresh), чтобы без профилирования enqueue_job не делал лишнего запроса
+_profiling_active = False
+_profiling_refresh: asyncio.Task | None = None
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _lease() -> datetime:
+    return _now() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+
+# Вспомогательные задачи, из результатов которых собирается задача пользователя (индексы PDF
+# стикеров WB, поставленные по мере загрузки файлов): без допуска и вне лимита очереди пользователя
+SUBTASK_KINDS = ('wb_index',)
+# Задачи, которые воркер выполняет одним запуском пула под профилировщиком; пакетам
+# и термопечати (несколько запусков) запросы профилирования не достаются
+PROFILED_KINDS = ('wb', 'ozon')
+CLAIM_ATTEMPTS = 5  # Попыток взять задачу, если лимит выбранного пользователя заняли другие воркеры
+
+
+@dataclass
+class Enqueued:
+    job_id: int
+    position: int  # Сколько задач будет выполнено раньше этой
+
+
+async def _check_admission(session, tenant: str) -> None:
+    queued = await session.scalar(
+        select(func.count()).select_from(Job).where(Job.status == 'queued', Job.kind.notin_(SUBTASK_KINDS))
+    )
+    if queued >= JOB_QUEUE_LIMIT:
+        raise QueueFull(queued, JOB_QUEUE_LIMIT)
+    own = await session.scalar(
+        select(func.count())
+        .select_from(Job)
+        .where(Job.status == 'queued', Job.tenant == tenant, Job.kind.notin_(SUBTASK_KINDS))
+    )
+    if own >= JOB_USER_QUEUE_LIMIT:
+        raise QueueFull(own, JOB_USER_QUEUE_LIMIT, per_tenant=True)
+
+
+async def check_admission(tenant: str) -> None:
+    """Raise QueueFull before the caller spends time downloading the files."""
+    async with get_read_session() as session:
+        await _check_admission(session, tenant)
+
+
+async def enqueue_job(
+    kind: str,
+    payload: dict,
+    *,
+    tenant: str,
+    cost: float = 1.0,
+    chat_id: int | None = None,
+    user_id: int | None = None,
+) -> Enqueued:
+    """Put a new job into the queue, or raise QueueFull."""
+    async with get_session() as session:
+        if kind not in SUBTASK_KINDS:
+            await _check_admission(session, tenant)
+
+        system_time = await session.scalar(
+            select(func.max(Job.vfinish)).where(Job.status == 'running')
+        ) or await session.scalar(
+            select(func.min(Job.vfinish)).where(Job.status == 'queued')
+        ) or 0.0
+        tenant_finish = await session.scalar(
+            select(func.max(Job.vfinish)).where(Job.tenant == tenant, Job.status.in_(('queued', 'running')))
+        )
+        vfinish = virtual_finish(system_time, tenant_finish, cost)
+
+        trace = current_context()
+        if trace is not None:
+            payload = {**payload, 'trace': trace}
+        # Задачи API (без пользователя) отчёт не получат: запросы профилирования на них не тратятся
+        profiled = kind in PROFILED_KINDS and payload.get('format', 'pdf') == 'pdf'
+        if _profiling_active and user_id is not None and profiled:
+            admin_chat_id = await _take_profiling(session, user_id)
+            if admin_chat_id is not None:
+                payload = {**payload, 'profile': {'admin_chat_id': admin_chat_id}}
+
+        job = Job(
+            kind=kind,
+            payload=payload,
+            chat_id=chat_id,
+            user_id=user_id,
+            tenant=tenant,
+            cost=cost,
+            vfinish=vfinish,
+            status='queued',
+        )
+        session.add(job)
+        await session.flush()
+        position = await session.scalar(
+            select(func.count())
+            .select_from(Job)
+            .where(Job.status == 'queued', Job.vfinish < vfinish, Job.kind.notin_(SUBTASK_KINDS))
+        )
+        enqueued = Enqueued(job.id, position)
+    logger.debug("Задача %s (%s) поставлена в очередь, стоимость %.0f, позиция %s", enqueued.job_id, kind, cost, position)
+    return enqueued
+
+
+async def _take_profiling(session, user_id: int) -> int | None:
+    """Use up one pending profiling request matching the user; return the admin chat or None."""
+    request = await session.scalar(
+        select(ProfileRequest)
+        .where(ProfileRequest.remaining > 0, or_(ProfileRequest.user_id == user_id, ProfileRequest.user_id.is_(None)))
+        # Запрос на конкретного пользователя важнее запроса «любые задачи»
+        .order_by(ProfileRequest.user_id.is_(None), ProfileRequest.id)
+        .limit(1)
+    )
+    if request is None:
+        return None
+    result = await session.execute(
+        update(ProfileRequest)
+        .where(ProfileRequest.id == request.id, ProfileRequest.remaining > 0)
+        .values(remaining=ProfileRequest.remaining - 1)
+    )
+    return request.admin_chat_id if result.rowcount == 1 else None
+
+
+async def request_profiling(admin_chat_id: int, count: int, user_id: int | None = None) -> None:
+    """Profile the next ``count`` jobs of ``user_id`` (of any bot user if None).
+
+    Other processes notice the request within ``PROFILING_REFRESH`` seconds.
+    """
+    global _profiling_active
+    async with get_session() as session:
+        session.add(ProfileRequest(user_id=user_id, remaining=count, admin_chat_id=admin_chat_id))
+    _profiling_active = True
+
+
+async def stop_profiling() -> None:
+    global _profiling_active
+    async with get_session() as session:
+        await session.execute(update(ProfileRequest).where(ProfileRequest.remaining > 0).values(remaining=0))
+    _profiling_active = False
+
+
+async def load_profiling() -> None:
+    """Re-read whether any profiling request is pending (other processes change them)."""
+    global _profiling_active
+    async with get_read_session() as session:
+        pending = await session.scalar(select(ProfileRequest.id).where(ProfileRequest.remaining > 0).limit(1))
+    _profiling_active = pending is not None
+
+
+async def _refresh_profiling_forever() -> None:
+    while True:
+        try:
+            await load_profiling()
+        except Exception:
+            logger.exception("Не удалось проверить запросы профилирования")
+        await asyncio.sleep(PROFILING_REFRESH)
+
+
+def start_profiling_refresh() -> asyncio.Task:
+    """Start the periodic re-read of pending profiling requests (once per process that enqueues jobs)."""
+    global _profiling_refresh
+    if _profiling_refresh is None or _profiling_refresh.done():
+        _profiling_refresh = asyncio.ensure_future(_refresh_profiling_forever())
+    return _profiling_refresh
+
+
+async def pending_profiling() -> list[ProfileRequest]:
+    async with get_read_session() as session:
+        result = await session.execute(
+            select(ProfileRequest).where(ProfileRequest.remaining > 0).order_by(ProfileRequest.id)
+        )
+        return list(result.scalars().all())
+
+
+def _running_count(tenant, now: datetime):
+    """Jobs of ``tenant`` running under a live lease."""
+    running = aliased(Job)
+    return (
+        select(func.count())
+        .select_from(running)
+        .where(running.tenant == tenant, running.status == 'running', running.locked_until >= now)
+        .scalar_subquery()
+    )
+
+
+async def claim_job(worker_id: str) -> Job | None:
+    """Take the claimable job with the smallest fair-queueing tag, or None.
+
+    The ``JOB_USER_CONCURRENCY`` cap is re-checked inside the claim itself
+    (under a per-tenant advisory lock on Postgres, in the ``UPDATE`` on
+    SQLite), so workers claiming at the same moment cannot exceed it.
+    """
+    now = _now()
+    claimable = or_(
+        Job.status == 'queued',
+        and_(
+            Job.status == 'running',
+            Job.locked_until < now,
+            Job.attempts < JOB_MAX_ATTEMPTS,
+            # Воркер пропал на задаче, уже ронявшей процесс: её закроет reap_expired_jobs
+            Job.crashes < JOB_MAX_CRASHES - 1,
+            Job.cancel_requested == False,  # noqa: E712
+        ),
+    )
+    busy_tenants = (
+        select(Job.tenant)
+        .where(Job.status == 'running', Job.locked_until >= now)
+        .group_by(Job.tenant)
+        .having(func.count() >= JOB_USER_CONCURRENCY)
+    )
+    skipped: set[str] = set()  # Пользователи, чей лимит заняли другие воркеры за время выборки
+
+    for _ in range(CLAIM_ATTEMPTS):
+        query = (
+            select(Job)
+            .where(claimable, Job.tenant.notin_(busy_tenants), Job.tenant.notin_(skipped))
+            .order_by(Job.vfinish, Job.id)
+            .limit(1)
+        )
+        async with get_session() as session:
+            if engine.dialect.name == 'postgresql':
+                job = (await session.execute(query.with_for_update(skip_locked=True))).scalars().first()
+                if job is None:
+                    return None
+                # Захваты задач одного пользователя идут по очереди: до конца транзакции
+                # другой воркер ждёт блокировку и видит уже зафиксированный захват
+                await session.execute(select(func.pg_advisory_xact_lock(func.hashtext(job.tenant))))
+                if await session.scalar(select(_running_count(job.tenant, now))) >= JOB_USER_CONCURRENCY:
+                    skipped.add(job.tenant)
+                    continue
+                if job.status == 'running':
+                    job.crashes += 1  # Прошлая попытка пропала вместе с воркером
+                job.status = 'running'
+                job.worker = worker_id
+                job.locked_until = _lease()
+                job.attempts += 1
+                return job
+
+            # SQLite не умеет SKIP LOCKED: забираем задачу условным UPDATE и проверяем rowcount;
+            # лимит пользователя проверяется в том же UPDATE, записи в SQLite идут строго по одной
+            job = (await session.execute(query)).scalars().first()
+            if job is None:
+                return None
+            result = await session.execute(
+                update(Job)
+                .where(
+                    Job.id == job.id,
+                    Job.status == job.status,
+                    Job.attempts == job.attempts,
+                    _running_count(job.tenant, now) < JOB_USER_CONCURRENCY,
+                )
+                .values(
+                    status='running',
+                    worker=worker_id,
+                    locked_until=_lease(),
+                    attempts=Job.attempts + 1,
+                    crashes=Job.crashes + (1 if job.status == 'running' else 0),
+                )
+            )
+            if result.rowcount != 1:
+                skipped.add(job.tenant)
+                continue
+            await session.refresh(job)
+            return job
+    return None
+
+
+async def extend_leases(job_ids: list[int], worker_id: str) -> None:
+    """Keep running jobs owned by ``worker_id`` from being reclaimed."""
+    if not job_ids:
+        return
+    async with get_session() as session:
+        await session.execute(
+            update(Job)
+            .where(Job.id.in_(job_ids), Job.worker == worker_id, Job.status == 'running')
+            .values(locked_until=_lease())
+        )
+
+
+async def finish_job(job_id: int, result: dict) -> None:
+    async with get_session() as session:
+        await session.execute(
+            update(Job).where(Job.id == job_id).values(status='done', result=result, locked_until=None)
+        )
+
+
+async def fail_job(
+    job_id: int, error: str, *, retry: bool = False, reason: str | None = None, crashed: bool = False
+) -> None:
+    """Mark a job failed, or put it back into the queue if it may be retried.
+
+    ``reason`` is stored in the result for the reply to the user (``too_large``).
+    A job that ``crashed`` its pool process on the last attempt or
+    ``JOB_MAX_CRASHES`` times in a row fails as ``too_large``: such a file
+    keeps killing processes (OOM killer, a segfault under RLIMIT_AS).
+    """
+    async with get_session() as session:
+        job = await session.get(Job, job_id)
+        if job is None:
+            return
+        job.locked_until = None
+        if crashed:
+            job.crashes += 1
+        if job.cancel_requested:
+            job.status = 'cancelled'
+        elif crashed and (job.crashes >= JOB_MAX_CRASHES or job.attempts >= JOB_MAX_ATTEMPTS):
+            job.status = 'failed'
+            job.result = {'error': error, 'reason': 'too_large'}
+        elif retry and job.attempts < JOB_MAX_ATTEMPTS:
+            job.status = 'queued'
+        else:
+            job.status = 'failed'
+            job.result = {'error': error, 'reason': reason} if reason else {'error': error}
+
+
+async def request_cancel(job_id: int, user_id: int) -> tuple[str | None, dict]:
+    """Cancel a user's job.
+
+    A queued job is cancelled at once; a running one is flagged and stopped by
+    its worker. Returns the resulting status and the job payload.
+    """
+    async with get_session() as session:
+        job = await session.get(Job, job_id)
+        if job is None or job.user_id != user_id:
+            return None, {}
+        result = await session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='cancelled', notified=True)
+        )
+        if result.rowcount == 1:
+            return 'cancelled', job.payload
+        result = await session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == 'running')
+            .values(cancel_requested=True, notified=True)
+        )
+        if result.rowcount == 1:
+            return 'cancelling', job.payload
+        return job.status, job.payload
+
+
+async def cancel_requested_jobs(job_ids: list[int]) -> list[int]:
+    """Return which of the given running jobs the users asked to cancel."""
+    if not job_ids:
+        return []
+    async with get_read_session() as session:
+        result = await session.execute(
+            select(Job.id).where(Job.id.in_(job_ids), Job.cancel_requested == True)  # noqa: E712
+        )
+        return list(result.scalars().all())
+
+
+async def mark_cancelled(job_id: int) -> None:
+    async with get_session() as session:
+        await session.execute(
+            update(Job).where(Job.id == job_id).values(status='cancelled', locked_until=None, notified=True)
+        )
+
+
+async def reap_expired_jobs() -> int:
+    """Settle jobs of lost workers that must not be retried.
+
+    Jobs the user cancelled are cancelled. Jobs past their last attempt, or
+    whose previous attempt also crashed, fail as ``too_large``: the lost
+    worker was most likely killed by the file itself.
+    """
+    async with get_session() as session:
+        expired = and_(Job.status == 'running', Job.locked_until < _now())
+        cancelled = await session.execute(
+            update(Job)
+            .where(expired, Job.cancel_requested == True)  # noqa: E712
+            .values(status='cancelled', locked_until=None)
+        )
+        failed = await session.execute(
+            update(Job)
+            .where(expired, or_(Job.attempts >= JOB_MAX_ATTEMPTS, Job.crashes >= JOB_MAX_CRASHES - 1))
+            .values(
+                status='failed',
+                crashes=Job.crashes + 1,
+                result={'error': 'worker lost', 'reason': 'too_large'},
+                locked_until=None,
+            )
+        )
+        return (cancelled.rowcount or 0) + (failed.rowcount or 0)
+
+
+async def queue_depth() -> dict[str, int]:
+    """Number of queued and running jobs."""
+    async with get_read_session() as session:
+        result = await session.execute(
+            select(Job.status, func.count())
+            .where(Job.status.in_(('queued', 'running')))
+            .group_by(Job.status)
+        )
+        return {'queued': 0, 'running': 0, **dict(result.all())}
+
+
+async def collect_subtasks(job_ids: list[int]) -> dict[int, dict]:
+    """Results of the finished ones of the given subtasks (``SUBTASK_KINDS``).
+
+    The results are taken: the rows keep no copy of them. Subtasks still
+    queued are cancelled, the caller does their work itself.
+    """
+    if not job_ids:
+        return {}
+    subtasks = and_(Job.id.in_(job_ids), Job.kind.in_(SUBTASK_KINDS))
+    async with get_session() as session:
+        result = await session.execute(
+            select(Job.id, Job.result).where(subtasks, Job.status == 'done')
+        )
+        done = dict(result.tuples().all())
+        await session.execute(update(Job).where(subtasks, Job.status == 'done').values(result=None))
+        await session.execute(update(Job).where(subtasks, Job.status == 'queued').values(status='cancelled'))
+    return done
+
+
+async def cancel_subtasks(job_ids: list[int | None]) -> None:
+    """Drop the subtasks of a scenario the user abandoned.
+
+    Queued ones are cancelled at once, running ones are stopped by their
+    worker, results of finished ones are discarded.
+    """
+    job_ids = [job_id for job_id in job_ids if job_id is not None]
+    if not job_ids:
+        return
+    subtasks = and_(Job.id.in_(job_ids), Job.kind.in_(SUBTASK_KINDS))
+    async with get_session() as session:
+        await session.execute(update(Job).where(subtasks, Job.status == 'queued').values(status='cancelled'))
+        await session.execute(update(Job).where(subtasks, Job.status == 'running').values(cancel_requested=True))
+        await session.execute(update(Job).where(subtasks, Job.status == 'done').values(result=None))
+
+
+async def get_job(job_id: int) -> Job | None:
+    async with get_read_session() as session:
+        return await session.get(Job, job_id)
+
+
+async def finished_jobs(limit: int = 50) -> list[Job]:
+    """Return finished jobs whose result has not been delivered to their chat yet."""
+    async with get_read_session() as session:
+        result = await session.execute(
+            select(Job)
+            # Задачи HTTP API без чата: результат забирает сам клиент (см. api.py)
+            .where(
+                Job.status.in_(('done', 'failed')),
+                Job.notified == False,  # noqa: E712
+                Job.chat_id.isnot(None),
+                # После неудачной отправки locked_until — время следующей попытки
+                or_(Job.locked_until.is_(None), Job.locked_until <= _now()),
+            )
+            .order_by(Job.id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+
+async def live_job_files() -> tuple[set[int], set[str]]:
+    """Ids and input paths of jobs whose files are still needed.
+
+    That is every job not yet delivered or cancelled, and running jobs the
+    user cancelled (their worker removes the files when it stops). Files of
+    finished HTTP API jobs are kept only for ``WORKSPACE_ORPHAN_TTL``.
+    """
+    async with get_read_session() as session:
+        result = await session.execute(
+            select(Job.id, Job.payload).where(
+                or_(
+                    and_(Job.notified == False, Job.chat_id.isnot(None)),  # noqa: E712
+                    Job.status.in_(('queued', 'running')),
+                )
+            )
+        )
+        rows = result.all()
+    paths = {path for _, payload in rows for path in (payload or {}).get('inputs', {}).values() if path}
+    return {job_id for job_id, _ in rows}, paths
+
+
+async def release_delivery(job_id: int, retry_in: float) -> bool:
+    """Put back a result whose sending failed, to be retried in ``retry_in`` seconds.
+
+    Returns False once ``DELIVERY_MAX_ATTEMPTS`` sends have failed: the job
+    stays delivered and the caller gives up on it.
+    """
+    async with get_session() as session:
+        result = await session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.delivery_failures < DELIVERY_MAX_ATTEMPTS - 1)
+            .values(
+                notified=False,
+                delivery_failures=Job.delivery_failures + 1,
+                locked_until=_now() + timedelta(seconds=retry_in),
+            )
+        )
+        return result.rowcount == 1
+
+
+async def claim_delivery(job_id: int) -> bool:
+    """Atomically mark a job as delivered; only one bot process wins."""
+    async with get_session() as session:
+        result = await session.execute(
+            update(Job).where(Job.id == job_id, Job.notified == False).values(notified=True)  # noqa: E712
+        )
+        return result.rowcount == 1
@@ -0,0 +1,394 @@
+"""Worker loop: claims jobs from the queue and runs them on the process pool.
+
+A batch job (``wb_batch``, see ``utils.batch``) takes several pool processes:
+its archive is unpacked and paired in one, then every pair runs in parallel
+as a separate pool task and the outputs are zipped together. A WB job with
+stickers split across several PDFs has each file indexed in parallel first;
+files the bot queued "wb_index" jobs for while they were uploaded are taken
+from those jobs' results.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timezone
+
+from config import (
+    JOB_CANCEL_GRACE,
+    JOB_LEASE_SECONDS,
+    JOB_POLL_INTERVAL,
+    STICKER_ARTICLES_MIN_COVERAGE,
+    WORKER_PROCESSES,
+)
+from database.setup import Job
+from database.sticker_articles import get_sticker_articles, save_sticker_articles
+from utils.cancellation import JobCancelled
+from utils.job_queue import (
+    cancel_requested_jobs,
+    claim_job,
+    collect_subtasks,
+    extend_leases,
+    fail_job,
+    finish_job,
+    mark_cancelled,
+    queue_depth,
+    reap_expired_jobs,
+)
+from utils.logs import log_event
+from utils.metrics import ARTICLES, FIRST_JOB_SECONDS, JOB_PEAK_RSS_BYTES, JOBS, PAGES, QUEUE_DEPTH, QUEUE_WAIT_SECONDS
+from utils.batch import pack_results
+from utils.thermal import DEFAULT_DPI, render_on_pool
+from utils.tracing import current_context, record_span, span
+from utils.worker_pool import JobFailed, JobTooLarge, ProcessPool, WorkerCrashed
+from utils.workspace import job_dir, remove_job_files, wb_pdf_inputs
+
+logger = logging.getLogger(__name__)
+
+SETTLE_ATTEMPTS = 3  # Попыток записать итог задачи в базу, между попытками 1 и 2 с
+
+
+class ArticlesUnknown(Exception):
+    """A stickers-only WB job: too few of the stickers have a saved article, the pick list is needed."""
+
+    def __init__(self, known: int, total: int):
+        super().__init__(f"артикулы известны для {known} из {total} стикеров")
+        self.known = known
+        self.total = total
+
+
+class JobWorker:
+    def __init__(self, processes: int = WORKER_PROCESSES, worker_id: str | None = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.pool = ProcessPool(processes)
+        self._running: dict[int, asyncio.Task] = {}
+        self._subtasks: dict[int, int] = {}  # Задача -> число её дополнительных задач пула (ключи (job_id, n))
+        self._cancelling: set[int] = set()
+        self._stopping = asyncio.Event()
+        self.ready = asyncio.Event()  # Процессы пула прогреты, задачи берутся из очереди
+        self._first_job = True
+
+    def stop(self) -> None:
+        """Stop claiming new jobs; running jobs are allowed to finish."""
+        self._stopping.set()
+
+    async def _idle(self) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    async def start(self) -> asyncio.Task:
+        """Start ``run`` in the background; return its task once the pool has warmed up."""
+        task = asyncio.ensure_future(self.run())
+        ready = asyncio.ensure_future(self.ready.wait())
+        await asyncio.wait({task, ready}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            ready.cancel()
+            task.result()
+        return task
+
+    async def run(self) -> None:
+        self.pool.start()
+        # Задачи берутся только после прогрева: первая не ждёт импортов и шрифтов
+        await self.pool.wait_ready()
+        self.ready.set()
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+        watcher = asyncio.ensure_future(self._watch_cancellations())
+        logger.info("Воркер %s запущен, процессов: %s", self.worker_id, self.pool.size)
+        try:
+            while not self._stopping.is_set():
+                if len(self._running) >= self.pool.size:
+                    await self._idle()
+                    continue
+                try:
+                    job = await claim_job(self.worker_id)
+                except Exception:
+                    logger.exception("Не удалось получить задачу из очереди")
+                    job = None
+                if job is None:
+                    await self._idle()
+                    continue
+                self._running[job.id] = asyncio.ensure_future(self._execute(job))
+        finally:
+            if self._running:
+                await asyncio.gather(*self._running.values(), return_exceptions=True)
+            heartbeat.cancel()
+            watcher.cancel()
+            self.pool.close()
+            logger.info("Воркер %s остановлен", self.worker_id)
+
+    async def _execute(self, job: Job) -> None:
+        trace = job.payload.get("trace")
+        waited = None
+        if job.attempts == 1 and job.created_at is not None:
+            created = job.created_at
+            if created.tzinfo is None:  # SQLite хранит время без зоны
+                created = created.replace(tzinfo=timezone.utc)
+            now = datetime.now(timezone.utc)
+            waited = max(0.0, (now - created).total_seconds())
+            QUEUE_WAIT_SECONDS.observe(waited, pipeline=job.kind)
+            record_span("job.queued", trace, int(created.timestamp() * 1e9), int(now.timestamp() * 1e9), job_id=job.id)
+        started = time.perf_counter()
+        with span("job.run", parent=trace, job_id=job.id, kind=job.kind, attempt=job.attempts, worker=self.worker_id):
+            status, result = await self._run(job)
+        run_s = time.perf_counter() - started
+        if self._first_job and status == "done":
+            self._first_job = False
+            FIRST_JOB_SECONDS.set(run_s, pipeline=job.kind)
+        # Одна строка на задачу вместо журнала каждого шага
+        log_event(
+            "jobs",
+            "job",
+            logging.INFO if status in ("done", "cancelled") else logging.WARNING,
+            job_id=job.id,
+            kind=job.kind,
+            user_id=job.user_id,
+            status=status,
+            attempt=job.attempts,
+            queue_wait_s=round(waited, 3) if waited is not None else None,
+            run_s=round(run_s, 3),
+            pages=result.get("pages"),
+            articles=result.get("articles"),
+            peak_rss_mb=result.get("peak_rss_mb"),
+            stages=result.get("stages"),
+            error=result.get("error"),
+        )
+
+    async def _run(self, job: Job) -> tuple[str, dict]:
+        """Run the job on the pool and record its outcome; return (status, result)."""
+        output = os.path.join(job_dir(job.id), job.payload["output_name"])
+        try:
+            if job.kind == "wb_batch":
+                result = await self._run_batch(job, output)
+            else:
+                inputs = job.payload["inputs"]
+                if job.kind == "wb" and "excel" not in inputs:
+                    inputs = await self._stored_articles(job, inputs)
+                elif job.kind == "wb" and (len(wb_pdf_inputs(inputs)) > 1 or job.payload.get("index_jobs")):
+                    inputs = {**inputs, "sticker_pages": await self._index_pdfs(job, wb_pdf_inputs(inputs))}
+                if job.payload.get("format", "pdf") != "pdf":
+                    result = await self._run_labels(job, inputs, output)
+                else:
+                    result = await self.pool.run(
+                        job.kind,
+                        inputs,
+                        output,
+                        key=job.id,
+                        profile="profile" in job.payload,
+                        trace=current_context(),
+                    )
+                await self._remember_articles(job, result.pop("sticker_articles", None))
+        except JobCancelled:
+            JOBS.inc(pipeline=job.kind, status="cancelled")
+            await self._settle(job, mark_cancelled)
+            remove_job_files(job.id, job.payload)
+            return "cancelled", {}
+        except WorkerCrashed as exc:
+            JOBS.inc(pipeline=job.kind, status="crashed")
+            await self._settle(job, fail_job, str(exc), retry=True, crashed=True)
+            return "crashed", {"error": str(exc)}
+        except ArticlesUnknown as exc:
+            JOBS.inc(pipeline=job.kind, status="needs_excel")
+            await self._settle(job, fail_job, str(exc), reason="needs_excel")
+            return "needs_excel", {"error": str(exc)}
+        except JobTooLarge as exc:
+            JOBS.inc(pipeline=job.kind, status="too_large")
+            await self._settle(job, fail_job, str(exc), reason="too_large")
+            return "too_large", {"error": str(exc)}
+        except JobFailed as exc:
+            JOBS.inc(pipeline=job.kind, status="failed")
+            await self._settle(job, fail_job, str(exc))
+            return "failed", {"error": str(exc)}
+        except Exception as exc:
+            # Ошибка вне пула (база, файлы задачи): задача не должна остаться в работе до истечения аренды
+            logger.exception("Ошибка при выполнении задачи %s", job.id)
+            JOBS.inc(pipeline=job.kind, status="error")
+            error = f"{type(exc).__name__}: {exc}"
+            await self._settle(job, fail_job, error)
+            return "error", {"error": error}
+        else:
+            JOBS.inc(pipeline=job.kind, status="done")
+            PAGES.inc(result.get("pages", 0), pipeline=job.kind)
+            ARTICLES.inc(result.get("articles", 0), pipeline=job.kind)
+            if "peak_rss_mb" in result:
+                JOB_PEAK_RSS_BYTES.observe(result["peak_rss_mb"] * 2**20, pipeline=job.kind)
+            await self._settle(job, finish_job, result)
+            return "done", result
+        finally:
+            self._running.pop(job.id, None)
+            self._subtasks.pop(job.id, None)
+            self._cancelling.discard(job.id)
+
+    async def _settle(self, job: Job, outcome, *args, **kwargs) -> None:
+        """Record the job's outcome with ``outcome(job.id, ...)``, retrying database errors.
+
+        If every attempt fails the error is logged: the job stays running until
+        its lease expires and then goes back to the queue or is reaped.
+        """
+        for attempt in range(SETTLE_ATTEMPTS):
+            try:
+                await outcome(job.id, *args, **kwargs)
+                return
+            except Exception:
+                if attempt == SETTLE_ATTEMPTS - 1:
+                    logger.exception("Не удалось записать итог задачи %s", job.id)
+                    return
+                logger.warning("Не удалось записать итог задачи %s, повтор", job.id, exc_info=True)
+                await asyncio.sleep(2**attempt)
+
+    async def _index_pdfs(self, job: Job, pdfs: list[str]) -> list[dict]:
+        """Indexes of the job's sticker PDFs in order.
+
+        PDFs the bot got indexed by "wb_index" jobs as they arrived (``index_jobs``
+        of the payload) are not read again; the rest are indexed now, each in its
+        own pool process.
+        """
+        index_jobs = job.payload.get("index_jobs") or []
+        done = await collect_subtasks([job_id for job_id in index_jobs if job_id is not None])
+        indexes = [None] * len(pdfs)
+        for index, job_id in enumerate(index_jobs[: len(pdfs)]):
+            if job_id in done:
+                indexes[index] = done[job_id]["sticker_pages"]
+        missing = [index for index, sticker_pages in enumerate(indexes) if sticker_pages is None]
+        self._subtasks[job.id] = len(pdfs)
+        results = await asyncio.gather(
+            *(
+                self.pool.run("wb_index", {"pdf": pdfs[index]}, "", key=(job.id, index), trace=current_context())
+                for index in missing
+            ),
+            return_exceptions=True,
+        )
+        for index, result in zip(missing, results):
+            if isinstance(result, BaseException):
+                raise result
+            indexes[index] = result["sticker_pages"]
+        return indexes
+
+    async def _stored_articles(self, job: Job, inputs: dict) -> dict:
+        """Inputs of a stickers-only WB job: the PDF indexes and the articles saved from the seller's pick lists."""
+        sticker_pages = await self._index_pdfs(job, wb_pdf_inputs(inputs))
+        stickers = set().union(*sticker_pages)
+        articles = await get_sticker_articles(job.user_id, stickers)
+        if stickers and len(articles) < STICKER_ARTICLES_MIN_COVERAGE * len(stickers):
+            raise ArticlesUnknown(len(articles), len(stickers))
+        return {**inputs, "sticker_pages": sticker_pages, "sticker_articles": articles}
+
+    async def _remember_articles(self, job: Job, sticker_articles: dict | None) -> None:
+        """Save the sticker -> article map of a processed pick list for the seller's stickers-only jobs."""
+        if not sticker_articles or job.user_id is None:
+            return
+        try:
+            await save_sticker_articles(job.user_id, sticker_articles)
+        except Exception:
+            # Не сохранились артикулы — задача всё равно выполнена
+            logger.exception("Не удалось сохранить артикулы стикеров задачи %s", job.id)
+
+    async def _run_labels(self, job: Job, inputs: dict, output: str) -> dict:
+        """Plan the thermal printer labels in one pool process, then render parts of the plan in all of them."""
+        output_format = job.payload["format"]
+        planned = await self.pool.run(
+            job.kind, {**inputs, "format": output_format}, output, key=job.id, trace=current_context()
+        )
+        self._subtasks[job.id] = max(self._subtasks.get(job.id, 0), self.pool.size)
+        rendered = await render_on_pool(
+            self.pool,
+            planned.pop("plan"),
+            output_format,
+            job.payload.get("dpi", DEFAULT_DPI),
+            output,
+            job.id,
+            self.pool.size,
+            trace=current_context(),
+        )
+        stages = dict(planned["stages"])
+        for name, seconds in rendered["stages"].items():
+            stages[name] = round(stages.get(name, 0.0) + seconds, 4)
+        return {
+            **planned,
+            **rendered,
+            "output": output,
+            "stages": stages,
+            "peak_rss_mb": max(planned["peak_rss_mb"], rendered["peak_rss_mb"]),
+        }
+
+    async def _run_batch(self, job: Job, output: str) -> dict:
+        """Pair the archive's files, run the pairs in parallel and zip their outputs with a report."""
+        directory = os.path.dirname(output)
+        plan = await self.pool.run("wb_batch_plan", job.payload["inputs"], directory, key=job.id, trace=current_context())
+        pairs = plan["pairs"]
+        self._subtasks[job.id] = len(pairs)
+        os.makedirs(os.path.join(directory, "outputs"), exist_ok=True)
+
+        async def run_pair(index: int, pair: dict) -> dict:
+            if job.id in self._cancelling:
+                raise JobCancelled()
+            pair_output = os.path.join(directory, "outputs", f"{index}.pdf")
+            inputs = {"excel": pair["excel"], "pdf": pair["pdf"]}
+            try:
+                result = await self.pool.run("wb", inputs, pair_output, key=(job.id, index), trace=current_context())
+            except JobTooLarge as exc:
+                return {**pair, "status": "too_large", "error": str(exc)}
+            except (JobFailed, WorkerCrashed) as exc:
+                # Ошибка одной пары не должна отменять остальные: она попадает в отчёт
+                return {**pair, "status": "failed", "error": str(exc)}
+            await self._remember_articles(job, result.pop("sticker_articles", None))
+            return {**pair, **result, "status": "done", "output": pair_output}
+
+        outcomes = await asyncio.gather(*(run_pair(i, pair) for i, pair in enumerate(pairs)), return_exceptions=True)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        await asyncio.to_thread(pack_results, output, outcomes, plan["unpaired"])
+
+        stages: dict[str, float] = dict(plan.get("stages", {}))
+        for outcome in outcomes:
+            for name, seconds in outcome.pop("stages", {}).items():
+                stages[name] = stages.get(name, 0.0) + seconds
+        done = [outcome for outcome in outcomes if outcome["status"] == "done"]
+        return {
+            "output": output,
+            "pages": sum(outcome["pages"] for outcome in done),
+            "articles": sum(outcome["articles"] for outcome in done),
+            "peak_rss_mb": max((outcome.get("peak_rss_mb", 0) for outcome in done), default=0),
+            "stages": stages,
+            "pairs": [
+                {key: outcome.get(key) for key in ("name", "excel", "pdf", "matched_by", "status", "pages", "articles", "error")}
+                for outcome in outcomes
+            ],
+            "unpaired": plan["unpaired"],
+        }
+
+    async def _watch_cancellations(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            try:
+                for job_id in await cancel_requested_jobs(list(self._running)):
+                    self._cancelling.add(job_id)
+                    self.pool.cancel(job_id, JOB_CANCEL_GRACE)
+                    for index in range(self._subtasks.get(job_id, 0)):
+                        self.pool.cancel((job_id, index), JOB_CANCEL_GRACE)
+            except Exception:
+                logger.exception("Не удалось проверить запросы на отмену")
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await extend_leases(list(self._running), self.worker_id)
+                reaped = await reap_expired_jobs()
+                if reaped:
+                    logger.warning("Закрыто задач потерянных воркеров: %s", reaped)
+            except Exception:
+                logger.exception("Не удалось продлить аренду задач")
+            await self._update_queue_depth()
+
+    async def _update_queue_depth(self) -> None:
+        try:
+            for status, count in (await queue_depth()).items():
+                QUEUE_DEPTH.set(count, status=status)
+        except Exception:
+            logger.exception("Не удалось получить размер очереди")
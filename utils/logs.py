@@ -0,0 +1,145 @@
+"""Structured, sampled logging.
+
+Log records are written as JSON lines (``LOG_FORMAT=json``, the default) with
+the fields passed to ``log_event``. Chatty categories are sampled:
+
+* ``updates`` — one line per Telegram update (replaces aiogram's LoggingMiddleware);
+* ``sql`` — every SQL statement (statements slower than ``SLOW_QUERY_MS`` are
+  always logged as ``slow_query``);
+* ``jobs`` — one summary line per processed job.
+
+A category's rate is the share of events that are written: 0 — off, 1 — all.
+Warnings and errors are never sampled. Rates are changed at runtime from the
+admin panel: they are stored in the ``runtime_settings`` table and every
+process re-reads them every ``LOG_RATES_REFRESH`` seconds.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+from config import LOG_FORMAT, LOG_LEVEL, LOG_RATES_REFRESH, LOG_SQL_RATE, LOG_UPDATES_RATE, SLOW_QUERY_MS
+
+logger = logging.getLogger("wb_stickers")
+
+DEFAULT_RATES = {
+    "updates": LOG_UPDATES_RATE,
+    "sql": LOG_SQL_RATE,
+    "jobs": 1.0,
+}
+RATES_SETTING = "log_rates"
+
+_rates = dict(DEFAULT_RATES)
+_refresh_task: asyncio.Task | None = None
+
+# Стандартные атрибуты LogRecord, которые не нужно дублировать в JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging() -> None:
+    """Configure the root logger; replaces ``logging.basicConfig`` in entry points."""
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(LOG_LEVEL)
+    # Журнал SQLAlchemy пишет каждый запрос; запросы логируются через категорию sql
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
+
+
+def sampled(category: str) -> bool:
+    """Whether an event of ``category`` should be logged this time."""
+    rate = _rates.get(category, 1.0)
+    return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+def log_event(category: str, event: str, level: int = logging.INFO, **fields) -> None:
+    if level < logging.WARNING and not sampled(category):
+        return
+    extra = {(f"{key}_" if key in _RECORD_ATTRS else key): value for key, value in fields.items()}
+    logger.log(level, event, extra={"category": category, **extra})
+
+
+def rates() -> dict[str, float]:
+    return dict(_rates)
+
+
+def apply_rates(values: dict) -> None:
+    for category, rate in values.items():
+        if category in DEFAULT_RATES:
+            _rates[category] = min(1.0, max(0.0, float(rate)))
+
+
+async def load_rates() -> None:
+    from database.runtime_settings import get_setting
+
+    apply_rates(await get_setting(RATES_SETTING, {}))
+
+
+async def save_rate(category: str, rate: float) -> None:
+    """Change a category's rate in this process and for all others (within LOG_RATES_REFRESH)."""
+    from database.runtime_settings import get_setting, set_setting
+
+    stored = await get_setting(RATES_SETTING, {})
+    stored[category] = rate
+    await set_setting(RATES_SETTING, stored)
+    apply_rates(stored)
+
+
+async def _refresh_forever() -> None:
+    while True:
+        try:
+            await load_rates()
+        except Exception:
+            logger.exception("Не удалось загрузить настройки логирования")
+        await asyncio.sleep(LOG_RATES_REFRESH)
+
+
+def start_rate_refresh() -> asyncio.Task:
+    """Start the periodic re-read of sampling rates (once per process)."""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.ensure_future(_refresh_forever())
+    return _refresh_task
+
+
+def install_query_log(engine) -> None:
+    """Log slow SQL statements always and the rest according to the ``sql`` rate."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _started(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info.pop("query_started", time.perf_counter())) * 1000
+        if elapsed_ms >= SLOW_QUERY_MS:
+            log_event("sql", "slow_query", logging.WARNING, ms=round(elapsed_ms, 1), statement=statement[:2000])
+        else:
+            log_event("sql", "query", ms=round(elapsed_ms, 1), statement=statement[:2000])
@@ -0,0 +1,212 @@
+"""Process-local metrics exposed in the Prometheus text format.
+
+Only what the bot needs: counters, gauges and histograms with labels, and an
+aiohttp ``/metrics`` endpoint. Pipeline stages run in pool processes; their
+timings are sent back with the job result and recorded in the parent (see
+``utils.worker_pool``), so one scrape per process sees everything.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_registry: list["_Metric"] = []
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: dict[tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @property
+    def exposed_name(self) -> str:
+        """Name of the samples, also used in the HELP and TYPE lines."""
+        return self.name
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.exposed_name} {self.documentation}", f"# TYPE {self.exposed_name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    @property
+    def exposed_name(self) -> str:
+        # Как в client_python: сэмплы счётчика и его HELP/TYPE называются <name>_total
+        return self.name if self.name.endswith("_total") else f"{self.name}_total"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0.0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._children.items())
+        return [f"{self.exposed_name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._children[self._key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._children.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._children.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._children[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._children.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+async def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Serve ``/metrics`` on a local port; returns the aiohttp runner."""
+    from aiohttp import web
+
+    async def handle(_request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+# Метрики приложения
+STAGE_SECONDS = Histogram(
+    "wb_stickers_stage_seconds",
+    "Duration of a processing stage (download, pipeline stages, upload).",
+    ("pipeline", "stage"),
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "wb_stickers_queue_wait_seconds", "Time a job spent in the queue before a worker took it.", ("pipeline",)
+)
+JOBS = Counter("wb_stickers_jobs", "Finished jobs by outcome.", ("pipeline", "status"))
+PAGES = Counter("wb_stickers_pages", "Sticker pages processed.", ("pipeline",))
+ARTICLES = Counter("wb_stickers_articles", "Article groups produced.", ("pipeline",))
+BYTES = Counter("wb_stickers_bytes", "File bytes transferred.", ("pipeline", "direction"))
+QUEUE_DEPTH = Gauge("wb_stickers_queue_depth", "Jobs in the queue by status.", ("status",))
+POOL_SIZE = Gauge("wb_stickers_worker_pool_size", "Processes in the worker pool.")
+POOL_BUSY = Gauge("wb_stickers_worker_pool_busy", "Worker pool processes currently running a job.")
+JOB_PEAK_RSS_BYTES = Histogram(
+    "wb_stickers_job_peak_rss_bytes",
+    "Peak resident memory of the pool process while it ran a job.",
+    ("pipeline",),
+    buckets=tuple(mb * 2**20 for mb in (64, 128, 256, 384, 512, 768, 1024, 1536, 2048, 3072)),
+)
+DB_CHECKOUT_WAIT_SECONDS = Histogram(
+    "wb_stickers_db_checkout_wait_seconds",
+    "Time spent waiting for a free database connection.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+DB_CONNECTIONS_IN_USE = Gauge("wb_stickers_db_connections_in_use", "Database connections checked out of the pool.")
+DB_POOL_CAPACITY = Gauge("wb_stickers_db_pool_capacity", "Maximum connections of the pool (size + overflow).")
+STARTUP_SECONDS = Gauge(
+    "wb_stickers_startup_seconds", "Time from process start until it was ready to take work.", ("process",)
+)
+WORKER_WARMUP_SECONDS = Histogram("wb_stickers_worker_warmup_seconds", "Warm-up time of a worker pool process.")
+WORKER_RECYCLED = Counter(
+    "wb_stickers_worker_recycled", "Pool processes replaced after a job (jobs, rss, memory_error).", ("reason",)
+)
+FIRST_JOB_SECONDS = Gauge(
+    "wb_stickers_first_job_seconds", "Run time of the first job this worker processed after start.", ("pipeline",)
+)
+JANITOR_FSM_EXPIRED = Counter("wb_stickers_janitor_fsm_expired", "Abandoned scenarios reset by the janitor.")
+JANITOR_FILES_REMOVED = Counter(
+    "wb_stickers_janitor_files_removed", "Workspace files deleted by the janitor (fsm, orphan, job_dir).", ("reason",)
+)
+JANITOR_BYTES_REMOVED = Counter(
+    "wb_stickers_janitor_bytes_removed", "Bytes of workspace files deleted by the janitor.", ("reason",)
+)
+API_REQUESTS = Counter(
+    "wb_stickers_api_requests", "HTTP API requests by route and response status.", ("route", "status")
+)
@@ -0,0 +1,177 @@
+"""Chunked writer of grouped sticker PDFs for very large batches.
+
+The in-memory path keeps the whole source, the reordered pages and every
+inserted header page in one ``fitz.Document`` until the final ``save``; with
+embedded barcode images a 10k-page batch takes gigabytes. ``write_grouped``
+instead copies the pages into a new document with ``insert_pdf`` and, every
+``PDF_CHUNK_PAGES`` pages, writes what it has to disk (the first time in full,
+then incrementally), reopens the output and the source and shrinks MuPDF's
+object store. Neither copied nor parsed pages accumulate: peak memory depends
+on the chunk size, not on the document size.
+
+Pages can come from several source files (stickers of one supply exported as
+separate PDFs): they are copied straight from each file, no merged copy of the
+sources is ever written.
+"""
+
+from __future__ import annotations
+
+import os
+
+import fitz  # PyMuPDF
+
+from config import FONT_PATH, PDF_CHUNK_PAGES
+from utils.cancellation import NEVER, CancelToken
+from utils.fonts import FONT_NAME, font_buffer
+from utils.memory import rss_bytes
+
+
+class ChunkedPdfWriter:
+    """Output document flushed to ``path`` every ``chunk_pages`` pages, copying from ``sources``.
+
+    Pages returned by ``copy_page`` and ``new_page`` are valid until the next
+    call. Every page gets the text font as a resource, embedded once for the
+    whole file, so ``utils.fonts.use_font`` does not embed it again after the
+    output has been reopened.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sources: str | list[str],
+        chunk_pages: int = PDF_CHUNK_PAGES,
+        font_path: str = FONT_PATH,
+    ):
+        self.path = str(path)
+        self.sources = [str(sources)] if isinstance(sources, (str, os.PathLike)) else [str(s) for s in sources]
+        self.srcs = [fitz.open(source) for source in self.sources]
+        self.chunk_pages = max(1, chunk_pages)
+        self.font_path = font_path
+        self.doc = fitz.open()
+        self.peak_rss = rss_bytes()
+        self._saved = False
+        self._unsaved_pages = 0
+        self._font_xref = 0
+
+    @property
+    def src(self) -> fitz.Document:
+        return self.srcs[0]
+
+    def copy_page(self, index: int, source: int = 0) -> fitz.Page:
+        self._reserve()
+        # final=0: общие ресурсы источника (шрифты) копируются один раз на фрагмент
+        self.doc.insert_pdf(self.srcs[source], from_page=index, to_page=index, final=0)
+        return self._added()
+
+    def new_page(self, width: float, height: float) -> fitz.Page:
+        self._reserve()
+        self.doc.new_page(width=width, height=height)
+        return self._added()
+
+    def _added(self) -> fitz.Page:
+        self._unsaved_pages += 1
+        page = self.doc[-1]
+        if not any(font[4] == FONT_NAME for font in page.get_fonts()):
+            if self._font_xref:
+                self._link_font(page)
+            else:
+                self._font_xref = page.insert_font(fontname=FONT_NAME, fontbuffer=font_buffer(self.font_path))
+        return page
+
+    def _link_font(self, page: fitz.Page) -> None:
+        """Add the already embedded font to the page's /Resources/Font."""
+        # xref_set_key не проходит по косвенным ссылкам: /Resources и /Font у скопированных страниц — отдельные объекты
+        xref, path = page.xref, ""
+        for key in ("Resources", "Font"):
+            kind, value = self.doc.xref_get_key(xref, path + key)
+            if kind == "xref":
+                xref, path = int(value.split()[0]), ""
+            else:
+                path += key + "/"
+        self.doc.xref_set_key(xref, path + FONT_NAME, f"{self._font_xref} 0 R")
+
+    def _reserve(self) -> None:
+        if self._unsaved_pages >= self.chunk_pages:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the pages added so far and release their memory."""
+        self.peak_rss = max(self.peak_rss, rss_bytes())
+        if self._saved:
+            self.doc.saveIncr()
+        else:
+            self.doc.save(self.path)
+            self._saved = True
+        self.doc.close()
+        # Источники тоже переоткрываются: MuPDF держит в памяти все разобранные объекты документа
+        self._close_sources()
+        fitz.TOOLS.store_shrink(100)
+        self.doc = fitz.open(self.path)
+        self.srcs = [fitz.open(source) for source in self.sources]
+        self._unsaved_pages = 0
+
+    def _close_sources(self) -> None:
+        for src in self.srcs:
+            src.close()
+
+    def close(self) -> None:
+        if self._unsaved_pages or not self._saved:
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+            if self._saved:
+                self.doc.saveIncr()
+            else:
+                self.doc.save(self.path)
+        self.doc.close()
+        self._close_sources()
+        fitz.TOOLS.store_shrink(100)
+
+    def abort(self) -> None:
+        self.doc.close()
+        self._close_sources()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def write_grouped(
+    source: str | list[str],
+    ordered: list[int] | list[tuple[int, int]],
+    groups: list[tuple[int, str, int]],
+    path: str,
+    header,
+    decorate=None,
+    cancel: CancelToken = NEVER,
+    chunk_pages: int = PDF_CHUNK_PAGES,
+    font_path: str = FONT_PATH,
+) -> int:
+    """Write pages of the ``source`` PDF in ``ordered`` order with a header page before each group.
+
+    ``groups`` are (position in ``ordered``, article, count) as produced by the
+    pipelines' ordering step; ``header(page, article, count)`` fills a header
+    page and ``decorate(page)``, if given, edits every copied page. With a
+    list of sources, ``ordered`` holds (source index, page index) pairs.
+    Returns the peak RSS observed while writing, in bytes.
+    """
+    writer = ChunkedPdfWriter(path, source, chunk_pages, font_path)
+    located = [entry if isinstance(entry, tuple) else (0, entry) for entry in ordered]
+    first = writer.srcs[located[0][0]][located[0][1]].rect
+    width, height = first.width, first.height
+    pending = sorted(groups, key=lambda group: group[0])
+    next_group = 0
+    try:
+        for position, (source_index, index) in enumerate(located):
+            while next_group < len(pending) and pending[next_group][0] <= position:
+                _, article, count = pending[next_group]
+                header(writer.new_page(width, height), article, count)
+                next_group += 1
+            cancel.check()
+            page = writer.copy_page(index, source_index)
+            if decorate is not None:
+                decorate(page)
+        for _, article, count in pending[next_group:]:
+            header(writer.new_page(width, height), article, count)
+        cancel.check()
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.peak_rss
@@ -0,0 +1,59 @@
+"""Entry point of the processing pipelines inside pool processes."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from utils.batch import plan_batch
+from utils.cancellation import NEVER, CancelToken
+from utils.create_ozon_pdf import build_ozon_pdf, plan_ozon_labels
+from utils.create_pdf import build_wb_pdf, index_sticker_pages, plan_wb_labels
+from utils.memory import peak_rss_bytes, reset_peak_rss
+from utils.stages import stage
+from utils.thermal import render_labels
+from utils.workspace import wb_pdf_inputs
+
+
+def run_job(kind: str, inputs: dict, output: str, cancel: CancelToken = NEVER) -> dict:
+    """Run the pipeline for ``kind`` and return the job result (output path, pages, articles, peak RSS).
+
+    With a thermal printer ``format`` in ``inputs`` the WB and Ozon pipelines
+    return the label plan (``plan``) instead of writing ``output``; the plan is
+    rendered by "labels" jobs (``utils.thermal.render_on_pool``).
+    """
+    if kind == "wb_batch_plan":
+        # Распаковка и подбор пар пакетного режима; сами пары — обычные задачи "wb"
+        return plan_batch(inputs["archive"], output, cancel=cancel)
+    if kind == "wb_index":
+        # Индекс одного из нескольких PDF задачи WB; файлы индексируются параллельно в разных процессах
+        with stage("extract", pipeline="wb"):
+            return {"sticker_pages": index_sticker_pages(inputs["pdf"], cancel)}
+    stats = {"pages": 0, "articles": 0}
+    reset_peak_rss()
+    labels = inputs.get("format", "pdf") != "pdf"
+    if kind == "labels":
+        stats = render_labels(inputs["plan"], inputs["format"], inputs["dpi"], output, cancel)
+    elif kind == "wb":
+        # Без листа подбора ("excel") воркер передаёт сохранённые артикулы стикеров
+        pdfs = wb_pdf_inputs(inputs)
+        options = {
+            "cancel": cancel,
+            "stats": stats,
+            "sticker_pages": inputs.get("sticker_pages"),
+            "sticker_articles": inputs.get("sticker_articles"),
+        }
+        if labels:
+            stats["plan"] = plan_wb_labels(inputs.get("excel"), pdfs, **options)
+            found = stats["plan"] is not None
+        else:
+            found = build_wb_pdf(inputs.get("excel"), pdfs, output, **options)
+        if not found:
+            raise ValueError("ни один стикер из PDF не найден в листе подбора")
+    elif kind == "ozon":
+        if labels:
+            stats["plan"] = plan_ozon_labels(Path(inputs["assembly"]), Path(inputs["ticket"]), cancel=cancel, stats=stats)
+        else:
+            build_ozon_pdf(Path(inputs["assembly"]), Path(inputs["ticket"]), Path(output), cancel=cancel, stats=stats)
+    else:
+        raise ValueError(f"unknown job kind: {kind}")
+    return {"output": output, **stats, "peak_rss_mb": round(peak_rss_bytes() / 2**20, 1)}
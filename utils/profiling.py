@@ -0,0 +1,126 @@
+"""Profiling of a single job, switched on per job from the admin panel.
+
+Runs inside the pool process. A background thread samples the stack of the
+main thread every few milliseconds (a statistical profiler: the pipeline is
+not slowed down the way ``cProfile`` slows it) and ``tracemalloc`` records
+allocations. Two files are written next to the job output:
+
+* ``<output>.collapsed`` — stacks in the collapsed format ("a;b;c 42"),
+  ready for flamegraph.pl or speedscope;
+* ``<output>.profile.txt`` — a short text report: hottest functions and
+  top allocations.
+
+Jobs without the flag do not touch this module at all.
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 20
+TRACEMALLOC_FRAMES = 10
+
+
+def profile_paths(output: str) -> tuple[str, str]:
+    """Return (collapsed stacks, text report) paths of a job's profile."""
+    return f"{output}.collapsed", f"{output}.profile.txt"
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}"
+
+
+class StackSampler(threading.Thread):
+    """Counts collapsed stacks of one thread sampled at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self.stacks: Counter[str] = Counter()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+def _report(sampler: StackSampler, snapshot: tracemalloc.Snapshot, wall: float, error: str | None) -> str:
+    total = sum(sampler.stacks.values()) or 1
+    own: Counter[str] = Counter()
+    inclusive: Counter[str] = Counter()
+    for stack, count in sampler.stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for name in set(frames):
+            inclusive[name] += count
+
+    lines = [f"Время: {wall:.2f} с, сэмплов: {total} (шаг {SAMPLE_INTERVAL * 1000:.0f} мс)"]
+    if error:
+        lines.append(f"Задача завершилась ошибкой: {error}")
+    lines += ["", "Собственное время (self):"]
+    lines += [f"{count / total:7.1%}  {name}" for name, count in own.most_common(TOP_FUNCTIONS)]
+    lines += ["", "Время с вызовами (inclusive):"]
+    lines += [f"{count / total:7.1%}  {name}" for name, count in inclusive.most_common(TOP_FUNCTIONS)]
+    lines += ["", "Выделения памяти (tracemalloc, живые на конец задачи):"]
+    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 2**20:8.2f} МБ {stat.count:8d} блоков  {frame.filename}:{frame.lineno}")
+    current, peak = tracemalloc.get_traced_memory()
+    lines.append(f"Пик Python-аллокаций: {peak / 2**20:.1f} МБ")
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def profiled(output: str):
+    """Profile the enclosed block and write the profile files for ``output``.
+
+    The files are written even if the block raises.
+    """
+    sampler = StackSampler(threading.get_ident())
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    started = time.perf_counter()
+    sampler.start()
+    error = None
+    try:
+        yield
+    except BaseException as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        sampler.stop()
+        wall = time.perf_counter() - started
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, threading.__file__),
+        ))
+        report = _report(sampler, snapshot, wall, error)
+        tracemalloc.stop()
+        collapsed_path, report_path = profile_paths(output)
+        os.makedirs(os.path.dirname(collapsed_path) or ".", exist_ok=True)
+        with open(collapsed_path, "w", encoding="utf-8") as fh:
+            for stack, count in sampler.stacks.most_common():
+                fh.write(f"{stack} {count}\n")
+        with open(report_path, "w", encoding="utf-8") as fh:
+            fh.write(report)
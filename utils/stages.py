@@ -0,0 +1,37 @@
+"""Named pipeline stages with pluggable observers.
+
+Pipelines wrap every step in ``with stage("extract", pipeline="wb"):``.
+Observers (benchmarks, metrics, tracing) are context-manager factories
+registered with ``add_observer``; without observers a stage costs one list
+check.
+"""
+
+from __future__ import annotations
+
+from contextlib import ExitStack, contextmanager
+from typing import Callable, ContextManager
+
+Observer = Callable[[str, dict], ContextManager]
+
+_observers: list[Observer] = []
+
+
+def add_observer(observer: Observer) -> None:
+    if observer not in _observers:
+        _observers.append(observer)
+
+
+def remove_observer(observer: Observer) -> None:
+    if observer in _observers:
+        _observers.remove(observer)
+
+
+@contextmanager
+def stage(name: str, **labels):
+    if not _observers:
+        yield
+        return
+    with ExitStack() as stack:
+        for observer in list(_observers):
+            stack.enter_context(observer(name, labels))
+        yield
@@ -0,0 +1,57 @@
+"""Getting documents from the Bot API server and size limits of its mode.
+
+The cloud Bot API serves files up to 20 MB over HTTP and accepts uploads up
+to 50 MB. A self-hosted server started with ``--local`` has no download cap:
+``getFile`` returns the absolute path of the file in the server's working
+directory, and uploads go up to 2000 MB. With ``TELEGRAM_API_LOCAL=1`` the bot
+opens documents right there instead of copying them into the job workspace.
+The server's directory must be readable by the bot and by the workers (the
+same volume mounted everywhere; ``TELEGRAM_API_PATH_MAP`` translates the
+server's path if it is mounted elsewhere).
+"""
+
+from __future__ import annotations
+
+import os
+
+from config import TELEGRAM_API_LOCAL, TELEGRAM_API_PATH_MAP
+
+CLOUD_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+CLOUD_UPLOAD_LIMIT = 50 * 1024 * 1024
+LOCAL_UPLOAD_LIMIT = 2000 * 1024 * 1024
+
+DOWNLOAD_LIMIT = None if TELEGRAM_API_LOCAL else CLOUD_DOWNLOAD_LIMIT
+UPLOAD_LIMIT = LOCAL_UPLOAD_LIMIT if TELEGRAM_API_LOCAL else CLOUD_UPLOAD_LIMIT
+
+
+def exceeds_download_limit(size: int | None) -> bool:
+    return bool(DOWNLOAD_LIMIT and size and size > DOWNLOAD_LIMIT)
+
+
+def exceeds_upload_limit(size: int) -> bool:
+    return size > UPLOAD_LIMIT
+
+
+def local_path(file_path: str, path_map: str = TELEGRAM_API_PATH_MAP) -> str | None:
+    """Path on this machine of a file returned by a local server's ``getFile``, if it is readable here."""
+    if not os.path.isabs(file_path):
+        return None
+    server_dir, _, mounted_dir = path_map.partition("=")
+    if server_dir and mounted_dir and os.path.commonpath([file_path, server_dir]) == server_dir:
+        file_path = os.path.join(mounted_dir, os.path.relpath(file_path, server_dir))
+    return file_path if os.path.isfile(file_path) else None
+
+
+async def fetch_document(document, destination: str) -> tuple[str, bool]:
+    """Make ``document`` available as a file; return (path, whether it was downloaded).
+
+    In local mode the path is the server's own file, which the bot must not
+    delete; otherwise the document is downloaded to ``destination``.
+    """
+    if TELEGRAM_API_LOCAL:
+        file = await document.get_file()
+        path = local_path(file.file_path)
+        if path is not None:
+            return path, False
+    await document.download(destination_file=destination)
+    return destination, True
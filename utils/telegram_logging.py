@@ -0,0 +1,37 @@
+"""aiogram middleware writing one sampled log line per update (category ``updates``)."""
+
+from __future__ import annotations
+
+import time
+
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from utils.logs import log_event, sampled
+
+
+class UpdateLogMiddleware(BaseMiddleware):
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        # Решение о выборке принимается сразу, чтобы не тратить время на неотбранные апдейты
+        if sampled("updates"):
+            data["_log_started"] = time.perf_counter()
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        started = data.pop("_log_started", None)
+        if started is None:
+            return
+        if update.message:
+            kind, user_id = update.message.content_type, update.message.from_user.id
+        elif update.callback_query:
+            kind, user_id = f"callback:{update.callback_query.data}", update.callback_query.from_user.id
+        else:
+            kind, user_id = "other", None
+        log_event(
+            "updates",
+            "update",
+            update_id=update.update_id,
+            update_type=kind,
+            user_id=user_id,
+            handled=bool(result),
+            ms=round((time.perf_counter() - started) * 1000, 1),
+        )
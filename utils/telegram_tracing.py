@@ -0,0 +1,40 @@
+"""aiogram middleware opening a trace span for every update.
+
+Updates of one flow (from "Обработать заказы" to the uploaded files) share a
+trace: the flow's first update stores its context in the FSM data under
+``trace`` and later updates of the flow continue that trace.
+"""
+
+from __future__ import annotations
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from utils import tracing
+
+
+def _sender(update: types.Update):
+    if update.message:
+        return update.message.chat.id, update.message.from_user.id, "message"
+    if update.callback_query:
+        query = update.callback_query
+        chat_id = query.message.chat.id if query.message else query.from_user.id
+        return chat_id, query.from_user.id, "callback_query"
+    return None, None, "other"
+
+
+class TracingMiddleware(BaseMiddleware):
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        chat_id, user_id, kind = _sender(update)
+        parent = None
+        if user_id is not None:
+            state = Dispatcher.get_current().current_state(chat=chat_id, user=user_id)
+            parent = (await state.get_data()).get("trace")
+        data["_trace_span"] = tracing.start_trace(
+            "telegram.update", parent, update_id=update.update_id, update_type=kind, user_id=user_id
+        )
+
+    async def on_post_process_update(self, update: types.Update, result, data: dict):
+        opened = data.pop("_trace_span", None)
+        if opened is not None:
+            opened.end()
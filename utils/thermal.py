@@ -0,0 +1,350 @@
+"""Output for thermal label printers: ZPL and 1-bit PNG/PBM at the printer's DPI.
+
+Packers print on 58×40 mm thermal printers; sent the vector PDF, the printer
+(or its driver) rasterises every label on the fly. Here labels are rasterised
+once, on the worker pool, at the printer's resolution:
+
+* ``zpl`` — one ``^XA…^XZ`` label per page, the bitmap in a compressed
+  ``^GFA`` graphic field (Z64);
+* ``pbm`` — binary PBM images, one after another in one file;
+* ``png`` — a 1-bit PNG per label, in a ZIP archive.
+
+Instead of a PDF the pipelines then produce a label plan (``label_plan``): the
+source PDFs and the labels in print order — group headers, and sticker pages
+with the article to print over their "WB" mark. ``render_labels`` rasterises
+each source page as is and pastes the article from a tile cache: a group
+header or an article overlay is rasterised once per text, size and DPI.
+``render_on_pool`` renders chunks of a plan in parallel on the worker pool and
+joins the parts; chunks are cut at group boundaries where possible, so the
+processes do not rasterise the same tiles (only a group larger than a chunk
+is shared by several processes).
+
+PyMuPDF and numpy are imported only where labels are rendered: the module is
+imported by the bot process too.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import base64
+import binascii
+import bisect
+import os
+import shutil
+import struct
+import zipfile
+import zlib
+
+from config import FONT_PATH
+from utils.cancellation import NEVER, CancelToken
+from utils.stages import stage
+
+FORMATS = ("pdf", "zpl", "png", "pbm")
+DPIS = (203, 300)
+DEFAULT_DPI = 203
+EXTENSIONS = {"pdf": ".pdf", "zpl": ".zpl", "png": ".zip", "pbm": ".pbm"}
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "zpl": "text/plain",
+    "png": "application/zip",
+    "pbm": "image/x-portable-bitmap",
+}
+_BLACK_LEVEL = 128  # Пиксели темнее этого уровня серого печатаются
+
+
+def label_plan(pipeline: str, sources: list[str], ordered: list, groups: list, overlay=None, font_path: str = FONT_PATH) -> dict:
+    """Plan of the grouped batch, from the same page order and group headers as ``write_grouped`` takes.
+
+    ``ordered`` holds page indexes of the single source or (source, page)
+    pairs; ``groups`` holds (position, article, count). ``overlay(article)``
+    returns the text to print over the "WB" mark of the group's stickers.
+    """
+    entries: list[tuple] = []
+    current, group = None, 0
+    for position in range(len(ordered) + 1):
+        while group < len(groups) and groups[group][0] <= position:
+            _, current, count = groups[group]
+            entries.append(("header", str(current), int(count)))
+            group += 1
+        if position == len(ordered):
+            break
+        page = ordered[position]
+        source, index = page if isinstance(page, (tuple, list)) else (0, page)
+        text = overlay(current) if overlay is not None and current else None
+        entries.append(("page", int(source), int(index), text))
+    return {"pipeline": pipeline, "sources": list(sources), "entries": entries, "font_path": font_path, "first": 0}
+
+
+def split_plan(plan: dict, parts: int) -> list[dict]:
+    """Split a plan into up to ``parts`` chunks, moving each cut to a nearby group header."""
+    entries = plan["entries"]
+    parts = max(1, min(parts, len(entries)))
+    headers = [i for i, entry in enumerate(entries) if entry[0] == "header"]
+    slack = len(entries) // parts // 2
+    cuts = []
+    for k in range(1, parts):
+        ideal = k * len(entries) // parts
+        nearest = bisect.bisect_left(headers, ideal)
+        candidates = [headers[i] for i in (nearest - 1, nearest) if 0 <= i < len(headers)]
+        cut = min(candidates, key=lambda i: abs(i - ideal), default=ideal)
+        if abs(cut - ideal) > slack:
+            cut = ideal
+        if 0 < cut < len(entries) and (not cuts or cut > cuts[-1]):
+            cuts.append(cut)
+    bounds = [0, *cuts, len(entries)]
+    return [
+        {**plan, "entries": entries[start:end], "first": plan.get("first", 0) + start}
+        for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+class _Tiles:
+    """Rasterised group headers and article overlays of one rendering, by (kind, text, size, DPI)."""
+
+    def __init__(self):
+        self.items = {}
+        self.rendered = 0
+        self.reused = 0
+
+    def get(self, key, render):
+        tile = self.items.get(key)
+        if tile is None:
+            tile = self.items[key] = render()
+            self.rendered += 1
+        else:
+            self.reused += 1
+        return tile
+
+
+def _raster(page, scale: float):
+    """1-bit raster of a page: a bool array, True where the printer burns a dot."""
+    import fitz  # PyMuPDF
+    import numpy as np
+
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return gray < _BLACK_LEVEL
+
+
+def _render_blank(width: float, height: float, draw, scale: float):
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    try:
+        page = doc.new_page(width=width, height=height)
+        draw(page)
+        return _raster(page, scale)
+    finally:
+        doc.close()
+
+
+def _header_writer(plan: dict):
+    if plan["pipeline"] == "ozon":
+        from utils.create_ozon_pdf import _write_group_header
+
+        return lambda page, article, count: _write_group_header(page, article, count, plan["font_path"])
+    from utils.create_pdf import write_group_header
+
+    return write_group_header
+
+
+def _paste(bits, tile, x: int, y: int) -> None:
+    """OR ``tile`` into ``bits`` at (x, y), clipped to the label."""
+    height, width = bits.shape
+    top, left = max(0, y), max(0, x)
+    bottom, right = min(height, y + tile.shape[0]), min(width, x + tile.shape[1])
+    if top < bottom and left < right:
+        bits[top:bottom, left:right] |= tile[top - y:bottom - y, left - x:right - x]
+
+
+def _overlay_article(bits, page, text: str, scale: float, tiles: _Tiles) -> None:
+    from utils.create_pdf import write_article
+    from utils.fonts import use_font
+
+    def draw(tile_page):
+        use_font(tile_page)
+        write_article(tile_page, tile_page.rect, text)
+
+    if "Артикул:" in page.get_text():
+        return
+    for inst in page.search_for("WB"):
+        # Белый прямоугольник на месте метки и артикул в расширенной на 1 пт области, как в PDF
+        bits[round(inst.y0 * scale):round(inst.y1 * scale), round(inst.x0 * scale):round(inst.x1 * scale)] = False
+        area = inst + (-1, -1, 1, 1)
+        key = ("overlay", text, round(area.width, 1), round(area.height, 1), scale)
+        tile = tiles.get(key, lambda: _render_blank(area.width, area.height, draw, scale))
+        _paste(bits, tile, round(area.x0 * scale), round(area.y0 * scale))
+
+
+def _rotated_page_raster(src, index: int, text: str | None, scale: float):
+    """Повёрнутая страница: артикул рисуется на копии страницы, как в PDF, без кэша."""
+    import fitz  # PyMuPDF
+
+    from utils.create_pdf import write_article
+    from utils.fonts import use_font
+
+    doc = fitz.open()
+    try:
+        doc.insert_pdf(src, from_page=index, to_page=index)
+        page = doc[0]
+        instances = page.search_for("WB") if text and "Артикул:" not in page.get_text() else []
+        if instances:
+            use_font(page)
+        for inst in instances:
+            page.draw_rect(inst, color=(1, 1, 1), fill=(1, 1, 1))
+            write_article(page, inst + (-1, -1, 1, 1), text)
+        return _raster(page, scale)
+    finally:
+        doc.close()
+
+
+class _ZplWriter:
+    def __init__(self, path: str, dpi: int, first: int):
+        self.fh = open(path, "wb")
+
+    def write(self, bits) -> None:
+        import numpy as np
+
+        height, width = bits.shape
+        packed = np.packbits(bits, axis=1)
+        data = base64.b64encode(zlib.compress(packed.tobytes()))
+        # Z64: base64 от zlib и CRC-16/XMODEM закодированной строки
+        self.fh.write(
+            b"^XA^PW%d^LL%d^FO0,0^GFA,%d,%d,%d,:Z64:%s:%04x^FS^XZ\n"
+            % (width, height, packed.size, packed.size, packed.shape[1], data, binascii.crc_hqx(data, 0))
+        )
+
+    def close(self) -> None:
+        self.fh.close()
+
+
+class _PbmWriter(_ZplWriter):
+    def write(self, bits) -> None:
+        import numpy as np
+
+        height, width = bits.shape
+        self.fh.write(b"P4\n%d %d\n" % (width, height) + np.packbits(bits, axis=1).tobytes())
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+def _png(bits, dpi: int) -> bytes:
+    import numpy as np
+
+    height, width = bits.shape
+    # Серый 1 бит: 0 — чёрный; каждая строка начинается с байта фильтра 0
+    rows = np.packbits(~bits, axis=1)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows]).tobytes()
+    per_meter = round(dpi / 0.0254)
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0)),
+        _png_chunk(b"pHYs", struct.pack(">IIB", per_meter, per_meter, 1)),
+        _png_chunk(b"IDAT", zlib.compress(raw, 9)),
+        _png_chunk(b"IEND", b""),
+    ))
+
+
+class _PngWriter:
+    def __init__(self, path: str, dpi: int, first: int):
+        # PNG уже сжаты: повторное сжатие только тратит процессор
+        self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED)
+        self.dpi = dpi
+        self.number = first
+
+    def write(self, bits) -> None:
+        self.number += 1
+        self.archive.writestr(f"{self.number:05d}.png", _png(bits, self.dpi))
+
+    def close(self) -> None:
+        self.archive.close()
+
+
+_WRITERS = {"zpl": _ZplWriter, "pbm": _PbmWriter, "png": _PngWriter}
+
+
+def render_labels(plan: dict, output_format: str, dpi: int, output: str, cancel: CancelToken = NEVER) -> dict:
+    """Rasterise the labels of ``plan`` into ``output``; return the label and tile counts."""
+    import fitz  # PyMuPDF
+
+    scale = dpi / 72
+    tiles = _Tiles()
+    write_header = _header_writer(plan)
+    srcs = [fitz.open(source) for source in plan["sources"]]
+    writer = _WRITERS[output_format](output, dpi, plan.get("first", 0))
+    try:
+        size = srcs[0][0].rect
+        with stage("render", pipeline=plan["pipeline"]):
+            for entry in plan["entries"]:
+                cancel.check()
+                if entry[0] == "header":
+                    _, article, count = entry
+                    bits = tiles.get(
+                        ("header", article, count, scale),
+                        lambda: _render_blank(size.width, size.height, lambda page: write_header(page, article, count), scale),
+                    )
+                else:
+                    _, source, index, text = entry
+                    page = srcs[source][index]
+                    if page.rotation:
+                        bits = _rotated_page_raster(srcs[source], index, text, scale)
+                    else:
+                        bits = _raster(page, scale)
+                        if text:
+                            _overlay_article(bits, page, text, scale, tiles)
+                writer.write(bits)
+    finally:
+        writer.close()
+        for src in srcs:
+            src.close()
+    return {"labels": len(plan["entries"]), "tiles_rendered": tiles.rendered, "tiles_reused": tiles.reused}
+
+
+def join_parts(parts: list[str], output_format: str, output: str) -> None:
+    """Concatenate the outputs of plan chunks, in order, into ``output``."""
+    if output_format != "png":
+        with open(output, "wb") as dst:
+            for part in parts:
+                with open(part, "rb") as src:
+                    shutil.copyfileobj(src, dst)
+        return
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as dst:
+        for part in parts:
+            with zipfile.ZipFile(part) as src:
+                for name in src.namelist():
+                    dst.writestr(name, src.read(name))
+
+
+async def render_on_pool(pool, plan: dict, output_format: str, dpi: int, output: str, key, parts: int, trace=None) -> dict:
+    """Render ``plan`` in up to ``parts`` chunks on ``pool`` (keys ``(key, n)``) and join them into ``output``."""
+    chunks = split_plan(plan, parts)
+    paths = [f"{output}.part{n}" for n in range(len(chunks))]
+    try:
+        results = await asyncio.gather(
+            *(
+                pool.run("labels", {"plan": chunk, "format": output_format, "dpi": dpi}, path, key=(key, n), trace=trace)
+                for n, (chunk, path) in enumerate(zip(chunks, paths))
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        await asyncio.to_thread(join_parts, paths, output_format, output)
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    stages: dict[str, float] = {}
+    for result in results:
+        for name, seconds in result["stages"].items():
+            stages[name] = round(stages.get(name, 0.0) + seconds, 4)
+    return {
+        "labels": sum(result["labels"] for result in results),
+        "tiles_rendered": sum(result["tiles_rendered"] for result in results),
+        "tiles_reused": sum(result["tiles_reused"] for result in results),
+        "peak_rss_mb": max(result.get("peak_rss_mb", 0.0) for result in results),
+        "stages": stages,
+    }
@@ -0,0 +1,173 @@
+"""Lightweight distributed tracing written to a local OTLP/JSON file.
+
+One trace follows a job from the first update of the flow to the uploaded
+document: update handling, FSM writes, downloads, database sessions, the
+queue wait, every pipeline stage in the pool process and the final
+``send_document``. The trace context is a ``[trace_id, span_id]`` pair; it is
+kept in the FSM data for the duration of a flow, stored in the job payload
+and passed to pool processes with the job, so all processes add spans to the
+same trace.
+
+Spans are appended to ``TRACE_FILE`` one ``ExportTraceServiceRequest`` per
+line (the OTLP/JSON file format), which the OpenTelemetry Collector reads with
+its ``otlpjsonfile`` receiver; no network or collector is needed to record.
+Without ``TRACE_FILE`` nothing is recorded and ``span`` is a no-op.
+
+Only ``start_trace`` and spans with an explicit ``parent`` create spans outside
+a trace; ``span`` inside code that is not traced (the worker polling the
+queue, for instance) records nothing.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from config import TRACE_FILE, TRACE_SERVICE
+
+TraceContext = list  # [trace_id, span_id]
+
+_current: contextvars.ContextVar[TraceContext | None] = contextvars.ContextVar("trace_context", default=None)
+_lock = threading.Lock()
+_fd: int | None = None
+
+enabled = bool(TRACE_FILE)
+
+
+def current_context() -> TraceContext | None:
+    """Context of the active span, to be stored in FSM data or a job payload."""
+    return _current.get()
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _write(record: dict) -> None:
+    global _fd
+    line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+    with _lock:
+        if _fd is None:
+            os.makedirs(os.path.dirname(os.path.abspath(TRACE_FILE)), exist_ok=True)
+            _fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        # Одна запись на строку: с O_APPEND строки разных процессов не перемешиваются
+        os.write(_fd, line)
+
+
+def _export(
+    name: str,
+    context: TraceContext,
+    parent_span_id: str | None,
+    start_ns: int,
+    end_ns: int,
+    attributes: dict,
+    error: str | None = None,
+) -> None:
+    span = {
+        "traceId": context[0],
+        "spanId": context[1],
+        "name": name,
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(end_ns),
+        "attributes": [_attribute(key, value) for key, value in attributes.items() if value is not None],
+        "status": {"code": 2, "message": error} if error else {"code": 1},
+    }
+    if parent_span_id:
+        span["parentSpanId"] = parent_span_id
+    _write({
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                _attribute("service.name", TRACE_SERVICE),
+                _attribute("process.pid", os.getpid()),
+            ]},
+            "scopeSpans": [{"scope": {"name": "wb_stickers"}, "spans": [span]}],
+        }]
+    })
+
+
+def record_span(name: str, parent: TraceContext | None, start_ns: int, end_ns: int, **attributes) -> None:
+    """Write a span with known start and end (e.g. the time a job spent in the queue)."""
+    if not enabled or parent is None:
+        return
+    _export(name, [parent[0], secrets.token_hex(8)], parent[1], start_ns, end_ns, attributes)
+
+
+class Span:
+    """An open span; ``end`` writes it. Used where start and end are in different callbacks."""
+
+    def __init__(self, name: str, parent: TraceContext | None, attributes: dict | None = None):
+        self.name = name
+        self.parent = parent
+        self.context: TraceContext = [parent[0] if parent else secrets.token_hex(16), secrets.token_hex(8)]
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self._token = None
+
+    def activate(self) -> None:
+        self._token = _current.set(self.context)
+
+    def end(self, error: str | None = None) -> None:
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+        parent_span_id = self.parent[1] if self.parent else None
+        _export(self.name, self.context, parent_span_id, self.start_ns, time.time_ns(), self.attributes, error)
+
+
+def start_trace(name: str, parent: TraceContext | None = None, **attributes) -> Span | None:
+    """Open and activate a span that may start a new trace; None when tracing is off."""
+    if not enabled:
+        return None
+    opened = Span(name, parent, attributes)
+    opened.activate()
+    return opened
+
+
+@contextmanager
+def span(name: str, parent: TraceContext | None = None, **attributes):
+    """Child span of ``parent`` or of the active span; no-op outside a trace."""
+    if not enabled:
+        yield
+        return
+    parent = parent or _current.get()
+    if parent is None:
+        yield
+        return
+    opened = Span(name, parent, attributes)
+    opened.activate()
+    try:
+        yield opened
+    except BaseException as exc:
+        opened.end(f"{type(exc).__name__}: {exc}")
+        raise
+    else:
+        opened.end()
+
+
+class StageSpans:
+    """Stage observer turning pipeline stages into spans of the active trace."""
+
+    def __call__(self, name: str, labels: dict):
+        return span(f"stage.{name}", **labels)
+
+
+@contextmanager
+def activated(context: TraceContext | None):
+    """Make ``context`` the active trace context inside the block (pool processes)."""
+    token = _current.set(context)
+    try:
+        yield
+    finally:
+        _current.reset(token)
@@ -0,0 +1,76 @@
+"""Warm-up of bot and worker processes before they take work.
+
+The first job after a deploy used to pay for importing pandas and PyMuPDF,
+reading the font from disk and PyMuPDF's first-use initialisation. Pool
+processes now do all of that at start-up: ``warm_up_pipelines`` imports the
+pipelines, loads the font into memory and runs a tiny synthetic WB job; the
+slot is handed jobs only after it reports ready (see ``utils.worker_pool``).
+The bot opens its database connections in ``warm_up_bot`` before polling or
+serving webhooks.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+_STICKERS = (("10000001 1234", "WARMUP-1"), ("10000002 5678", "WARMUP-1"), ("10000003 9012", "WARMUP-2"))
+
+
+def process_uptime() -> float:
+    """Seconds since this process was started (interpreter start-up included)."""
+    import psutil
+
+    return max(0.0, time.time() - psutil.Process().create_time())
+
+
+def _write_wb_inputs(directory: str) -> dict:
+    import fitz  # PyMuPDF
+    from openpyxl import Workbook
+
+    pdf_path = os.path.join(directory, "stickers.pdf")
+    doc = fitz.open()
+    for sticker, _ in reversed(_STICKERS):
+        page = doc.new_page(width=164, height=113)
+        page.insert_text((6, 70), "WB", fontsize=14)
+        page.insert_text((30, 100), sticker, fontsize=16)
+    doc.save(pdf_path)
+    doc.close()
+
+    excel_path = os.path.join(directory, "pick_list.xlsx")
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["Лист подбора"])
+    sheet.append(['Номер задания', 'Фото', 'Бренд', 'Наименование', 'Размер', 'Цвет', 'Артикул', 'Стикер'])
+    for task_id, (sticker, article) in enumerate(_STICKERS, start=1):
+        sheet.append([task_id, "", "", article, "", "", article, sticker])
+    workbook.save(excel_path)
+    return {"excel": excel_path, "pdf": pdf_path}
+
+
+def warm_up_pipelines() -> float:
+    """Import the pipelines, load fonts and run a synthetic job; return the seconds spent."""
+    started = time.perf_counter()
+    from utils.fonts import font_buffer
+    from utils.pipelines import run_job
+
+    font_buffer()
+    with tempfile.TemporaryDirectory(prefix="wb_stickers_warmup_") as directory:
+        result = run_job("wb", _write_wb_inputs(directory), os.path.join(directory, "result.pdf"))
+    if result["pages"] != len(_STICKERS):
+        logger.warning("Тестовая задача прогрева обработала %s страниц из %s", result["pages"], len(_STICKERS))
+    return time.perf_counter() - started
+
+
+async def warm_up_bot() -> None:
+    """Open database connections so the first update does not wait for them."""
+    from sqlalchemy import text
+
+    from database.setup import engine
+
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
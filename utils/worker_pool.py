@@ -0,0 +1,366 @@
+"""Pool of long-lived processes running the PDF pipelines.
+
+PyMuPDF and pandas work is CPU-bound and blocking, so it never runs on the
+event loop. Each slot of the pool is a separate process connected by a pipe;
+the parent waits for the answer with ``loop.add_reader`` and does not block.
+
+A running job can be cancelled: the slot's cancel event is set so the pipeline
+stops at its next check, the slot is immediately replaced by a fresh process
+and the old one is killed if it has not stopped within the grace period.
+
+Pipeline stage timings measured in the child are sent back with every answer
+and recorded in the parent's metrics.
+
+A fresh process first warms up (``utils.warmup``) and reports ready; a slot
+gets its first job only after that, so a newly started or replaced process
+never makes a job wait for imports and fonts.
+
+Processes are bounded in memory: the address space is capped with
+``RLIMIT_AS`` (``WORKER_MEMORY_LIMIT_MB``), so a malformed or huge upload gets
+a MemoryError and a "file too large" answer (``JobTooLarge``) instead of
+taking the host down; MuPDF's store is emptied after every job. A process
+that has run ``WORKER_MAX_JOBS`` jobs, whose RSS has grown by more than
+``WORKER_MAX_RSS_GROWTH_MB`` since warm-up or that ran out of memory exits
+after answering and the slot is given a fresh one.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import resource
+import signal
+import sys
+import time
+from contextlib import contextmanager
+
+from config import WORKER_MAX_JOBS, WORKER_MAX_RSS_GROWTH_MB, WORKER_MEMORY_LIMIT_MB, WORKER_WARMUP
+from utils import metrics
+from utils.cancellation import CancelToken, JobCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCrashed(Exception):
+    """The process died before answering; the job may be retried."""
+
+
+class JobFailed(Exception):
+    """The pipeline raised an error while processing the job."""
+
+
+class JobTooLarge(JobFailed):
+    """The job ran out of the process memory limit: the file is too large or too complex."""
+
+
+class _StageTimings:
+    """Stage observer of a pool process: collects (stage, labels, seconds) of the current job."""
+
+    def __init__(self):
+        self.items: list[tuple[str, dict, float]] = []
+
+    @contextmanager
+    def __call__(self, name: str, labels: dict):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.items.append((name, labels, time.perf_counter() - started))
+
+    def take(self) -> list[tuple[str, dict, float]]:
+        items, self.items = self.items, []
+        return items
+
+
+def _limit_memory() -> None:
+    """Cap the process address space, so a runaway job gets MemoryError instead of the OOM killer."""
+    if WORKER_MEMORY_LIMIT_MB <= 0:
+        return
+    limit = WORKER_MEMORY_LIMIT_MB * 2**20
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as exc:
+        logger.warning("Не удалось ограничить память процесса обработки: %s", exc)
+
+
+def _release_memory() -> None:
+    """Empty MuPDF's store of decoded images and fonts between jobs."""
+    import fitz  # PyMuPDF
+
+    fitz.TOOLS.store_shrink(100)
+
+
+def _out_of_memory(exc: Exception) -> bool:
+    """The job failed for lack of memory (Python or MuPDF allocation) or hit a MuPDF limit."""
+    if isinstance(exc, MemoryError) or type(exc).__name__ == "FzErrorLimit":
+        return True
+    message = str(exc).lower()
+    if "out of memory" in message or ("malloc" in message and "failed" in message):
+        return True
+    # zlib внутри MuPDF: "deflateInit failed: -4" — Z_MEM_ERROR
+    return "init failed: -4" in message
+
+
+def _answer(conn, message: tuple) -> bool:
+    """Send a message to the parent; False if the pool has been closed meanwhile."""
+    try:
+        conn.send(message)
+    except (BrokenPipeError, OSError):
+        return False
+    return True
+
+
+def _child_main(conn, cancel_event) -> None:
+    # Остановкой процессов управляет родитель, Ctrl+C не должен обрывать задачу
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _limit_memory()
+    from utils import tracing
+    from utils.memory import rss_bytes
+    from utils.pipelines import run_job
+    from utils.stages import add_observer
+
+    cancel = CancelToken(cancel_event)
+    timings = _StageTimings()
+    add_observer(timings)
+    if tracing.enabled:
+        add_observer(tracing.StageSpans())
+    try:
+        warmup = 0.0
+        if WORKER_WARMUP:
+            from utils.warmup import warm_up_pipelines
+
+            warmup = warm_up_pipelines()
+            _release_memory()
+        ready = ("ready", warmup, timings.take(), None)
+    except Exception as exc:
+        logger.exception("Не удалось прогреть процесс обработки")
+        ready = ("warmup_failed", f"{type(exc).__name__}: {exc}", timings.take(), None)
+    if not _answer(conn, ready):
+        return
+    baseline_rss = rss_bytes()
+    jobs = 0
+    while True:
+        try:
+            kind, inputs, output, profile, trace = conn.recv()
+        except EOFError:
+            return
+        jobs += 1
+        recycle = None
+        try:
+            with tracing.activated(trace), tracing.span("pipeline", pipeline=kind, pid=os.getpid()):
+                if profile:
+                    from utils.profiling import profiled
+
+                    with profiled(output):
+                        result = run_job(kind, inputs, output, cancel=cancel)
+                else:
+                    result = run_job(kind, inputs, output, cancel=cancel)
+            answer = ("ok", result, timings.take())
+        except JobCancelled:
+            answer = ("cancelled", None, timings.take())
+        except Exception as exc:
+            if _out_of_memory(exc):
+                logger.warning("Задаче %s не хватило памяти: %s: %s", kind, type(exc).__name__, exc)
+                answer = ("too_large", f"{type(exc).__name__}: {exc}", timings.take())
+                # После нехватки памяти состояние кучи и хранилища MuPDF ненадёжно
+                recycle = "memory_error"
+            else:
+                logger.exception("Ошибка в задаче %s", kind)
+                answer = ("error", f"{type(exc).__name__}: {exc}", timings.take())
+        try:
+            _release_memory()
+        except Exception:
+            logger.exception("Не удалось освободить память MuPDF")
+        if recycle is None and WORKER_MAX_JOBS and jobs >= WORKER_MAX_JOBS:
+            recycle = "jobs"
+        elif recycle is None and WORKER_MAX_RSS_GROWTH_MB and rss_bytes() - baseline_rss > WORKER_MAX_RSS_GROWTH_MB * 2**20:
+            recycle = "rss"
+        if not _answer(conn, (*answer, recycle)) or recycle is not None:
+            return
+
+
+def _record_timings(timings) -> dict[str, float]:
+    """Record stage timings of a job in the metrics; return seconds per stage."""
+    stages: dict[str, float] = {}
+    for name, labels, seconds in timings:
+        metrics.STAGE_SECONDS.observe(seconds, stage=name, **labels)
+        stages[name] = round(stages.get(name, 0.0) + seconds, 4)
+    return stages
+
+
+@contextmanager
+def _main_module_hidden():
+    """Keep spawned processes from re-importing the parent's ``__main__``.
+
+    ``spawn`` runs the parent's main script (``main.py``: aiogram, handlers, the
+    bot) in every child as ``__mp_main__``. Pool processes need none of it, only
+    ``utils.worker_pool``; without ``__file__`` the main module is not re-run.
+    """
+    main = sys.modules["__main__"]
+    path = getattr(main, "__file__", None)
+    if path is None or getattr(main, "__spec__", None) is not None:
+        yield
+        return
+    del main.__file__
+    try:
+        yield
+    finally:
+        main.__file__ = path
+
+
+class _Slot:
+    def __init__(self, ctx):
+        self.cancel_event = ctx.Event()
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_child_main, args=(child_conn, self.cancel_event), daemon=True)
+        with _main_module_hidden():
+            self.process.start()
+        child_conn.close()
+        self.waiter: asyncio.Future | None = None
+        self.grace = 0.0  # Сколько ждать процесс после запроса отмены
+        self.ready = False  # Процесс прогрет и ответил "ready"
+
+    def close(self) -> None:
+        self.conn.close()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+
+
+class ProcessPool:
+    def __init__(self, size: int):
+        self.size = size
+        self._ctx = mp.get_context("spawn")
+        self._idle: asyncio.Queue[_Slot] | None = None
+        self._slots: list[_Slot] = []
+        self._busy: dict[object, _Slot] = {}
+
+    def start(self) -> None:
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            slot = _Slot(self._ctx)
+            self._slots.append(slot)
+            self._idle.put_nowait(slot)
+        metrics.POOL_SIZE.set(self.size)
+        metrics.POOL_BUSY.set(0)
+
+    async def wait_ready(self) -> None:
+        """Wait until every process of the pool has warmed up."""
+        await asyncio.gather(*(self._wait_ready(slot) for slot in list(self._slots)), return_exceptions=True)
+
+    async def _wait_ready(self, slot: _Slot) -> None:
+        if slot.ready:
+            return
+        status, value, _, _ = await self._receive(slot)
+        slot.ready = True
+        if status == "ready":
+            metrics.WORKER_WARMUP_SECONDS.observe(value)
+        else:
+            logger.warning("Процесс %s начал работу без прогрева: %s", slot.process.pid, value)
+
+    def _replace(self, slot: _Slot) -> _Slot:
+        fresh = _Slot(self._ctx)
+        self._slots[self._slots.index(slot)] = fresh
+        return fresh
+
+    async def _receive(self, slot: _Slot):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        slot.waiter = future
+        fd = slot.conn.fileno()
+
+        def on_readable():
+            if future.done():
+                return
+            try:
+                future.set_result(slot.conn.recv())
+            except (EOFError, OSError) as exc:
+                future.set_exception(WorkerCrashed(f"process exited with code {slot.process.exitcode}: {exc!r}"))
+
+        loop.add_reader(fd, on_readable)
+        try:
+            return await future
+        finally:
+            loop.remove_reader(fd)
+            slot.waiter = None
+
+    async def run(
+        self,
+        kind: str,
+        inputs: dict,
+        output: str,
+        key: object = None,
+        profile: bool = False,
+        trace: list | None = None,
+    ) -> dict:
+        """Run one job in a free process and return the pipeline result.
+
+        The result gains ``stages``: seconds spent in every pipeline stage.
+
+        ``key`` identifies the job for ``cancel``. With ``profile`` the job is
+        profiled and the report is written next to ``output``; ``trace`` is the
+        trace context the pipeline spans are attached to.
+        """
+        slot = await self._idle.get()
+        slot.cancel_event.clear()
+        if key is not None:
+            self._busy[key] = slot
+        metrics.POOL_BUSY.inc()
+        try:
+            await self._wait_ready(slot)
+            slot.conn.send((kind, inputs, output, profile, trace))
+            status, value, timings, recycle = await self._receive(slot)
+            if recycle is not None:
+                # Процесс завершается сам после ответа, вместо него запускается новый
+                metrics.WORKER_RECYCLED.inc(reason=recycle)
+                old, slot = slot, self._replace(slot)
+                asyncio.get_running_loop().run_in_executor(None, old.close)
+        except (WorkerCrashed, BrokenPipeError, OSError) as exc:
+            slot.close()
+            slot = self._replace(slot)
+            raise exc if isinstance(exc, WorkerCrashed) else WorkerCrashed(str(exc))
+        except (JobCancelled, asyncio.CancelledError):
+            # Слот освобождается сразу: старый процесс дорабатывает отмену в фоне
+            old, slot = slot, self._replace(slot)
+            asyncio.ensure_future(self._retire(old))
+            raise
+        finally:
+            metrics.POOL_BUSY.dec()
+            self._busy.pop(key, None)
+            self._idle.put_nowait(slot)
+
+        stages = _record_timings(timings)
+        if status == "cancelled":
+            raise JobCancelled()
+        if status == "too_large":
+            raise JobTooLarge(value)
+        if status == "error":
+            raise JobFailed(value)
+        return {**value, "stages": stages}
+
+    def cancel(self, key: object, grace: float) -> bool:
+        """Ask the job's process to stop; kill it if it ignores the request for ``grace`` seconds."""
+        slot = self._busy.get(key)
+        if slot is None:
+            return False
+        slot.cancel_event.set()
+        slot.grace = grace
+        if slot.waiter is not None and not slot.waiter.done():
+            slot.waiter.set_exception(JobCancelled())
+        return True
+
+    async def _retire(self, slot: _Slot) -> None:
+        loop = asyncio.get_running_loop()
+        answered = await loop.run_in_executor(None, slot.conn.poll, slot.grace)
+        if not answered and slot.process.is_alive():
+            logger.warning("Процесс %s не остановился за %.0f с, завершаем принудительно", slot.process.pid, slot.grace)
+            slot.process.kill()
+        await loop.run_in_executor(None, slot.close)
+
+    def close(self) -> None:
+        for slot in self._slots:
+            slot.close()
+        self._slots.clear()
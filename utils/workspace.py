@@ -0,0 +1,52 @@
+"""Paths inside the shared job workspace."""
+
+from __future__ import annotations
+
+import os
+import secrets
+import shutil
+
+from config import JOB_WORKSPACE
+
+
+def user_dir(user_id: int | str) -> str:
+    """Return (and create) the directory holding a user's uploads."""
+    path = os.path.join(JOB_WORKSPACE, "users", str(user_id))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def new_user_file(user_id: int | str, name: str) -> str:
+    """Return a fresh, collision-free path for an upload of ``user_id``."""
+    return os.path.join(user_dir(user_id), f"{secrets.token_hex(4)}_{name}")
+
+
+def job_dir(job_id: int) -> str:
+    """Return (and create) the output directory of a job."""
+    path = os.path.join(JOB_WORKSPACE, "jobs", str(job_id))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def in_workspace(path: str) -> bool:
+    return os.path.realpath(path).startswith(os.path.realpath(JOB_WORKSPACE) + os.sep)
+
+
+def wb_pdf_inputs(inputs: dict) -> list[str]:
+    """Sticker PDFs of a WB job in upload order: ``pdf``, ``pdf_2``, ``pdf_3``..."""
+    keys = [key for key in inputs if key == "pdf" or (key.startswith("pdf_") and key[4:].isdigit())]
+    return [inputs[key] for key in sorted(keys, key=lambda key: int(key[4:] or 1))]
+
+
+def safe_remove(path: str | None) -> None:
+    """Delete a file of the workspace; others (files of a local Bot API server) are not ours."""
+    if path and in_workspace(path) and os.path.exists(path):
+        os.remove(path)
+
+
+def remove_job_files(job_id: int | None, payload: dict) -> None:
+    """Delete a job's uploads and its output directory."""
+    for path in payload.get("inputs", {}).values():
+        safe_remove(path)
+    if job_id is not None:
+        shutil.rmtree(os.path.join(JOB_WORKSPACE, "jobs", str(job_id)), ignore_errors=True)
@@ -0,0 +1,300 @@
+"""Webhook entry point with pre-forked worker processes.
+
+The parent process binds the listening socket and forks ``WEBHOOK_WORKERS``
+children that all accept connections on it. Whichever child receives an update
+forwards it to the shard queue of the child owning the chat
+(``chat_id % WEBHOOK_WORKERS``), so updates of one chat are always handled by
+the same process and in arrival order. Shutdown on SIGTERM/SIGINT has two
+phases so that no forwarded update is lost: first every child stops accepting
+and flushes what it forwarded to other shards; once all of them have, the
+parent lets the children drain their shards and finish in-flight handlers.
+
+    python webhook.py serve                         # без регистрации вебхука
+    python webhook.py replay updates.jsonl --url http://127.0.0.1:8080/webhook
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+
+from aiohttp import ClientSession, web
+
+from config import (
+    WEBHOOK_DRAIN_TIMEOUT,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WEBHOOK_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def shard_key(update: dict) -> int:
+    """Return the chat id (or user id as a fallback) an update belongs to."""
+    for kind, payload in update.items():
+        if kind == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return int(chat["id"])
+        sender = payload.get("from") or payload.get("user")
+        if sender and "id" in sender:
+            return int(sender["id"])
+    return 0
+
+
+class _ChatSerializer:
+    """Runs updates concurrently across chats but strictly in order within a chat."""
+
+    def __init__(self, dispatcher):
+        self._dp = dispatcher
+        self._tails: dict[int, asyncio.Task] = {}
+
+    def submit(self, chat_id: int, update: dict) -> asyncio.Task:
+        previous = self._tails.get(chat_id)
+        task = asyncio.ensure_future(self._run(previous, update))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._forget(chat_id, t))
+        return task
+
+    def _forget(self, chat_id: int, task: asyncio.Task) -> None:
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    async def _run(self, previous: asyncio.Task | None, update: dict) -> None:
+        from aiogram import types
+
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self._dp.process_update(types.Update(**update))
+        except Exception:
+            logger.exception("Ошибка при обработке обновления %s", update.get("update_id"))
+
+    @property
+    def pending(self) -> list[asyncio.Task]:
+        return list(self._tails.values())
+
+
+def _pump_shard(shard: mp.Queue, loop: asyncio.AbstractEventLoop, inbox: asyncio.Queue, stop: threading.Event) -> None:
+    """Move updates from the cross-process shard queue into the worker's event loop."""
+    while not stop.is_set():
+        try:
+            update = shard.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        loop.call_soon_threadsafe(inbox.put_nowait, update)
+
+
+async def _serve_worker(
+    index: int, sock: socket.socket, shards: list[mp.Queue], closed: mp.Event, drain: mp.Event
+) -> None:
+    from aiogram import Bot, Dispatcher
+
+    from main import on_shutdown, on_startup
+    from bot_setup import bot, dp
+
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+
+    if index == 0:
+        if WEBHOOK_URL:
+            await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, drop_pending_updates=True)
+        await on_startup(dp)
+    else:
+        from utils.janitor import start_janitor
+        from utils.job_queue import start_profiling_refresh
+        from utils.logs import start_rate_refresh
+        from utils.warmup import warm_up_bot
+
+        await warm_up_bot()
+        start_rate_refresh()
+        start_profiling_refresh()
+        # У каждого воркера своё MemoryStorage; при FSM_STORAGE=db проходы безопасно пересекаются
+        start_janitor(dp.storage)
+
+    loop = asyncio.get_running_loop()
+    inbox: asyncio.Queue = asyncio.Queue()
+    serializer = _ChatSerializer(dp)
+    stop_pump = threading.Event()
+    pump = threading.Thread(target=_pump_shard, args=(shards[index], loop, inbox, stop_pump), daemon=True)
+    pump.start()
+
+    async def receive(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        update = await request.json()
+        owner = shard_key(update) % len(shards)
+        if owner == index:
+            inbox.put_nowait(update)
+        else:
+            shards[owner].put(update)
+        return web.Response()
+
+    async def consume() -> None:
+        while True:
+            update = await inbox.get()
+            serializer.submit(shard_key(update), update)
+            inbox.task_done()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receive)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.SockSite(runner, sock)
+    await site.start()
+    consumer = asyncio.ensure_future(consume())
+    logger.info("Воркер %s принимает обновления на %s", index, WEBHOOK_PATH)
+
+    stopping = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
+
+    # Остановка, фаза 1: перестаём принимать (cleanup дожидается начатых запросов)
+    # и проталкиваем в каналы всё, что переслали в чужие шарды
+    logger.info("Воркер %s останавливается, дочитываем очередь", index)
+    await runner.cleanup()
+    for owner, shard in enumerate(shards):
+        if owner != index:
+            shard.close()
+            await loop.run_in_executor(None, shard.join_thread)
+    closed.set()
+
+    # Фаза 2: когда все воркеры перестали принимать, в свой шард больше ничего не придёт
+    await loop.run_in_executor(None, drain.wait, WEBHOOK_DRAIN_TIMEOUT)
+    deadline = time.monotonic() + WEBHOOK_DRAIN_TIMEOUT
+    stop_pump.set()
+    await loop.run_in_executor(None, pump.join)
+    await asyncio.sleep(0)  # Обновление, взятое потоком последним, встаёт в inbox раньше остальных
+    while True:
+        try:
+            inbox.put_nowait(shards[index].get_nowait())
+        except queue.Empty:
+            break
+    try:
+        await asyncio.wait_for(inbox.join(), max(0.0, deadline - time.monotonic()))
+        if serializer.pending:
+            await asyncio.wait(serializer.pending, timeout=max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        pass
+    if not inbox.empty() or serializer.pending:
+        logger.warning(
+            "Воркер %s не успел обработать обновлений: %s в очереди, %s чатов в работе",
+            index, inbox.qsize(), len(serializer.pending),
+        )
+    consumer.cancel()
+    if index == 0:
+        await on_shutdown(dp)
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+    await bot.close()
+
+
+def _worker_main(index: int, sock: socket.socket, shards: list[mp.Queue], closed: mp.Event, drain: mp.Event) -> None:
+    from utils.logs import setup_logging
+
+    setup_logging()
+    asyncio.run(_serve_worker(index, sock, shards, closed, drain))
+
+
+def serve(workers: int = WEBHOOK_WORKERS, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+    """Bind the port, fork the workers and supervise them until shutdown."""
+    # Хендлеры регистрируются до fork, чтобы воркеры не импортировали их повторно
+    import main  # noqa: F401
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.setblocking(False)
+
+    ctx = mp.get_context("fork")
+    shards = [ctx.Queue() for _ in range(workers)]
+    closed = [ctx.Event() for _ in range(workers)]  # Воркер перестал принимать и переслал всё принятое
+    drain = ctx.Event()  # Все воркеры перестали принимать: можно дочитывать шарды
+    processes = [
+        ctx.Process(target=_worker_main, args=(i, sock, shards, closed[i], drain), name=f"webhook-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info("Вебхук слушает %s:%s, воркеров: %s", host, port, workers)
+
+    stopping = threading.Event()
+
+    def forward(signum, _frame):
+        stopping.set()
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+
+    while not stopping.is_set() and all(process.is_alive() for process in processes):
+        stopping.wait(1.0)
+    if not stopping.is_set():
+        logger.error("Один из воркеров вебхука завершился, останавливаем остальные")
+        forward(signal.SIGTERM, None)
+
+    # Шарды дочитываются только после того, как ни один воркер больше не перешлёт в них обновление
+    deadline = time.monotonic() + WEBHOOK_DRAIN_TIMEOUT
+    for process, event in zip(processes, closed):
+        while process.is_alive() and not event.wait(0.2) and time.monotonic() < deadline:
+            pass
+    drain.set()
+
+    for process in processes:
+        process.join(2 * WEBHOOK_DRAIN_TIMEOUT + 10)
+    for process in processes:
+        if process.is_alive():
+            process.kill()
+    sock.close()
+
+
+async def replay(path: str, url: str, secret: str | None = WEBHOOK_SECRET) -> None:
+    """POST recorded updates (one JSON object per line) to a running webhook."""
+    headers = {SECRET_HEADER: secret} if secret else {}
+    async with ClientSession() as session:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if not line.strip():
+                    continue
+                async with session.post(url, json=json.loads(line), headers=headers) as response:
+                    logger.info("update -> %s", response.status)
+
+
+if __name__ == "__main__":
+    from utils.logs import setup_logging
+
+    setup_logging()
+    parser = argparse.ArgumentParser(description="Вебхук бота с несколькими воркерами.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_cmd = sub.add_parser("serve", help="Запустить вебхук.")
+    serve_cmd.add_argument("--workers", type=int, default=WEBHOOK_WORKERS)
+    serve_cmd.add_argument("--port", type=int, default=WEBHOOK_PORT)
+    replay_cmd = sub.add_parser("replay", help="Отправить записанные обновления на вебхук.")
+    replay_cmd.add_argument("path")
+    replay_cmd.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(workers=args.workers, port=args.port)
+    else:
+        asyncio.run(replay(args.path, args.url))
@@ -0,0 +1,39 @@
+"""Standalone processing worker.
+
+Runs next to the bot or on other machines sharing the database and
+``JOB_WORKSPACE``; start as many as needed:
+
+    python worker.py
+"""
+
+import asyncio
+import signal
+
+from config import METRICS_HOST, WORKER_METRICS_PORT
+from database.setup import init_db
+from utils.job_worker import JobWorker
+from utils.logs import setup_logging, start_rate_refresh
+from utils.metrics import STARTUP_SECONDS, start_metrics_server
+from utils.warmup import process_uptime
+
+
+async def main():
+    await init_db()
+    start_rate_refresh()
+    runner = await start_metrics_server(WORKER_METRICS_PORT, METRICS_HOST) if WORKER_METRICS_PORT else None
+    worker = JobWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        task = await worker.start()
+        STARTUP_SECONDS.set(process_uptime(), process="worker")
+        await task
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    asyncio.run(main())